@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+36247 Local Fingerprinting
+
+Compact chroma fingerprints computed locally with NumPy. There are no
+network calls and no chromaprint dependency; ffmpeg is used only to
+decode audio.
+
+Each track is decoded to 11 kHz mono (first two minutes), framed, and
+turned into a 12-bin chroma sequence. Every frame becomes a 24-bit
+sub-fingerprint:
+  - 12 bits: did each pitch class get louder than in the previous frame
+  - 12 bits: is each pitch class louder than its neighbour
+Re-encodes, different bitrates and small trims keep most bits, so two
+fingerprints are compared by bit error rate at the best alignment.
+
+Fingerprints are stored per track id as <id>.npy (uint32) in a directory,
+so each file is only ever fingerprinted once. FingerprintIndex keeps an
+inverted index of sub-fingerprints. It finds candidate pairs without
+comparing every track against every other, and confirms them by bit
+error rate.
+
+Usage:
+    python fingerprint.py build   ../metadata/metadata_base.json --workers 8
+    python fingerprint.py dupes   ../metadata/metadata_base.json
+    python fingerprint.py match   ../metadata/metadata_base.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_RATE = 11025
+MAX_SECONDS = 120
+FRAME_SIZE = 4096
+HOP_SIZE = 1024
+MIN_FREQ = 55.0
+MAX_FREQ = 3520.0
+BITS_PER_FRAME = 24
+
+DEFAULT_FINGERPRINT_DIR = Path(__file__).resolve().parent.parent / 'metadata' / 'fingerprints'
+DUPLICATE_SIMILARITY = 0.95
+NEAR_DUPLICATE_SIMILARITY = 0.75
+MAX_OFFSET_FRAMES = 40
+MIN_SHARED_FRACTION = 0.05
+COMMON_HASH_FRACTION = 0.05
+
+
+def decode_audio(path: Path = None, data: bytes = None) -> np.ndarray:
+    """Decode a file (or in-memory bytes) to mono float32 PCM via ffmpeg."""
+    source = ['-nostdin', '-i', str(path)] if data is None else ['-i', 'pipe:0']
+    cmd = [
+        'ffmpeg', '-v', 'error', *source,
+        '-t', str(MAX_SECONDS), '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-f', 's16le', 'pipe:1'
+    ]
+    proc = subprocess.run(cmd, input=data, capture_output=True, check=True)
+    return np.frombuffer(proc.stdout, dtype='<i2').astype(np.float32) / 32768.0
+
+
+def _chroma_matrix() -> tuple:
+    """FFT-bin -> pitch-class projection for FRAME_SIZE at SAMPLE_RATE."""
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / SAMPLE_RATE)
+    valid = np.flatnonzero((freqs >= MIN_FREQ) & (freqs <= MAX_FREQ))
+    pitch_class = np.round(12 * np.log2(freqs[valid] / 440.0)).astype(int) % 12
+    matrix = np.zeros((len(valid), 12), dtype=np.float32)
+    matrix[np.arange(len(valid)), pitch_class] = 1.0
+    return valid, matrix
+
+
+_VALID_BINS, _CHROMA_MATRIX = _chroma_matrix()
+_WINDOW = np.hanning(FRAME_SIZE).astype(np.float32)
+_BIT_WEIGHTS = (1 << np.arange(BITS_PER_FRAME, dtype=np.uint32)).astype(np.uint32)
+
+
+def chroma(samples: np.ndarray) -> np.ndarray:
+    """(frames, 12) L2-normalized chroma, fully vectorized."""
+    if len(samples) < FRAME_SIZE:
+        return np.zeros((0, 12), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    power = np.abs(np.fft.rfft(frames * _WINDOW, axis=1))[:, _VALID_BINS] ** 2
+    energy = power @ _CHROMA_MATRIX
+    norms = np.linalg.norm(energy, axis=1, keepdims=True)
+    return energy / np.maximum(norms, 1e-9)
+
+
+def fingerprint_samples(samples: np.ndarray) -> np.ndarray:
+    """24-bit sub-fingerprint per frame, packed into uint32."""
+    c = chroma(samples)
+    if len(c) < 2:
+        return np.zeros(0, dtype=np.uint32)
+    temporal = c[1:] > c[:-1]
+    spectral = c[1:] > np.roll(c[1:], -1, axis=1)
+    bits = np.concatenate([temporal, spectral], axis=1).astype(np.uint32)
+    return bits @ _BIT_WEIGHTS
+
+
+def fingerprint_file(path: Path) -> np.ndarray:
+    return fingerprint_samples(decode_audio(path=path))
+
+
+def fingerprint_bytes(data: bytes) -> tuple:
+    """(duration_seconds, fingerprint) for in-memory audio."""
+    samples = decode_audio(data=data)
+    return len(samples) / SAMPLE_RATE, fingerprint_samples(samples)
+
+
+def popcount(values: np.ndarray) -> int:
+    return int(np.unpackbits(values.view(np.uint8)).sum())
+
+
+def similarity(a: np.ndarray, b: np.ndarray, max_offset: int = MAX_OFFSET_FRAMES) -> float:
+    """1 - bit error rate at the best alignment within max_offset frames."""
+    best = 0.0
+    for offset in range(-max_offset, max_offset + 1):
+        x = a[max(offset, 0):]
+        y = b[max(-offset, 0):]
+        n = min(len(x), len(y))
+        if n < 16:
+            continue
+        errors = popcount(np.bitwise_xor(x[:n], y[:n]))
+        best = max(best, 1.0 - errors / (n * BITS_PER_FRAME))
+    return best
+
+
+class FingerprintIndex:
+    """Fingerprints by track id plus an inverted sub-fingerprint index."""
+
+    def __init__(self, directory: Path = DEFAULT_FINGERPRINT_DIR):
+        self.directory = Path(directory)
+        self.fingerprints = {}
+        self.postings = {}
+
+    def path_for(self, track_id: str) -> Path:
+        return self.directory / f"{track_id}.npy"
+
+    def has(self, track_id: str) -> bool:
+        return self.path_for(track_id).exists()
+
+    def save(self, track_id: str, fp: np.ndarray):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        np.save(self.path_for(track_id), fp)
+
+    def load(self, track_ids=None) -> int:
+        """Load stored fingerprints (optionally only track_ids) and index them."""
+        paths = (self.path_for(t) for t in track_ids) if track_ids else self.directory.glob('*.npy')
+        for path in paths:
+            if path.exists():
+                self.add(path.stem, np.load(path))
+        return len(self.fingerprints)
+
+    def add(self, track_id: str, fp: np.ndarray):
+        self.fingerprints[track_id] = fp
+        for value in np.unique(fp):
+            self.postings.setdefault(int(value), []).append(track_id)
+
+    def candidates(self, track_id: str, within=None) -> dict:
+        """Other track ids sharing enough sub-fingerprints, with shared counts."""
+        fp = self.fingerprints[track_id]
+        common_limit = max(2, int(len(self.fingerprints) * COMMON_HASH_FRACTION))
+        shared = {}
+        for value in np.unique(fp):
+            ids = self.postings.get(int(value), ())
+            if len(ids) > common_limit:
+                continue  # silence and other ubiquitous frames
+            for other in ids:
+                if other != track_id and (within is None or other in within):
+                    shared[other] = shared.get(other, 0) + 1
+        threshold = max(1, int(len(np.unique(fp)) * MIN_SHARED_FRACTION))
+        return {other: count for other, count in shared.items() if count >= threshold}
+
+    def best_match(self, track_id: str, within=None, threshold: float = NEAR_DUPLICATE_SIMILARITY):
+        """(other_id, similarity) of the closest match above threshold, or None."""
+        best = None
+        for other in self.candidates(track_id, within):
+            score = similarity(self.fingerprints[track_id], self.fingerprints[other])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (other, score)
+        return best
+
+    def duplicate_pairs(self, threshold: float = NEAR_DUPLICATE_SIMILARITY) -> list:
+        """All (a, b, similarity) pairs at or above threshold, a < b."""
+        pairs = []
+        for track_id in sorted(self.fingerprints):
+            for other in self.candidates(track_id):
+                if other <= track_id:
+                    continue
+                score = similarity(self.fingerprints[track_id], self.fingerprints[other])
+                if score >= threshold:
+                    pairs.append((track_id, other, score))
+        return sorted(pairs, key=lambda p: -p[2])
+
+
+def _fingerprint_worker(args: tuple) -> tuple:
+    track_id, path = args
+    try:
+        return track_id, fingerprint_file(Path(path)), None
+    except Exception as e:
+        return track_id, None, str(e)
+
+
+def build(tracks: dict, index: FingerprintIndex, workers: int = 1) -> tuple:
+    """Fingerprint every track with a readable original file and no stored print."""
+    jobs = [
+        (t['id'], t['original_path'])
+        for t in tracks.values()
+        if not index.has(t['id']) and Path(t.get('original_path', '')).exists()
+    ]
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        for track_id, fp, error in executor.map(_fingerprint_worker, jobs, chunksize=4):
+            if error:
+                print(f"  Error fingerprinting {track_id}: {error}", file=sys.stderr)
+                failed += 1
+                continue
+            index.save(track_id, fp)
+            done += 1
+            if done % 50 == 0:
+                print(f"  {done}/{len(jobs)} fingerprinted")
+    return done, failed, len(tracks) - len(jobs)
+
+
+def load_tracks(metadata_file: Path) -> dict:
+    """Tracks from metadata_base.json (or a metadata.sqlite3 store) keyed by id."""
+    if metadata_file.suffix == '.sqlite3':
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tools'))
+        import metadata_store
+        store = metadata_store.MetadataStore(metadata_file)
+        try:
+            return {t['id']: t for t in store.tracks().values()}
+        finally:
+            store.close()
+    with open(metadata_file) as f:
+        return {t['id']: t for t in json.load(f)['tracks'].values()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local audio fingerprinting for 36247')
+    parser.add_argument('command', choices=['build', 'dupes', 'match'])
+    parser.add_argument('metadata', type=Path, help='Path to metadata_base.json or metadata.sqlite3')
+    parser.add_argument('--dir', type=Path, default=DEFAULT_FINGERPRINT_DIR,
+                        help=f'Fingerprint store (default: {DEFAULT_FINGERPRINT_DIR})')
+    parser.add_argument('--workers', type=int, default=1, help='Fingerprinting processes (default: 1)')
+    parser.add_argument('--threshold', type=float, default=NEAR_DUPLICATE_SIMILARITY,
+                        help=f'Minimum similarity (default: {NEAR_DUPLICATE_SIMILARITY})')
+    args = parser.parse_args()
+
+    tracks = load_tracks(args.metadata)
+    index = FingerprintIndex(args.dir)
+
+    if args.command == 'build':
+        done, failed, skipped = build(tracks, index, args.workers)
+        print(f"Fingerprinted {done}, failed {failed}, skipped {skipped} (stored or missing file)")
+        return 0 if failed == 0 else 1
+
+    print(f"Loaded {index.load(tracks)} fingerprint(s)")
+
+    if args.command == 'dupes':
+        for a, b, score in index.duplicate_pairs(args.threshold):
+            kind = 'duplicate' if score >= DUPLICATE_SIMILARITY else 'near-duplicate'
+            print(f"{score:.3f} {kind}: {tracks[a].get('original_filename')} <-> {tracks[b].get('original_filename')}")
+        return 0
+
+    tagged = {t for t in index.fingerprints if tracks[t].get('tagged')}
+    for track_id in sorted(set(index.fingerprints) - tagged):
+        match = index.best_match(track_id, within=tagged, threshold=args.threshold)
+        if match:
+            other = tracks[match[0]]
+            print(f"{match[1]:.3f} {tracks[track_id].get('original_filename')} -> "
+                  f"{other.get('artist')} - {other.get('title')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
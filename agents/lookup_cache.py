@@ -0,0 +1,136 @@
+"""
+36247 Lookup Cache
+
+On-disk SQLite cache for external metadata queries (MusicBrainz).
+
+- Keys are normalized queries, so "Three 6 Mafia" and " three  6 mafia"
+  share an entry.
+- Found results and "no results" are both cached, with separate TTLs.
+  Errors are never cached.
+- The cache is bounded: least recently used entries are evicted past
+  max_entries.
+- Hit/miss counters are kept for the end-of-run report.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+DEFAULT_CACHE_PATH = Path(os.environ.get(
+    'MB_CACHE_PATH', Path.home() / '.cache' / '36247' / 'musicbrainz.sqlite3'
+))
+POSITIVE_TTL_SECONDS = 30 * 24 * 3600
+NEGATIVE_TTL_SECONDS = 3 * 24 * 3600
+MAX_ENTRIES = 50000
+
+# Sentinel for "not in cache" (None/{} are valid cached values)
+MISS = object()
+
+
+def normalize_query(*parts) -> str:
+    """Case-, accent- and whitespace-insensitive cache key."""
+    normalized = []
+    for part in parts:
+        text = unicodedata.normalize('NFKD', str(part or ''))
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+        normalized.append(re.sub(r'\s+', ' ', text).strip().lower())
+    return '|'.join(normalized)
+
+
+class LookupCache:
+    """SQLite-backed TTL + LRU cache, safe to share between threads."""
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, max_entries: int = MAX_ENTRIES,
+                 positive_ttl: int = POSITIVE_TTL_SECONDS, negative_ttl: int = NEGATIVE_TTL_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS lookups (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                found INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS lookups_last_used ON lookups (last_used)')
+        self.db.commit()
+
+    def get(self, key: str):
+        """Cached value for key, or MISS."""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                'SELECT value, found, expires_at FROM lookups WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return MISS
+            value, found, expires_at = row
+            if expires_at < now:
+                self.db.execute('DELETE FROM lookups WHERE key = ?', (key,))
+                self.db.commit()
+                self.expired += 1
+                self.misses += 1
+                return MISS
+            self.db.execute('UPDATE lookups SET last_used = ? WHERE key = ?', (now, key))
+            self.db.commit()
+            if found:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return json.loads(value)
+
+    def put(self, key: str, value: dict):
+        """Store a result; an empty dict is cached as a negative result."""
+        now = time.time()
+        found = bool(value)
+        ttl = self.positive_ttl if found else self.negative_ttl
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO lookups (key, value, found, expires_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps(value or {}), int(found), now + ttl, now)
+            )
+            self.db.commit()
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones past max_entries."""
+        with self.lock:
+            removed = self.db.execute('DELETE FROM lookups WHERE expires_at < ?', (time.time(),)).rowcount
+            count = self.db.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                removed += self.db.execute(
+                    'DELETE FROM lookups WHERE key IN '
+                    '(SELECT key FROM lookups ORDER BY last_used LIMIT ?)', (excess,)
+                ).rowcount
+            self.db.commit()
+            return removed
+
+    def report(self) -> str:
+        lookups = self.hits + self.negative_hits + self.misses
+        rate = (self.hits + self.negative_hits) / lookups if lookups else 0.0
+        return (f"Cache: {self.hits + self.negative_hits}/{lookups} hits ({rate:.0%}; "
+                f"{self.negative_hits} negative, {self.expired} expired) at {self.path}")
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.db.close()
@@ -7,17 +7,24 @@ using external music databases (MusicBrainz, Discogs).
 """
 
 import argparse
-import hashlib
-import io
-import json
+import asyncio
+import difflib
 import os
+import re
 import sys
 import time
 from datetime import datetime
+from pathlib import Path
 
-import boto3
-import musicbrainzngs
-from mutagen import File as MutagenFile
+import lookup_cache
+
+# Shared helpers live with the upload tools
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tools'))
+import manifest_log  # noqa: E402
+import metadata_store  # noqa: E402
+from core import get_client, lazy_import, metrics  # noqa: E402
+
+musicbrainzngs = lazy_import('musicbrainzngs')
 
 # Configuration
 AWS_PROFILE = os.environ.get('AWS_PROFILE', 'personal')
@@ -30,66 +37,125 @@ MB_APP_NAME = '36247-metadata-agent'
 MB_APP_VERSION = '1.0'
 MB_CONTACT = 'metadata@rmzi.world'
 
+# Alternate MusicBrainz server, e.g. a local fake for testing ("localhost:8080")
+MB_HOST = os.environ.get('MB_HOST')
+MB_HTTPS = os.environ.get('MB_HTTPS', '1') != '0'
+
 # Rate limiting for external APIs
-API_DELAY_SECONDS = 1.0
+API_RATE_PER_SECOND = 1.0
+MAX_IN_FLIGHT = 4
+DELTA_FLUSH_EVERY = 25
 
 
 def setup_musicbrainz():
-    """Configure MusicBrainz client."""
+    """
+    Configure MusicBrainz client.
+
+    musicbrainzngs' own limiter serializes every call behind a lock; it is
+    turned off because run_lookups paces requests with a token bucket.
+    """
     musicbrainzngs.set_useragent(MB_APP_NAME, MB_APP_VERSION, MB_CONTACT)
+    musicbrainzngs.set_rate_limit(False)
+    if MB_HOST:
+        musicbrainzngs.set_hostname(MB_HOST, use_https=MB_HTTPS)
 
 
 def get_s3_client():
     """Get boto3 S3 client using the configured profile."""
-    session = boto3.Session(profile_name=AWS_PROFILE, region_name=AWS_REGION)
-    return session.client('s3')
+    return get_client('s3', AWS_PROFILE, AWS_REGION)
 
 
 def get_manifest(s3_client) -> dict:
-    """Fetch current manifest from S3."""
+    """Fetch current manifest from S3, including deltas not yet compacted."""
     try:
-        response = s3_client.get_object(Bucket=TRACKS_BUCKET, Key=MANIFEST_KEY)
-        return json.loads(response['Body'].read().decode('utf-8'))
-    except s3_client.exceptions.NoSuchKey:
-        return {
-            'version': 1,
-            'generated': datetime.utcnow().isoformat() + 'Z',
-            'tracks': []
-        }
+        manifest, _, pending = manifest_log.load_manifest(s3_client, TRACKS_BUCKET)
+        if pending:
+            print(f"Manifest has {len(pending)} pending delta(s)")
+        return manifest
     except Exception as e:
         print(f"Error fetching manifest: {e}", file=sys.stderr)
         sys.exit(1)
 
 
-def save_manifest(s3_client, manifest: dict):
-    """Save manifest to S3."""
-    manifest['generated'] = datetime.utcnow().isoformat() + 'Z'
-    body = json.dumps(manifest, indent=2)
+def write_delta(s3_client, updates: dict) -> int | None:
+    """Record per-track field updates ({track_id: fields}) as a manifest delta."""
+    ops = [{'op': 'update', 'id': track_id, 'fields': fields} for track_id, fields in updates.items()]
+    with metrics.timer('manifest_write'):
+        seq = manifest_log.append_delta(s3_client, TRACKS_BUCKET, ops, writer='metadata-agent.py')
+    print(f"Wrote manifest delta {seq} ({len(ops)} track(s))")
+    return seq
 
-    s3_client.put_object(
-        Bucket=TRACKS_BUCKET,
-        Key=MANIFEST_KEY,
-        Body=body.encode('utf-8'),
-        ContentType='application/json'
-    )
+
+def update_local_store(store: metadata_store.MetadataStore, track_id: str, fields: dict) -> bool:
+    """
+    Copy tag fixes into the local metadata store, so the next batch upload
+    publishes them instead of the stale local tags.
+    """
+    file_key, local = store.get_by_id(track_id)
+    if local is None:
+        return False
+    store.put(file_key, {**local, **fields})
+    return True
+
+
+def save_manifest(s3_client, updates: dict, compact: bool = True):
+    """Write any remaining updates as a delta, then fold the log into manifest.json."""
+    if updates:
+        write_delta(s3_client, updates)
+    if compact:
+        with metrics.timer('manifest_compact'):
+            manifest_log.compact(s3_client, TRACKS_BUCKET)
 
 
 def compute_acoustid_fingerprint(audio_data: bytes) -> tuple:
     """
-    Compute AcoustID fingerprint from audio data.
+    Compute a local chroma fingerprint from audio data.
+
+    Returns (duration_seconds, fingerprint). This is not an AcoustID
+    fingerprint. It is the local format from fingerprint.py, used to match
+    against the fingerprint store without any network access. Requires
+    numpy and ffmpeg; returns (None, None) if they are unavailable.
+    """
+    try:
+        import fingerprint
+        return fingerprint.fingerprint_bytes(audio_data)
+    except Exception as e:
+        print(f"  Fingerprinting unavailable: {e}", file=sys.stderr)
+        return None, None
+
+
+def match_fingerprints(tracks: list, manifest: dict, fingerprint_dir: Path) -> dict:
+    """
+    Match tracks against tagged tracks in the local fingerprint store.
 
-    Note: This requires chromaprint/fpcalc to be installed.
-    For simplicity, we'll skip fingerprinting and rely on text-based search.
+    Returns {track_id: result} in search_musicbrainz's result format, taken
+    from the matching tagged track, for every track with a confident match.
     """
-    # TODO: Implement AcoustID fingerprinting if needed
-    return None, None
+    import fingerprint
+
+    index = fingerprint.FingerprintIndex(fingerprint_dir)
+    by_id = {t['id']: t for t in manifest['tracks']}
+    index.load(list(by_id))
+    tagged = {t for t in index.fingerprints if by_id[t].get('tagged') and by_id[t].get('artist')}
+    print(f"Fingerprint store: {len(index.fingerprints)} track(s), {len(tagged)} tagged")
+
+    matches = {}
+    for track in tracks:
+        if track['id'] not in index.fingerprints:
+            continue
+        match = index.best_match(track['id'], within=tagged - {track['id']})
+        if match:
+            source = by_id[match[0]]
+            matches[track['id']] = {k: source[k] for k in ('artist', 'album', 'title', 'year') if source.get(k)}
+    return matches
 
 
 def search_musicbrainz(artist: str = None, title: str = None, album: str = None) -> dict:
     """
     Search MusicBrainz for track metadata.
 
-    Returns dict with artist, album, title, year if found.
+    Returns dict with artist, album, title, year if found, {} if nothing
+    matched, or None if the request failed (so errors are never cached).
     """
     result = {}
 
@@ -137,12 +203,112 @@ def search_musicbrainz(artist: str = None, title: str = None, album: str = None)
 
     except musicbrainzngs.WebServiceError as e:
         print(f"  MusicBrainz error: {e}", file=sys.stderr)
+        metrics.count('api_errors')
+        return None
     except Exception as e:
         print(f"  Unexpected error searching MusicBrainz: {e}", file=sys.stderr)
+        metrics.count('api_errors')
+        return None
+
+    return result
 
+
+def search_cache_key(artist: str = None, title: str = None) -> str | None:
+    """Normalized cache key for the query search_musicbrainz would send."""
+    if artist and title:
+        return lookup_cache.normalize_query('recording', artist, title)
+    if title:
+        return lookup_cache.normalize_query('recording', '', title)
+    return None
+
+
+def search_musicbrainz_release(artist: str, album: str) -> dict:
+    """
+    Look up a whole release (album/tape) and its tracklist.
+
+    Costs two requests: a release search, then the release with recordings.
+    Returns {'artist', 'album', 'year', 'titles'}, {} if nothing matched, or
+    None if a request failed.
+    """
+    try:
+        releases = musicbrainzngs.search_releases(artist=artist, release=album, limit=5)
+        if not releases.get('release-list'):
+            return {}
+
+        release_id = releases['release-list'][0]['id']
+        release = musicbrainzngs.get_release_by_id(
+            release_id, includes=['recordings', 'artist-credits']
+        )['release']
+
+    except musicbrainzngs.WebServiceError as e:
+        print(f"  MusicBrainz error: {e}", file=sys.stderr)
+        metrics.count('api_errors')
+        return None
+    except Exception as e:
+        print(f"  Unexpected error searching MusicBrainz: {e}", file=sys.stderr)
+        metrics.count('api_errors')
+        return None
+
+    result = {
+        'artist': release.get('artist-credit-phrase'),
+        'album': release.get('title'),
+        'titles': [
+            t['recording']['title']
+            for medium in release.get('medium-list', [])
+            for t in medium.get('track-list', [])
+            if t.get('recording', {}).get('title')
+        ],
+    }
+    if release.get('date'):
+        try:
+            result['year'] = int(release['date'][:4])
+        except ValueError:
+            pass
     return result
 
 
+def normalize_title(title: str) -> str:
+    """Loose title form for matching: no case, punctuation or (feat. ...) parts."""
+    title = re.sub(r'[\(\[].*?[\)\]]', ' ', (title or '').lower())
+    title = re.sub(r'\b(feat|ft)\.?\s.*$', ' ', title)
+    return ' '.join(re.sub(r'[^\w\s]', ' ', title).split())
+
+
+def match_release_title(title: str, titles: list, cutoff: float = 0.8) -> str | None:
+    """Closest release track title to `title`, or None below cutoff."""
+    if not title or not titles:
+        return None
+    normalized = {normalize_title(t): t for t in titles}
+    match = difflib.get_close_matches(normalize_title(title), list(normalized), n=1, cutoff=cutoff)
+    return normalized[match[0]] if match else None
+
+
+def group_by_release(plans: list, min_size: int = 2) -> tuple:
+    """
+    Group (track, plan) pairs by normalized artist + album.
+
+    Groups of at least min_size get one release-level lookup; everything
+    else (no artist/album, or alone on its album) is looked up per track.
+    Returns (groups, singles) where groups maps key -> [(track, plan), ...].
+    """
+    buckets = {}
+    singles = []
+    for track, plan in plans:
+        if plan['search_artist'] and plan['search_album']:
+            key = lookup_cache.normalize_query('release', plan['search_artist'], plan['search_album'])
+            buckets.setdefault(key, []).append((track, plan))
+        else:
+            singles.append((track, plan))
+
+    groups = {}
+    for key, members in buckets.items():
+        if len(members) >= min_size:
+            groups[key] = members
+        else:
+            singles.extend(members)
+    return groups, singles
+
+
 def guess_metadata_from_filename(filename: str) -> dict:
     """
     Attempt to extract artist/title from filename patterns.
@@ -185,42 +351,44 @@ def guess_metadata_from_filename(filename: str) -> dict:
     return result
 
 
-def process_untagged_track(track: dict, s3_client, dry_run: bool = False) -> dict:
+def plan_lookup(track: dict) -> dict:
     """
-    Process a single untagged track and attempt to find metadata.
+    Local work for one track: filename guesses and search terms.
 
-    Returns updated track dict with new metadata.
+    Returns a plan dict consumed by search_musicbrainz and apply_lookup.
     """
-    print(f"\nProcessing: {track.get('original_filename', track['id'])}")
-
-    updates = {}
-
-    # Start with filename-based guesses
     original_filename = track.get('original_filename', f"{track['id']}.mp3")
     filename_meta = guess_metadata_from_filename(original_filename)
 
+    # Use filename guesses if we have nothing
+    return {
+        'filename_meta': filename_meta,
+        'search_artist': track.get('artist') or filename_meta.get('artist'),
+        'search_title': track.get('title') or filename_meta.get('title'),
+        'search_album': track.get('album') or filename_meta.get('album'),
+    }
+
+
+def apply_lookup(track: dict, plan: dict, mb_result: dict, dry_run: bool = False) -> list:
+    """
+    Merge a MusicBrainz result (or the filename fallback) into track.
+
+    Only missing fields are filled. Returns the report lines so concurrent
+    lookups can print each track's block in one piece.
+    """
+    lines = [f"\nProcessing: {track.get('original_filename', track['id'])}"]
+    filename_meta = plan['filename_meta']
+    updates = {}
+
     # Get current metadata
     current_artist = track.get('artist')
     current_title = track.get('title')
-    current_album = track.get('album')
 
-    # Use filename guesses if we have nothing
-    search_artist = current_artist or filename_meta.get('artist')
-    search_title = current_title or filename_meta.get('title')
-
-    print(f"  Current: {current_artist or '???'} - {current_title or '???'}")
-    print(f"  Searching with: {search_artist or '???'} - {search_title or '???'}")
-
-    # Search MusicBrainz
-    time.sleep(API_DELAY_SECONDS)  # Rate limiting
-    mb_result = search_musicbrainz(
-        artist=search_artist,
-        title=search_title,
-        album=current_album
-    )
+    lines.append(f"  Current: {current_artist or '???'} - {current_title or '???'}")
+    lines.append(f"  Searching with: {plan['search_artist'] or '???'} - {plan['search_title'] or '???'}")
 
     if mb_result:
-        print(f"  MusicBrainz found: {mb_result.get('artist', '???')} - {mb_result.get('title', '???')}")
+        lines.append(f"  MusicBrainz found: {mb_result.get('artist', '???')} - {mb_result.get('title', '???')}")
 
         # Update only missing fields
         if not current_artist and mb_result.get('artist'):
@@ -236,7 +404,7 @@ def process_untagged_track(track: dict, s3_client, dry_run: bool = False) -> dic
             updates['year'] = mb_result['year']
 
     else:
-        print("  MusicBrainz: No results")
+        lines.append("  MusicBrainz: No results")
 
         # Fall back to filename metadata
         if not current_artist and filename_meta.get('artist'):
@@ -249,7 +417,7 @@ def process_untagged_track(track: dict, s3_client, dry_run: bool = False) -> dic
             updates['album'] = filename_meta['album']
 
     if updates:
-        print(f"  Updates: {updates}")
+        lines.append(f"  Updates: {updates}")
 
         if not dry_run:
             # Apply updates to track
@@ -261,9 +429,156 @@ def process_untagged_track(track: dict, s3_client, dry_run: bool = False) -> dic
             track['metadata_updated'] = datetime.utcnow().isoformat() + 'Z'
 
     else:
-        print("  No updates found")
+        lines.append("  No updates found")
+
+    return lines
 
-    return track
+
+class TokenBucket:
+    """
+    Asyncio token bucket: `rate` tokens per second, holding at most `burst`.
+
+    acquire() waits until a token is available, so callers can keep many
+    requests queued and the bucket releases them at exactly the allowed rate.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def run_lookups(tracks: list, s3_client, dry_run: bool = False, rate: float = API_RATE_PER_SECOND,
+                      concurrency: int = MAX_IN_FLIGHT, flush_every: int = DELTA_FLUSH_EVERY,
+                      cache: lookup_cache.LookupCache = None, local_matches: dict = None,
+                      store: metadata_store.MetadataStore = None) -> tuple:
+    """
+    Look up every track concurrently under a token-bucket rate limit.
+
+    The bucket, not a fixed sleep, paces requests, so up to `concurrency`
+    requests can be in flight while local work continues: planning the next
+    tracks, merging results and writing manifest deltas in the background.
+    Cache hits skip the bucket entirely, and tracks in local_matches (from
+    the fingerprint store) skip the network altogether. With a local
+    metadata store, each change is also upserted there as it lands.
+
+    Returns (updated_count, unflushed_updates, flushed_delta_count).
+    """
+    bucket = TokenBucket(rate)
+    in_flight = asyncio.Semaphore(concurrency)
+    pending_updates = {}
+    flushes = []
+    updated_count = 0
+
+    async def lookup(track: dict, plan: dict) -> list:
+        key = search_cache_key(plan['search_artist'], plan['search_title'])
+        if cache and key:
+            cached = cache.get(key)
+            if cached is not lookup_cache.MISS:
+                metrics.count('cache_hits')
+                return [(track, plan, cached)]
+
+        async with in_flight:
+            with metrics.timer('rate_limit_wait'):
+                await bucket.acquire()
+            with metrics.timer('api_lookup'):
+                mb_result = await asyncio.to_thread(
+                    search_musicbrainz,
+                    artist=plan['search_artist'],
+                    title=plan['search_title'],
+                    album=plan['search_album']
+                )
+            metrics.count('api_requests')
+        if cache and key and mb_result is not None:
+            cache.put(key, mb_result)
+        return [(track, plan, mb_result)]
+
+    async def lookup_release(key: str, members: list) -> list:
+        artist, album = members[0][1]['search_artist'], members[0][1]['search_album']
+        release = cache.get(key) if cache else lookup_cache.MISS
+        if release is lookup_cache.MISS:
+            async with in_flight:
+                with metrics.timer('rate_limit_wait'):
+                    await bucket.acquire()
+                    await bucket.acquire()  # search + tracklist
+                with metrics.timer('api_release_lookup'):
+                    release = await asyncio.to_thread(search_musicbrainz_release, artist, album)
+                metrics.count('api_requests', 2)
+            if cache and release is not None:
+                cache.put(key, release)
+        else:
+            metrics.count('cache_hits')
+
+        # Fan the release out to members whose title is on it; the rest
+        # fall back to their own recording lookup
+        results, unmatched = [], []
+        for track, plan in members:
+            title = match_release_title(plan['search_title'], (release or {}).get('titles'))
+            if title:
+                result = {k: release[k] for k in ('artist', 'album', 'year') if release.get(k)}
+                results.append((track, plan, {**result, 'title': title}))
+            else:
+                unmatched.append((track, plan))
+
+        for batch in await asyncio.gather(*(lookup(track, plan) for track, plan in unmatched)):
+            results.extend(batch)
+        return results
+
+    # Planning stage: group album-structured tracks so each release costs
+    # one lookup instead of one per track
+    local_matches = local_matches or {}
+    local = [(track, plan_lookup(track), local_matches[track['id']])
+             for track in tracks if track['id'] in local_matches]
+    groups, singles = group_by_release([
+        (track, plan_lookup(track)) for track in tracks if track['id'] not in local_matches
+    ])
+    grouped = sum(len(members) for members in groups.values())
+    print(f"Planned {len(groups)} release lookup(s) covering {grouped} track(s), "
+          f"{len(singles)} single lookup(s), {len(local)} fingerprint match(es)")
+    metrics.count('fingerprint_matches', len(local))
+
+    async def resolved(results: list) -> list:
+        return results
+
+    tasks = [asyncio.create_task(resolved(local))]
+    tasks += [asyncio.create_task(lookup_release(key, members)) for key, members in groups.items()]
+    tasks += [asyncio.create_task(lookup(track, plan)) for track, plan in singles]
+    for done in asyncio.as_completed(tasks):
+        for track, plan, mb_result in await done:
+            before = dict(track)
+            original_tagged = track.get('tagged', False)
+            print('\n'.join(apply_lookup(track, plan, mb_result, dry_run)))
+
+            if track.get('tagged') != original_tagged or track.get('metadata_updated'):
+                updated_count += 1
+                metrics.count('tracks_updated')
+
+            changed = {k: v for k, v in track.items() if before.get(k) != v}
+            if changed:
+                pending_updates[track['id']] = changed
+                if store and not dry_run:
+                    update_local_store(store, track['id'], changed)
+
+            # Write results as they accumulate without pausing lookups
+            if not dry_run and len(pending_updates) >= flush_every:
+                batch, pending_updates = pending_updates, {}
+                flushes.append(asyncio.create_task(asyncio.to_thread(write_delta, s3_client, batch)))
+
+    await asyncio.gather(*flushes)
+    return updated_count, pending_updates, len(flushes)
 
 
 def main():
@@ -286,6 +601,45 @@ def main():
         default=0,
         help='Limit number of tracks to process (0 = no limit)'
     )
+    parser.add_argument(
+        '--no-compact',
+        action='store_true',
+        help='Only append a manifest delta; leave compaction to tools/manifest_log.py'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=API_RATE_PER_SECOND,
+        help=f'MusicBrainz requests per second (default: {API_RATE_PER_SECOND})'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=MAX_IN_FLIGHT,
+        help=f'Maximum MusicBrainz requests in flight (default: {MAX_IN_FLIGHT})'
+    )
+    parser.add_argument(
+        '--cache-path',
+        type=Path,
+        default=lookup_cache.DEFAULT_CACHE_PATH,
+        help=f'Lookup cache database (default: {lookup_cache.DEFAULT_CACHE_PATH})'
+    )
+    parser.add_argument(
+        '--fingerprints',
+        type=Path,
+        help='Fingerprint store (see fingerprint.py); untagged tracks that match '
+             'a tagged track are filled from it without any network lookup'
+    )
+    parser.add_argument(
+        '--metadata-db',
+        type=Path,
+        help='Local metadata store (tools/metadata_store.py) to write tag fixes into as well'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always query MusicBrainz, bypassing the lookup cache'
+    )
     parser.add_argument(
         '--bucket',
         default=TRACKS_BUCKET,
@@ -296,11 +650,17 @@ def main():
         default=AWS_PROFILE,
         help=f'AWS profile (default: {AWS_PROFILE})'
     )
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
+    with metrics.instrument('metadata_agent', args.metrics, args.cprofile):
+        return run(args)
 
-    # Update globals from args
+
+def run(args) -> int:
     global TRACKS_BUCKET, AWS_PROFILE
+
+    # Update globals from args
     TRACKS_BUCKET = args.bucket
     AWS_PROFILE = args.profile
 
@@ -334,17 +694,35 @@ def main():
         return 0
 
     # Process tracks
-    updated_count = 0
-    for track in tracks_to_process:
-        original_tagged = track.get('tagged', False)
-        process_untagged_track(track, s3_client, args.dry_run)
+    cache = None if args.no_cache else lookup_cache.LookupCache(args.cache_path)
+    local_matches = None
+    if args.fingerprints:
+        local_matches = match_fingerprints(tracks_to_process, manifest, args.fingerprints)
 
-        if track.get('tagged') != original_tagged or track.get('metadata_updated'):
-            updated_count += 1
+    store = metadata_store.MetadataStore(args.metadata_db) if args.metadata_db else None
+
+    started = time.monotonic()
+    try:
+        updated_count, updates, flushed = asyncio.run(run_lookups(
+            tracks_to_process, s3_client, args.dry_run,
+            rate=args.rate, concurrency=args.concurrency, cache=cache,
+            local_matches=local_matches, store=store
+        ))
+    finally:
+        if cache:
+            cache.close()
+        if store:
+            store.touch()
+            store.close()
+    elapsed = time.monotonic() - started
+    print(f"\nLooked up {len(tracks_to_process)} track(s) in {elapsed:.1f}s "
+          f"({len(tracks_to_process) / max(elapsed, 1e-6):.2f}/s)")
+    if cache:
+        print(cache.report())
 
     # Save updated manifest
-    if updated_count > 0 and not args.dry_run:
-        save_manifest(s3_client, manifest)
+    if (updates or flushed) and not args.dry_run:
+        save_manifest(s3_client, updates, not args.no_compact)
         print(f"\nUpdated {updated_count} track(s)")
     elif args.dry_run and updated_count > 0:
         print(f"\nWould update {updated_count} track(s)")
@@ -143,6 +143,31 @@ resource "aws_cloudfront_distribution" "main" {
     max_ttl     = 300
   }
 
+  # Search index behavior: Tracks bucket (requires signed cookies), published
+  # next to manifest.json and rebuilt with it
+  ordered_cache_behavior {
+    path_pattern               = "/search-index.json"
+    allowed_methods            = ["GET", "HEAD", "OPTIONS"]
+    cached_methods             = ["GET", "HEAD"]
+    target_origin_id           = "tracks"
+    viewer_protocol_policy     = "redirect-to-https"
+    compress                   = false  # Stored gzip-encoded
+    trusted_key_groups         = [aws_cloudfront_key_group.signing.id]
+    response_headers_policy_id = aws_cloudfront_response_headers_policy.security.id
+
+    forwarded_values {
+      query_string = false
+      headers      = ["Origin"]
+      cookies {
+        forward = "all"
+      }
+    }
+
+    min_ttl     = 0
+    default_ttl = 60     # Same as manifest.json, so the two stay in step
+    max_ttl     = 300
+  }
+
   # Artwork behavior: Tracks bucket (requires signed cookies)
   ordered_cache_behavior {
     path_pattern               = "/artwork/*"
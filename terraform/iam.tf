@@ -35,6 +35,29 @@ resource "aws_iam_role_policy" "upload" {
         ]
         Resource = "${aws_s3_bucket.tracks.arn}/audio/*"
       },
+      {
+        # upload.py checks whether a track is already in the bucket (head_object)
+        Sid    = "ReadAudio"
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject"
+        ]
+        Resource = "${aws_s3_bucket.tracks.arn}/audio/*"
+      },
+      {
+        # upload.py --stream: multipart upload to incoming/, then copy and delete
+        # (the lifecycle rule in s3-tracks.tf cleans up interrupted runs)
+        Sid    = "StreamIncoming"
+        Effect = "Allow"
+        Action = [
+          "s3:PutObject",
+          "s3:GetObject",
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload",
+          "s3:ListMultipartUploadParts"
+        ]
+        Resource = "${aws_s3_bucket.tracks.arn}/incoming/*"
+      },
       {
         Sid    = "ManageManifest"
         Effect = "Allow"
@@ -42,7 +65,47 @@ resource "aws_iam_role_policy" "upload" {
           "s3:GetObject",
           "s3:PutObject"
         ]
-        Resource = "${aws_s3_bucket.tracks.arn}/manifest.json"
+        Resource = [
+          "${aws_s3_bucket.tracks.arn}/manifest.json",
+          "${aws_s3_bucket.tracks.arn}/manifest.min.json*",
+          "${aws_s3_bucket.tracks.arn}/manifest.columnar.json*",
+          "${aws_s3_bucket.tracks.arn}/manifest.index.json",
+          "${aws_s3_bucket.tracks.arn}/manifest/shards/*",
+          "${aws_s3_bucket.tracks.arn}/search-index.json"
+        ]
+      },
+      {
+        # Delta log (tools/manifest_log.py): append, read, prune after compaction
+        Sid    = "ManifestDeltaLog"
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:DeleteObject"
+        ]
+        Resource = "${aws_s3_bucket.tracks.arn}/manifest.d/*"
+      },
+      {
+        # Shards no index references any more (manifest_writer.prune_shards)
+        Sid    = "PruneManifestShards"
+        Effect = "Allow"
+        Action = [
+          "s3:DeleteObject"
+        ]
+        Resource = "${aws_s3_bucket.tracks.arn}/manifest/shards/*"
+      },
+      {
+        Sid    = "ListManifestDeltas"
+        Effect = "Allow"
+        Action = [
+          "s3:ListBucket"
+        ]
+        Resource = aws_s3_bucket.tracks.arn
+        Condition = {
+          StringLike = {
+            "s3:prefix" = ["manifest.d/*", "manifest/shards/*"]
+          }
+        }
       },
       {
         Sid    = "GetSigningKey"
@@ -113,7 +176,34 @@ resource "aws_iam_role_policy" "metadata_agent" {
           "s3:GetObject",
           "s3:PutObject"
         ]
-        Resource = "${aws_s3_bucket.tracks.arn}/manifest.json"
+        Resource = [
+          "${aws_s3_bucket.tracks.arn}/manifest.json",
+          "${aws_s3_bucket.tracks.arn}/manifest.min.json*",
+          "${aws_s3_bucket.tracks.arn}/manifest.columnar.json*",
+          "${aws_s3_bucket.tracks.arn}/manifest.index.json",
+          "${aws_s3_bucket.tracks.arn}/manifest/shards/*",
+          "${aws_s3_bucket.tracks.arn}/search-index.json"
+        ]
+      },
+      {
+        # Delta log (tools/manifest_log.py): append, read, prune after compaction
+        Sid    = "ManifestDeltaLog"
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:DeleteObject"
+        ]
+        Resource = "${aws_s3_bucket.tracks.arn}/manifest.d/*"
+      },
+      {
+        # Shards no index references any more (manifest_writer.prune_shards)
+        Sid    = "PruneManifestShards"
+        Effect = "Allow"
+        Action = [
+          "s3:DeleteObject"
+        ]
+        Resource = "${aws_s3_bucket.tracks.arn}/manifest/shards/*"
       }
     ]
   })
@@ -24,6 +24,37 @@ resource "aws_s3_bucket_versioning" "tracks" {
   }
 }
 
+# Clean up after interrupted streaming uploads (tools/upload.py --stream):
+# incomplete multipart uploads and objects left in incoming/ by a crash
+# between complete and copy. Deleted temporary keys leave noncurrent
+# versions, which expire too.
+resource "aws_s3_bucket_lifecycle_configuration" "tracks" {
+  bucket = aws_s3_bucket.tracks.id
+
+  rule {
+    id     = "incoming-cleanup"
+    status = "Enabled"
+
+    filter {
+      prefix = "incoming/"
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+
+    expiration {
+      days = 2
+    }
+
+    noncurrent_version_expiration {
+      noncurrent_days = 1
+    }
+  }
+
+  depends_on = [aws_s3_bucket_versioning.tracks]
+}
+
 # CORS configuration for audio streaming
 resource "aws_s3_bucket_cors_configuration" "tracks" {
   bucket = aws_s3_bucket.tracks.id
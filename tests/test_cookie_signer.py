@@ -0,0 +1,106 @@
+"""
+Tests for tools/cookie_signer.py with the file secret provider standing in
+for Secrets Manager.
+
+    python -m unittest discover tests
+"""
+
+import base64
+import json
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tools'))
+import cookie_signer  # noqa: E402
+
+
+def cloudfront_b64decode(s: str) -> bytes:
+    return base64.b64decode(s.replace('-', '+').replace('_', '=').replace('~', '/'))
+
+
+class CookieSignerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.key_file = Path(cls.tmp.name) / 'key.json'
+        cookie_signer.keygen(cls.key_file, key_pair_id='KTEST')
+        cls.signer = cookie_signer.CookieSigner(cookie_signer.FileSecretProvider(cls.key_file))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def verify(self, cookies: dict) -> dict:
+        """Check the signature with the key's public half; return the policy."""
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        pem = json.loads(self.key_file.read_text())['private_key'].encode()
+        public_key = serialization.load_pem_private_key(pem, password=None).public_key()
+        policy = cloudfront_b64decode(cookies['CloudFront-Policy'])
+        signature = cloudfront_b64decode(cookies['CloudFront-Signature'])
+        public_key.verify(signature, policy, padding.PKCS1v15(), hashes.SHA1())  # raises if invalid
+        return json.loads(policy)
+
+    def test_file_provider_signature_verifies(self):
+        expires = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        cookies = self.signer.cookies('https://example.test/audio/*', expires)
+
+        self.assertEqual(cookies['CloudFront-Key-Pair-Id'], 'KTEST')
+        statement = self.verify(cookies)['Statement'][0]
+        self.assertEqual(statement['Resource'], 'https://example.test/audio/*')
+        self.assertEqual(statement['Condition']['DateLessThan']['AWS:EpochTime'], int(expires.timestamp()))
+
+    def test_batch_keeps_order(self):
+        now = datetime.now(timezone.utc)
+        requests = [(f"https://example.test/{i}/*", now + timedelta(hours=i + 1)) for i in range(5)]
+        results = self.signer.sign_batch(requests, workers=3)
+
+        self.assertEqual([r['resource'] for r in results], [r for r, _ in requests])
+        for result in results:
+            self.assertEqual(self.verify(result['cookies'])['Statement'][0]['Resource'], result['resource'])
+
+    def test_parse_requests_rejects_out_of_range_expiries(self):
+        now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        for item in ({'expires': 1e20}, {'hours': 1e12}, {'hours': float('inf')},
+                     {'hours': -1}, {'hours': 24 * 400}, {'expires': 0}):
+            with self.subTest(item=item), self.assertRaises(ValueError):
+                cookie_signer.parse_requests([item], now)
+
+        [(resource, expires)] = cookie_signer.parse_requests([{'hours': 6}], now)
+        self.assertEqual(resource, cookie_signer.DEFAULT_RESOURCE)
+        self.assertEqual(expires, now + timedelta(hours=6))
+
+    def test_service_answers_bad_expiry_with_400(self):
+        from http.server import ThreadingHTTPServer
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), cookie_signer.make_handler(self.signer, 1))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        def post(body: dict):
+            request = urllib.request.Request(
+                f"http://127.0.0.1:{server.server_address[1]}/sign",
+                data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'}
+            )
+            return urllib.request.urlopen(request, timeout=10)
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            post({'requests': [{'expires': 1e20}]})
+        self.assertEqual(error.exception.code, 400)
+
+        with post({'requests': [{'resource': 'https://example.test/*', 'hours': 1}]}) as response:
+            [result] = json.loads(response.read())['cookies']
+        self.verify(result['cookies'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+36247 Audio Analysis
+
+Decodes each track once (ffmpeg to 48 kHz float PCM, mono sources as mono,
+everything else as stereo) and computes, with NumPy:
+
+- integrated loudness (ITU-R BS.1770 / EBU R128 gating) and the gain that
+  brings the track to TARGET_LUFS without pushing its peak above
+  PEAK_CEILING_DB
+- silence trim points: the first and last 10 ms window above SILENCE_DB
+- a PEAK_COUNT-point waveform (max |sample| per bucket, 0-255)
+
+The PCM is read from ffmpeg in 10 s chunks and never held whole: each chunk
+is reduced to per-100 ms K-weighted energies, per-10 ms RMS and per-1 ms
+peaks, and the results come from those. The K-weighting filter is applied
+in the frequency domain: the chunk's 100 ms sub-blocks are FFT'd at once and
+their power spectra weighted by the filter's squared magnitude response.
+That gives each sub-block's filtered energy without a per-sample loop, and
+the 400 ms gating blocks (75% overlap) are sums of four sub-blocks.
+
+Results are written as a binary sidecar, metadata/analysis/<id>.bin
+(HEADER followed by the uint8 peaks). A track id is its content hash, so
+an existing sidecar of the current VERSION means the audio is unchanged and
+the track is skipped. The summary (loudness, gain, trim) is also recorded
+on each track in metadata. Tracks run in a process pool.
+
+Requires NumPy, and ffmpeg and ffprobe on PATH.
+"""
+
+import argparse
+import math
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from core import lazy_import
+
+np = lazy_import('numpy')
+
+ANALYSIS_DIR = 'analysis'
+SAMPLE_RATE = 48000
+TARGET_LUFS = -14.0
+PEAK_CEILING_DB = -1.0
+SILENCE_DB = -50.0
+SILENCE_WINDOW = 0.01  # seconds
+PEAK_COUNT = 1000
+PEAK_BLOCK = SAMPLE_RATE // 1000  # 1 ms; the waveform is bucketed from these
+READ_FRAMES = SAMPLE_RATE * 10  # PCM per read: whole sub-blocks, windows and peak blocks
+
+# magic, version, channels, peak count, LUFS, gain dB, peak dBFS, trim start s, trim end s
+HEADER = struct.Struct('<4sBBHfffff')
+MAGIC = b'36AN'
+VERSION = 2  # v1 counted dual-mono stereo as mono
+
+# BS.1770 K-weighting at 48 kHz: high shelf, then high pass (b, a)
+K_WEIGHTING = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)),
+)
+SUB_BLOCK = SAMPLE_RATE // 10  # 100 ms
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def sidecar_path(analysis_dir: Path, track_id: str) -> Path:
+    return analysis_dir / f"{track_id}.bin"
+
+
+def write_sidecar(path: Path, result: dict):
+    header = HEADER.pack(MAGIC, VERSION, result['channels'], len(result['peaks']),
+                         result['lufs'], result['gain'], result['peak_db'],
+                         result['start'], result['end'])
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(header + bytes(result['peaks']))
+    tmp.replace(path)
+
+
+def read_sidecar(path: Path) -> dict:
+    data = Path(path).read_bytes()
+    magic, version, channels, count, lufs, gain, peak_db, start, end = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a v{VERSION} analysis sidecar")
+    return {
+        'channels': channels, 'lufs': lufs, 'gain': gain, 'peak_db': peak_db,
+        'start': start, 'end': end, 'peaks': data[HEADER.size:HEADER.size + count],
+    }
+
+
+def load_sidecar(path: Path) -> dict | None:
+    """The sidecar's contents, or None if it is missing or from another version."""
+    try:
+        return read_sidecar(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def summary(result: dict) -> dict:
+    """The per-track fields recorded in metadata (JSON has no -inf)."""
+    return {
+        'lufs': round(result['lufs'], 2) if math.isfinite(result['lufs']) else None,
+        'gain': round(result['gain'], 2),
+        'start': round(result['start'], 2),
+        'end': round(result['end'], 2),
+    }
+
+
+def probe_channels(source: Path) -> int:
+    """Channel count of the first audio stream, as the container reports it."""
+    out = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=channels', '-of', 'csv=p=0', str(source),
+    ], check=True, capture_output=True, text=True).stdout
+    return int(out.split()[0])
+
+
+def k_weighting_power(n: int):
+    """|H(f)|^2 of the K-weighting filter at the rfft bins of an n-sample block."""
+    z = np.exp(-1j * np.pi * np.arange(n // 2 + 1) / (n / 2))
+    response = np.ones_like(z)
+    for b, a in K_WEIGHTING:
+        response *= (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    return np.abs(response) ** 2
+
+
+class Analysis:
+    """
+    Running state over a PCM stream, fed in chunks of whole frames.
+
+    Only small per-block summaries are kept: the K-weighted energy of each
+    100 ms sub-block, the RMS of each 10 ms window and the peak of each
+    1 ms block. A 45-minute track needs a few MB of them, against ~1 GB
+    for the decoded samples.
+    """
+
+    def __init__(self, channels: int):
+        self.channels = channels
+        self.weights = None
+        self.energy = []
+        self.rms = []
+        self.peaks = []
+
+    def feed(self, samples):
+        """samples: (frames, channels) float32. Partial blocks only at the end of the stream."""
+        blocks = len(samples) // SUB_BLOCK
+        if blocks:
+            if self.weights is None:
+                # Parseval over a real FFT: interior bins stand for two conjugate bins
+                bins = np.full(SUB_BLOCK // 2 + 1, 2.0)
+                bins[0] = bins[-1] = 1.0
+                self.weights = k_weighting_power(SUB_BLOCK) * bins
+            # (sub-blocks, channels, samples) -> filtered mean square, summed
+            # over channels (channel weights are 1 for L/R)
+            frames = samples[:blocks * SUB_BLOCK].reshape(blocks, SUB_BLOCK, -1).transpose(0, 2, 1)
+            spectrum = np.abs(np.fft.rfft(frames, axis=-1)) ** 2
+            self.energy.append((spectrum @ self.weights).sum(axis=1) / SUB_BLOCK ** 2)
+
+        window = int(SAMPLE_RATE * SILENCE_WINDOW)
+        count = len(samples) // window
+        if count:
+            mono = samples[:count * window].mean(axis=1, dtype=np.float64).reshape(count, window)
+            self.rms.append(np.sqrt((mono ** 2).mean(axis=1)))
+
+        # 1 ms peaks; a trailing partial block still counts
+        count = -(-len(samples) // PEAK_BLOCK)
+        if count:
+            flat = np.zeros(count * PEAK_BLOCK * self.channels, dtype=np.float32)
+            flat[:samples.size] = np.abs(samples).ravel()
+            self.peaks.append(flat.reshape(count, -1).max(axis=1))
+
+    def loudness(self) -> float:
+        """Gated integrated loudness in LUFS (-inf for digital silence)."""
+        energy = np.concatenate(self.energy) if self.energy else np.zeros(0)
+        if len(energy) < 4:
+            return float('-inf')
+        # 400 ms blocks, 100 ms hop = mean of four consecutive sub-blocks
+        block_energy = np.convolve(energy, np.full(4, 0.25), mode='valid')
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * np.log10(block_energy)
+        gated = block_energy[loudness > ABSOLUTE_GATE]
+        if not len(gated):
+            return float('-inf')
+        relative = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+        gated = block_energy[(loudness > ABSOLUTE_GATE) & (loudness > relative)]
+        return -0.691 + 10 * math.log10(gated.mean())
+
+    def trim_points(self) -> tuple:
+        """(start, end) seconds of the audible part, by 10 ms RMS windows."""
+        rms = np.concatenate(self.rms) if self.rms else np.zeros(0)
+        audible = np.flatnonzero(rms > 10 ** (SILENCE_DB / 20))
+        if not len(audible):
+            return 0.0, 0.0
+        return float(audible[0] * SILENCE_WINDOW), float((audible[-1] + 1) * SILENCE_WINDOW)
+
+    def peak(self) -> float:
+        return float(max(p.max() for p in self.peaks)) if self.peaks else 0.0
+
+    def waveform(self, count: int = PEAK_COUNT) -> bytes:
+        """count bucket peaks of |sample| across channels, scaled to 0-255."""
+        blocks = np.concatenate(self.peaks) if self.peaks else np.zeros(0, dtype=np.float32)
+        per_bucket = len(blocks) // count
+        if not per_bucket:
+            peaks = np.zeros(count, dtype=np.float32)
+            peaks[:len(blocks)] = blocks
+        else:
+            # The few leftover blocks join the last bucket
+            peaks = blocks[:per_bucket * count].reshape(count, per_bucket).max(axis=1)
+            if len(blocks) > per_bucket * count:
+                peaks[-1] = max(peaks[-1], blocks[per_bucket * count:].max())
+        return np.clip(np.round(peaks * 255), 0, 255).astype(np.uint8).tobytes()
+
+    def result(self) -> dict:
+        lufs = self.loudness()
+        peak = self.peak()
+        peak_db = 20 * math.log10(peak) if peak > 0 else -120.0
+        gain = min(TARGET_LUFS - lufs, PEAK_CEILING_DB - peak_db) if math.isfinite(lufs) else 0.0
+        start, end = self.trim_points()
+        return {
+            'channels': self.channels, 'lufs': lufs, 'gain': gain, 'peak_db': peak_db,
+            'start': start, 'end': end, 'peaks': self.waveform(),
+        }
+
+
+def analyze_stream(stream, channels: int) -> dict:
+    """Analyze interleaved float32 PCM at SAMPLE_RATE read from a binary stream."""
+    analysis = Analysis(channels)
+    chunk_bytes = READ_FRAMES * channels * 4
+    while True:
+        data = stream.read(chunk_bytes)  # full chunks until the last one
+        if not data:
+            break
+        analysis.feed(np.frombuffer(data, dtype='<f4').reshape(-1, channels))
+    return analysis.result()
+
+
+def analyze(source: Path) -> dict:
+    """
+    Decode with ffmpeg at SAMPLE_RATE and analyze the PCM as it arrives.
+    Mono sources stay mono (BS.1770 counts a mono channel once); anything
+    else is analyzed as stereo.
+    """
+    channels = 1 if probe_channels(source) == 1 else 2
+    cmd = [
+        'ffmpeg', '-nostdin', '-v', 'error', '-i', str(source),
+        '-map', '0:a:0', '-ac', str(channels), '-ar', str(SAMPLE_RATE), '-f', 'f32le', '-',
+    ]
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            result = analyze_stream(proc.stdout, channels)
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=errors.read())
+    return result
+
+
+def _analyze_worker(args: tuple) -> tuple:
+    """Process pool entry point. Returns (track_id, summary, error)."""
+    track_id, source, analysis_dir = args
+    try:
+        result = analyze(Path(source))
+        write_sidecar(sidecar_path(Path(analysis_dir), track_id), result)
+        return track_id, summary(result), None
+    except subprocess.CalledProcessError as e:
+        return track_id, None, e.stderr.decode(errors='replace').strip()[-200:]
+    except Exception as e:
+        return track_id, None, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute loudness, trim points and waveforms for every track')
+    parser.add_argument(
+        '--metadata-dir',
+        type=Path,
+        default=Path(__file__).parent.parent / 'metadata',
+        help='Directory containing metadata_base.json'
+    )
+    parser.add_argument('--workers', type=int, default=4, help='Analysis processes (default: 4)')
+    parser.add_argument('--limit', type=int, default=0, help='Only analyze the first N tracks (0 = all)')
+    parser.add_argument('--download', action='store_true',
+                        help='Download uploaded audio when the local original is gone')
+    args = parser.parse_args()
+
+    for tool in ('ffmpeg', 'ffprobe'):
+        if not shutil.which(tool):
+            print(f"Error: {tool} not found on PATH", file=sys.stderr)
+            return 1
+
+    import batch_upload
+    from transcode import fetch_source
+
+    metadata = batch_upload.load_metadata(args.metadata_dir)
+    analysis_dir = args.metadata_dir / ANALYSIS_DIR
+    analysis_dir.mkdir(parents=True, exist_ok=True)
+    by_id = {t['id']: t for t in metadata['tracks'].values()}
+
+    # Cached sidecars only need their summary copied onto the track
+    jobs = []
+    recorded = 0
+    for track in by_id.values():
+        cached = load_sidecar(sidecar_path(analysis_dir, track['id']))
+        if cached is None:
+            jobs.append(track)
+        elif track.get('analysis') is None:
+            track['analysis'] = summary(cached)
+            recorded += 1
+    if args.limit > 0:
+        jobs = jobs[:args.limit]
+    print(f"Tracks: {len(jobs)} to analyze, {len(by_id) - len(jobs)} cached")
+
+    s3_client = batch_upload.get_s3_client() if args.download else None
+    failed = 0
+    done = 0
+
+    def collect(future, source: Path):
+        nonlocal failed, done
+        track_id, result, error = future.result()
+        if source.parent == scratch_dir:
+            source.unlink(missing_ok=True)  # downloaded copy
+        if error:
+            print(f"  Error analyzing {track_id}: {error}", file=sys.stderr)
+            failed += 1
+            return
+        by_id[track_id]['analysis'] = result
+        done += 1
+        if done % 100 == 0:
+            print(f"  {done}/{len(jobs)} analyzed")
+
+    with tempfile.TemporaryDirectory(prefix='36247-analyze-') as scratch, \
+            ProcessPoolExecutor(max_workers=args.workers) as executor:
+        scratch_dir = Path(scratch)
+        pending = deque()
+        for track in jobs:
+            source = fetch_source(s3_client, batch_upload.TRACKS_BUCKET, track, scratch_dir)
+            if source is None:
+                print(f"  Skip {track['id']}: no local original (use --download)")
+                continue
+            pending.append((executor.submit(_analyze_worker, (track['id'], str(source), str(analysis_dir))), source))
+            while len(pending) >= args.workers * 2:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+
+    if done or recorded:
+        batch_upload.save_metadata(args.metadata_dir, metadata)
+    print(f"Analyzed {done}, failed {failed}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
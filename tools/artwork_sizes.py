@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+36247 Artwork Sizes
+
+Generates fixed-size renditions of every cover in metadata/artwork:
+
+- thumb:  96x96   track list thumbnails
+- medium: 600x600 player artwork
+
+Renditions are WebP by default (JPEG with --format jpg), written to
+metadata/artwork/sized/<hash>-<size>.<ext> and uploaded as
+artwork/<size>/<hash>.<ext>. Covers that already have every rendition are
+skipped, so re-runs only process new artwork. Work runs in a process pool.
+
+With --upload, the S3 keys are recorded on each track (s3_artwork_thumb,
+s3_artwork_medium) and the manifest exposes them as artwork_thumb /
+artwork_medium.
+
+Requires Pillow.
+"""
+
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+SIZES = {'thumb': 96, 'medium': 600}
+QUALITY = {'webp': 80, 'jpg': 82}
+SIZED_DIR = 'sized'
+
+
+def rendition_path(sized_dir: Path, cover_hash: str, size: str, fmt: str) -> Path:
+    return sized_dir / f"{cover_hash}-{size}.{fmt}"
+
+
+def rendition_key(cover_hash: str, size: str, fmt: str) -> str:
+    return f"artwork/{size}/{cover_hash}.{fmt}"
+
+
+def render_cover(args: tuple) -> tuple:
+    """
+    Process pool entry point: write every missing rendition of one cover.
+
+    Returns (cover_hash, bytes_in, {size: bytes_out}, error).
+    """
+    from PIL import Image, ImageOps
+
+    source, sized_dir, fmt = args
+    cover_hash = source.stem
+    outputs = {}
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for size, pixels in SIZES.items():
+                target = rendition_path(sized_dir, cover_hash, size, fmt)
+                if not target.exists():
+                    # Center-crop to square, then resize to the fixed size
+                    rendition = ImageOps.fit(image, (pixels, pixels), Image.LANCZOS)
+                    tmp = target.with_name(f".{target.name}.tmp")
+                    rendition.save(tmp, 'WEBP' if fmt == 'webp' else 'JPEG',
+                                   quality=QUALITY[fmt], optimize=True)
+                    tmp.replace(target)
+                outputs[size] = target.stat().st_size
+    except Exception as e:
+        return cover_hash, 0, outputs, str(e)
+    return cover_hash, source.stat().st_size, outputs, None
+
+
+def pending_covers(artwork_dir: Path, sized_dir: Path, fmt: str) -> tuple:
+    """Covers missing at least one rendition, and the count already done."""
+    covers = sorted(p for p in artwork_dir.iterdir() if p.is_file() and p.suffix in ('.jpg', '.png'))
+    pending = [
+        c for c in covers
+        if not all(rendition_path(sized_dir, c.stem, size, fmt).exists() for size in SIZES)
+    ]
+    return pending, len(covers) - len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate thumbnail and player sizes for artwork')
+    parser.add_argument(
+        '--metadata-dir',
+        type=Path,
+        default=Path(__file__).parent.parent / 'metadata',
+        help='Directory containing metadata_base.json and artwork'
+    )
+    parser.add_argument('--workers', type=int, default=4, help='Image processes (default: 4)')
+    parser.add_argument('--format', choices=['webp', 'jpg'], default='webp', help='Output format (default: webp)')
+    parser.add_argument('--upload', action='store_true',
+                        help='Upload renditions and record their keys in metadata_base.json')
+    args = parser.parse_args()
+
+    artwork_dir = args.metadata_dir / 'artwork'
+    sized_dir = artwork_dir / SIZED_DIR
+    sized_dir.mkdir(parents=True, exist_ok=True)
+
+    pending, done = pending_covers(artwork_dir, sized_dir, args.format)
+    print(f"Covers: {len(pending)} to process, {done} already sized")
+
+    bytes_in = 0
+    bytes_out = {size: 0 for size in SIZES}
+    failed = 0
+    jobs = [(cover, sized_dir, args.format) for cover in pending]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for i, (cover_hash, size_in, outputs, error) in enumerate(
+                executor.map(render_cover, jobs, chunksize=8), 1):
+            if error:
+                print(f"  Error sizing {cover_hash}: {error}", file=sys.stderr)
+                failed += 1
+                continue
+            bytes_in += size_in
+            for size, n in outputs.items():
+                bytes_out[size] += n
+            if i % 100 == 0:
+                print(f"  {i}/{len(jobs)} covers")
+
+    if pending:
+        count = len(pending) - failed
+        print(f"Original covers: {bytes_in / 1024:,.0f} KB")
+        for size, n in bytes_out.items():
+            print(f"  {size:<6} {SIZES[size]}px: {n / 1024:,.0f} KB total, "
+                  f"{n / max(count, 1) / 1024:.1f} KB avg")
+
+    if args.upload:
+        upload_renditions(args.metadata_dir, sized_dir, args.format)
+
+    return 0 if failed == 0 else 1
+
+
+def upload_renditions(metadata_dir: Path, sized_dir: Path, fmt: str):
+    """Upload each rendition once and point tracks at it."""
+    import batch_upload
+
+    metadata = batch_upload.load_metadata(metadata_dir)
+    s3_client = batch_upload.get_s3_client()
+    uploaded = set()
+    linked = 0
+
+    for track in metadata['tracks'].values():
+        if not track.get('artwork_path'):
+            continue
+        cover_hash = track.get('artwork_hash') or Path(track['artwork_path']).stem
+        for size in SIZES:
+            path = rendition_path(sized_dir, cover_hash, size, fmt)
+            key = rendition_key(cover_hash, size, fmt)
+            field = f"s3_artwork_{size}"
+            if not path.exists():
+                continue
+            if key not in uploaded and track.get(field) != key:
+                if not batch_upload.upload_file(s3_client, path, key, batch_upload.get_content_type(path)):
+                    continue
+                uploaded.add(key)
+            if track.get(field) != key:
+                track[field] = key
+                linked += 1
+
+    batch_upload.save_metadata(metadata_dir, metadata)
+    batch_upload.upload_manifest(s3_client, batch_upload.build_manifest(metadata), writer='artwork_sizes.py',
+                                 fields=('artwork_thumb', 'artwork_medium'))
+    print(f"Uploaded {len(uploaded)} rendition(s), linked {linked} track field(s)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
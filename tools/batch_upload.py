@@ -2,75 +2,129 @@
 """
 36247 Batch Upload Tool
 
-Uploads all tracks from metadata_base.json to S3, along with artwork.
-Deletes original files after successful upload.
+Uploads all tracks from metadata_base.json (or metadata.sqlite3, when
+present) to S3, along with artwork. Deletes original files after
+successful upload.
 """
 
 import argparse
 import json
 import os
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
 
-import boto3
-from botocore.exceptions import ClientError
+import manifest_log
+import metadata_store
+from core import get_client, get_content_type, lazy_import, metrics
+from upload_journal import UploadJournal, write_json_atomic
+
+botocore_exceptions = lazy_import('botocore.exceptions')
 
 # Configuration
-AWS_PROFILE = 'personal'
-TRACKS_BUCKET = '36247-tracks.rmzi.world'
+AWS_PROFILE = os.environ.get('AWS_PROFILE', 'personal')
+TRACKS_BUCKET = os.environ.get('TRACKS_BUCKET', '36247-tracks.rmzi.world')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. a local moto server
 METADATA_FILE = 'metadata_base.json'
 MANIFEST_FILE = 'manifest.json'
 
+# Upload tuning
+DEFAULT_CONCURRENCY = 8
+UPLOAD_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 1.0
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+TRANSFER_CONCURRENCY = 4
+_transfer_config = None
+
+
+def transfer_config():
+    """boto3 TransferConfig, built on first use so boto3 isn't imported at startup."""
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+        _transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNKSIZE,
+            max_concurrency=TRANSFER_CONCURRENCY
+        )
+    return _transfer_config
+
 
-def get_s3_client():
-    """Get boto3 S3 client with personal profile."""
-    session = boto3.Session(profile_name=AWS_PROFILE)
-    return session.client('s3')
+def get_s3_client(concurrency: int = 1):
+    """
+    Get boto3 S3 client with personal profile.
+
+    The client is shared by every upload thread, so its connection pool is
+    sized for the threads plus the parts each multipart transfer runs.
+    """
+    return get_client(
+        's3', AWS_PROFILE, endpoint_url=S3_ENDPOINT_URL,
+        max_pool_connections=max(10, concurrency * TRANSFER_CONCURRENCY),
+        adaptive_retries=True
+    )
 
 
-def upload_file(s3_client, local_path: Path, s3_key: str, content_type: str = None) -> bool:
-    """Upload a file to S3. Returns True on success."""
+def upload_file(s3_client, local_path: Path, s3_key: str, content_type: str = None,
+                retries: int = UPLOAD_RETRIES) -> bool:
+    """Upload a file to S3, retrying with exponential backoff. Returns True on success."""
     extra_args = {}
     if content_type:
         extra_args['ContentType'] = content_type
 
-    try:
-        s3_client.upload_file(str(local_path), TRACKS_BUCKET, s3_key, ExtraArgs=extra_args)
-        return True
-    except ClientError as e:
-        print(f"  Error uploading {local_path.name}: {e}", file=sys.stderr)
-        return False
-
-
-def get_content_type(filepath: Path) -> str:
-    """Get MIME type for file."""
-    ext = filepath.suffix.lower()
-    types = {
-        '.mp3': 'audio/mpeg',
-        '.m4a': 'audio/mp4',
-        '.ogg': 'audio/ogg',
-        '.flac': 'audio/flac',
-        '.wav': 'audio/wav',
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-    }
-    return types.get(ext, 'application/octet-stream')
+    for attempt in range(1, retries + 1):
+        try:
+            s3_client.upload_file(
+                str(local_path), TRACKS_BUCKET, s3_key,
+                ExtraArgs=extra_args, Config=transfer_config()
+            )
+            return True
+        except (botocore_exceptions.ClientError, botocore_exceptions.BotoCoreError) as e:
+            if attempt == retries:
+                print(f"  Error uploading {local_path.name}: {e}", file=sys.stderr)
+                metrics.count('upload_failures')
+                return False
+            metrics.count('upload_retries')
+            delay = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            print(f"  Retry {attempt}/{retries - 1} for {local_path.name} in {delay:.0f}s: {e}",
+                  file=sys.stderr)
+            time.sleep(delay)
+    return False
 
 
 def load_metadata(metadata_dir: Path) -> dict:
-    """Load metadata_base.json."""
+    """Load metadata from metadata.sqlite3 if present, else metadata_base.json."""
+    store = metadata_store.open_store(metadata_dir)
+    if store:
+        try:
+            return store.load()
+        finally:
+            store.close()
     metadata_file = metadata_dir / METADATA_FILE
     with open(metadata_file) as f:
         return json.load(f)
 
 
 def save_metadata(metadata_dir: Path, metadata: dict):
-    """Save metadata_base.json."""
-    metadata_file = metadata_dir / METADATA_FILE
-    with open(metadata_file, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    """Save metadata to metadata.sqlite3 (one transaction) if present, else metadata_base.json."""
+    store = metadata_store.open_store(metadata_dir)
+    if store:
+        try:
+            store.put_many(metadata['tracks'])
+            store.touch()
+        finally:
+            store.close()
+        return
+    write_json_atomic(metadata_dir / METADATA_FILE, metadata)
+
+
+# Manifest fields that local metadata is the source of truth for. Tags
+# (artist, album, title, year, tagged) are set when a track is first
+# published; later corrections come from the metadata agent's deltas.
+UPLOAD_FIELDS = ('path', 'duration', 'artwork', 'artwork_thumb', 'artwork_medium', 'renditions', 'hls')
 
 
 def build_manifest(metadata: dict) -> dict:
@@ -89,6 +143,10 @@ def build_manifest(metadata: dict) -> dict:
             'year': track.get('year'),
             'duration': track.get('duration'),
             'artwork': track.get('s3_artwork_path'),
+            'artwork_thumb': track.get('s3_artwork_thumb'),
+            'artwork_medium': track.get('s3_artwork_medium'),
+            'renditions': track.get('renditions'),
+            'hls': track.get('hls'),
             'tagged': track.get('tagged', False)
         })
 
@@ -99,21 +157,124 @@ def build_manifest(metadata: dict) -> dict:
     }
 
 
-def upload_manifest(s3_client, manifest: dict) -> bool:
-    """Upload manifest.json to S3."""
+def upload_manifest(s3_client, manifest: dict, sharded: bool = False, checkpoint: bool = False,
+                    writer: str = 'batch_upload.py', fields: tuple = UPLOAD_FIELDS) -> bool:
+    """
+    Publish the manifest's tracks through the manifest delta log.
+
+    New tracks are added whole; on tracks already published only `fields`
+    are updated, so the metadata agent's tag fixes aren't undone by a
+    rebuild from local metadata. The changes go into one delta that is then
+    compacted. Sharded checkpoints (checkpoint=True) only append the
+    delta and upload changed shards and the index; manifest.json and its
+    variants are compacted by the final upload of the run. Returns False
+    if manifest.json was not written.
+    """
     try:
-        s3_client.put_object(
-            Bucket=TRACKS_BUCKET,
-            Key=MANIFEST_FILE,
-            Body=json.dumps(manifest, indent=2),
-            ContentType='application/json'
-        )
-        return True
-    except ClientError as e:
+        with metrics.timer('manifest_write'):
+            return manifest_log.publish(s3_client, TRACKS_BUCKET, manifest['tracks'], writer, fields,
+                                        sharded=sharded, checkpoint=checkpoint)
+    except botocore_exceptions.ClientError as e:
         print(f"Error uploading manifest: {e}", file=sys.stderr)
         return False
 
 
+class ArtworkUploads:
+    """
+    Uploads each content-addressed cover once per bucket.
+
+    The first track to need a key uploads it; concurrent tracks wait on
+    the same Future instead of uploading a second copy. Keys already
+    referenced by uploaded tracks are seeded as done.
+    """
+
+    def __init__(self, existing_keys=()):
+        self.lock = threading.Lock()
+        self.uploads = {}
+        self.reused = 0
+        self.bytes_saved = 0
+        for key in existing_keys:
+            done = Future()
+            done.set_result(True)
+            self.uploads[key] = done
+
+    def upload(self, s3_client, artwork_path: Path, s3_key: str) -> tuple:
+        """Returns (ok, bytes_uploaded)."""
+        with self.lock:
+            pending = self.uploads.get(s3_key)
+            if pending is None:
+                pending = self.uploads[s3_key] = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            ok = pending.result()
+            if ok:
+                with self.lock:
+                    self.reused += 1
+                    self.bytes_saved += artwork_path.stat().st_size
+            return ok, 0
+
+        with metrics.timer('upload_artwork'):
+            ok = upload_file(s3_client, artwork_path, s3_key, get_content_type(artwork_path))
+        if not ok:
+            with self.lock:
+                del self.uploads[s3_key]  # let a later track retry
+        pending.set_result(ok)
+        return ok, artwork_path.stat().st_size if ok else 0
+
+
+def upload_track(s3_client, file_path: str, track: dict, skip_artwork: bool = False,
+                 artwork_uploads: ArtworkUploads = None) -> dict:
+    """
+    Upload one track's audio and artwork. Runs on a pool thread.
+
+    Returns a result dict; the caller applies it to the metadata so that
+    only the main thread ever mutates shared state.
+    """
+    original_path = Path(file_path)
+    result = {'file_path': file_path, 'ok': False, 'bytes': 0, 'error': None,
+              's3_path': None, 's3_artwork_path': None}
+
+    if not original_path.exists():
+        result['error'] = 'Original file not found'
+        return result
+
+    # Upload audio file
+    s3_audio_key = f"audio/{track['id']}.mp3"
+    with metrics.timer('upload'):
+        ok = upload_file(s3_client, original_path, s3_audio_key, get_content_type(original_path))
+    if not ok:
+        result['error'] = 'Upload failed'
+        return result
+
+    result['ok'] = True
+    result['s3_path'] = s3_audio_key
+    result['bytes'] += original_path.stat().st_size
+
+    # Upload artwork if exists (shared covers only once)
+    if not skip_artwork and track.get('artwork_path'):
+        artwork_path = Path(track['artwork_path'])
+        if artwork_path.exists():
+            s3_artwork_key = f"artwork/{artwork_path.name}"
+            artwork_uploads = artwork_uploads or ArtworkUploads()
+            ok, sent = artwork_uploads.upload(s3_client, artwork_path, s3_artwork_key)
+            if ok:
+                result['s3_artwork_path'] = s3_artwork_key
+                result['bytes'] += sent
+
+    return result
+
+
+def format_throughput(total_bytes: int, files: int, elapsed: float) -> str:
+    """Human-readable throughput summary."""
+    elapsed = max(elapsed, 1e-6)
+    mb = total_bytes / (1024 * 1024)
+    return (f"{mb:.1f} MB in {elapsed:.1f}s "
+            f"({mb / elapsed:.2f} MB/s, {files / elapsed:.2f} files/s)")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Batch upload audio files to S3 from metadata_base.json'
@@ -145,12 +306,64 @@ def main():
         action='store_true',
         help='Skip uploading artwork files'
     )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'Number of files to upload in parallel (default: {DEFAULT_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--sharded',
+        action='store_true',
+        help='Also write a sharded manifest; checkpoints upload only changed shards'
+    )
+    parser.add_argument(
+        '--check-bucket',
+        action='store_true',
+        help='List audio/ once and skip tracks already in the bucket; re-queue missing ones'
+    )
+    parser.add_argument(
+        '--bucket',
+        default=TRACKS_BUCKET,
+        help=f'S3 bucket name (default: {TRACKS_BUCKET})'
+    )
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
+    with metrics.instrument('batch_upload', args.metrics, args.cprofile):
+        return run(args)
+
+
+def run(args) -> int:
+    global TRACKS_BUCKET
+    TRACKS_BUCKET = args.bucket
 
     # Load metadata
     print(f"Loading metadata from {args.metadata_dir}...")
     metadata = load_metadata(args.metadata_dir)
+    store = metadata_store.open_store(args.metadata_dir)
+    if store:
+        print(f"Using metadata store {store.path} (per-track updates)")
+
+    # Recover transitions a previous run journaled but never checkpointed
+    journal = UploadJournal(args.metadata_dir)
+    recovered = journal.replay(metadata)
+    if recovered:
+        print(f"Recovered {recovered} journaled transition(s) from an interrupted run")
+        save_metadata(args.metadata_dir, metadata)
+    journal.reset()
+
+    # One bucket listing instead of re-uploading objects that are already there
+    if args.check_bucket:
+        import sync_plan
+        inventory = sync_plan.list_inventory(get_s3_client(), TRACKS_BUCKET, ('audio/',))
+        plan = sync_plan.build_plan(metadata, inventory)
+        print(f"Bucket check: {len(inventory)} audio object(s), {len(plan['present'])} already present, "
+              f"{len(plan['repair'])} to repair, {len(plan['lost'])} lost")
+        if not args.dry_run:
+            changed = sync_plan.apply_plan(metadata, plan)
+            if changed:
+                save_metadata(args.metadata_dir, metadata)
 
     total_tracks = len(metadata['tracks'])
     print(f"Found {total_tracks} tracks in metadata")
@@ -173,75 +386,100 @@ def main():
             print(f"  {i}. {track['original_filename']}")
             print(f"      -> audio/{track['id']}.mp3")
             if track.get('artwork_path'):
-                print(f"      -> artwork/{track['id']}.*")
+                print(f"      -> artwork/{Path(track['artwork_path']).name}")
         return 0
 
     # Initialize S3 client
-    print("\nInitializing S3 client...")
-    s3_client = get_s3_client()
+    print(f"\nInitializing S3 client ({args.concurrency} concurrent uploads)...")
+    s3_client = get_s3_client(args.concurrency)
 
     # Upload tracks
     uploaded = 0
     failed = 0
     deleted = 0
+    total_bytes = 0
+    started = time.monotonic()
 
-    artwork_dir = args.metadata_dir / 'artwork'
-
-    for i, (file_path, track) in enumerate(to_upload.items(), 1):
-        original_path = Path(file_path)
-        track_id = track['id']
-
-        print(f"[{i}/{len(to_upload)}] {track['original_filename'][:60]}...")
-
-        # Upload audio file
-        s3_audio_key = f"audio/{track_id}.mp3"
-
-        if not original_path.exists():
-            print(f"  SKIP: Original file not found")
-            failed += 1
-            continue
-
-        if not upload_file(s3_client, original_path, s3_audio_key, get_content_type(original_path)):
-            failed += 1
-            continue
-
-        # Update metadata with S3 path
-        metadata['tracks'][file_path]['s3_path'] = s3_audio_key
-        metadata['tracks'][file_path]['uploaded'] = True
-
-        # Upload artwork if exists
-        if not args.skip_artwork and track.get('artwork_path'):
-            artwork_path = Path(track['artwork_path'])
-            if artwork_path.exists():
-                s3_artwork_key = f"artwork/{artwork_path.name}"
-                if upload_file(s3_client, artwork_path, s3_artwork_key, get_content_type(artwork_path)):
-                    metadata['tracks'][file_path]['s3_artwork_path'] = s3_artwork_key
-
-        uploaded += 1
-
-        # Delete original file
-        if not args.no_delete:
-            try:
-                original_path.unlink()
-                deleted += 1
-                print(f"  Uploaded and deleted")
-            except OSError as e:
-                print(f"  Uploaded (delete failed: {e})")
-        else:
-            print(f"  Uploaded")
+    artwork_uploads = ArtworkUploads(
+        t['s3_artwork_path'] for t in metadata['tracks'].values()
+        if t.get('uploaded') and t.get('s3_artwork_path')
+    )
 
-        # Save checkpoint every 50 tracks
-        if uploaded % 50 == 0:
-            print(f"  Checkpoint: saving metadata and manifest...")
-            save_metadata(args.metadata_dir, metadata)
-            manifest = build_manifest(metadata)
-            upload_manifest(s3_client, manifest)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {
+            executor.submit(upload_track, s3_client, file_path, track, args.skip_artwork,
+                            artwork_uploads): track
+            for file_path, track in to_upload.items()
+        }
+
+        for i, future in enumerate(as_completed(futures), 1):
+            track = futures[future]
+            result = future.result()
+            file_path = result['file_path']
+
+            print(f"[{i}/{len(to_upload)}] {track['original_filename'][:60]}...")
+
+            if not result['ok']:
+                print(f"  SKIP: {result['error']}")
+                metrics.count('tracks_failed')
+                failed += 1
+                continue
+
+            # Journal each transition before the next step, so the original
+            # is only deleted once its upload is durably recorded
+            fields = {'s3_path': result['s3_path'], 'uploaded': True}
+            journal.append(file_path, 'uploaded', fields)
+            if result['s3_artwork_path']:
+                journal.append(file_path, 'artwork', {'s3_artwork_path': result['s3_artwork_path']})
+                fields['s3_artwork_path'] = result['s3_artwork_path']
+            metadata['tracks'][file_path].update(fields)
+            if store:
+                store.put(file_path, metadata['tracks'][file_path])
+
+            uploaded += 1
+            total_bytes += result['bytes']
+            metrics.count('tracks_uploaded')
+            metrics.count('bytes_uploaded', result['bytes'])
+
+            # Delete original file
+            if not args.no_delete:
+                try:
+                    Path(file_path).unlink()
+                    journal.append(file_path, 'deleted', {'original_deleted': True})
+                    metadata['tracks'][file_path]['original_deleted'] = True
+                    if store:
+                        store.put(file_path, metadata['tracks'][file_path])
+                    deleted += 1
+                    print(f"  Uploaded and deleted")
+                except OSError as e:
+                    print(f"  Uploaded (delete failed: {e})")
+            else:
+                print(f"  Uploaded")
+
+            # Checkpoint every 50 tracks; the journal covers the gap between
+            # checkpoints (the store is already up to date)
+            if uploaded % 50 == 0:
+                print(f"  Checkpoint: saving metadata and manifest...")
+                with metrics.timer('metadata_write'):
+                    if not store:
+                        save_metadata(args.metadata_dir, metadata)
+                    journal.reset()
+                manifest = build_manifest(metadata)
+                upload_manifest(s3_client, manifest, sharded=args.sharded, checkpoint=args.sharded)
+
+    elapsed = time.monotonic() - started
 
     # Final save
     print("\nSaving final metadata and manifest...")
-    save_metadata(args.metadata_dir, metadata)
+    with metrics.timer('metadata_write'):
+        if store:
+            store.touch()
+            store.close()
+        else:
+            save_metadata(args.metadata_dir, metadata)
+        journal.reset()
     manifest = build_manifest(metadata)
-    upload_manifest(s3_client, manifest)
+    upload_manifest(s3_client, manifest, sharded=args.sharded)
 
     print(f"\nDone!")
     print(f"  Uploaded: {uploaded}")
@@ -249,6 +487,9 @@ def main():
     if not args.no_delete:
         print(f"  Deleted: {deleted}")
     print(f"  Manifest tracks: {len(manifest['tracks'])}")
+    print(f"  Artwork reused: {artwork_uploads.reused} "
+          f"({artwork_uploads.bytes_saved / (1024 * 1024):.1f} MB not re-uploaded)")
+    print(f"  Throughput: {format_throughput(total_bytes, uploaded, elapsed)}")
 
     return 0 if failed == 0 else 1
 
@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+"""
+36247 Tool Benchmarks
+
+Micro-benchmarks for the ingest tools. Each subcommand prints a short
+human-readable report; pass --json for machine-readable output.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SUPPORTED_EXTENSIONS = {'.mp3', '.m4a', '.ogg', '.flac', '.wav'}
+REPO_ROOT = Path(__file__).resolve().parent.parent
+ENTRY_POINTS = [
+    'tools/upload.py',
+    'tools/batch_upload.py',
+    'tools/extract_metadata.py',
+    'tools/sign-cookies.py',
+    'tools/deploy-cookies.py',
+    'tools/cookie_signer.py',
+    'tools/manifest_log.py',
+    'tools/sync_plan.py',
+    'agents/metadata-agent.py',
+]
+
+
+def read_io_counters() -> dict:
+    """Bytes read/written through syscalls by this process (Linux only)."""
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def measure(fn, *args) -> dict:
+    """Run fn(*args) once, returning wall time and bytes read."""
+    before = read_io_counters()
+    started = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - started
+    after = read_io_counters()
+    return {
+        'seconds': round(elapsed, 4),
+        'bytes_read': after.get('rchar', 0) - before.get('rchar', 0),
+    }
+
+
+def find_audio_files(directory: Path, limit: int = 0) -> list:
+    """Audio files directly inside directory, sorted."""
+    files = sorted(p for p in directory.iterdir() if p.suffix.lower() in SUPPORTED_EXTENSIONS)
+    return files[:limit] if limit > 0 else files
+
+
+def bench_extract_io(args) -> dict:
+    """Compare the legacy three-read extraction path with the single-read path."""
+    from mutagen import File as MutagenFile
+    from mutagen.id3 import ID3
+
+    import extract_metadata
+
+    files = find_audio_files(args.directory, args.limit)
+    if not files:
+        print(f"Error: no audio files in {args.directory}", file=sys.stderr)
+        sys.exit(1)
+
+    def legacy(paths):
+        # What extract_metadata did before: hash in 8 KB chunks, then let
+        # mutagen and ID3 reopen the file by path.
+        import hashlib
+        for path in paths:
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(8192), b''):
+                    sha256.update(chunk)
+            MutagenFile(path)
+            if path.suffix.lower() == '.mp3':
+                try:
+                    ID3(path)
+                except Exception:
+                    pass
+
+    def single_read(paths):
+        for path in paths:
+            buf = extract_metadata.read_audio_file(path)
+            extract_metadata.compute_buffer_hash(buf.getbuffer())
+            audio = MutagenFile(buf)
+            if path.suffix.lower() == '.mp3' and not isinstance(getattr(audio, 'tags', None), ID3):
+                buf.seek(0)
+                try:
+                    ID3(buf)
+                except Exception:
+                    pass
+
+    total_bytes = sum(p.stat().st_size for p in files)
+    results = {'files': len(files), 'total_bytes': total_bytes}
+    for name, fn in (('legacy', legacy), ('single_read', single_read)):
+        runs = [measure(fn, files) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r['seconds'])
+        best['files_per_sec'] = round(len(files) / max(best['seconds'], 1e-9), 1)
+        results[name] = best
+
+    if results['legacy']['bytes_read']:
+        results['io_reduction'] = round(
+            1 - results['single_read']['bytes_read'] / results['legacy']['bytes_read'], 3
+        )
+    return results
+
+
+def synthetic_manifest(count: int, seed: int = 36247) -> dict:
+    """Manifest with `count` plausible-looking tracks (albums share artists)."""
+    rng = random.Random(seed)
+    words = ['three', 'six', 'mafia', 'dj', 'paul', 'juicy', 'project', 'pat', 'gangsta',
+             'boo', 'playa', 'fly', 'spanish', 'koopsta', 'knicca', 'lord', 'infamous',
+             'crunchy', 'black', 'tommy', 'wright', 'kingpin', 'skinny', 'mystic', 'stylez',
+             'tape', 'vol', 'side', 'memphis', 'north', 'south', 'murder', 'smoked', 'out']
+    tracks = []
+    album = artist = year = None
+    for i in range(count):
+        if i % 12 == 0:
+            artist = ' '.join(rng.sample(words, 2)).title()
+            album = ' '.join(rng.sample(words, 3)).title()
+            year = rng.choice([None] + list(range(1988, 2001)))
+        track_id = f"{rng.getrandbits(48):012x}"
+        tracks.append({
+            'id': track_id,
+            'path': f"audio/{track_id}.mp3",
+            'artist': artist,
+            'album': album,
+            'title': ' '.join(rng.sample(words, rng.randint(1, 4))).title(),
+            'year': year,
+            'duration': rng.randint(90, 420),
+            'artwork': f"artwork/{track_id}.jpg",
+            'tagged': True,
+        })
+    return {'version': 1, 'generated': '2026-01-01T00:00:00Z', 'tracks': tracks}
+
+
+def bench_search_index(args) -> dict:
+    """Build time and size of search-index.json at several catalog sizes."""
+    import search_index
+
+    results = {}
+    for count in args.sizes:
+        manifest = synthetic_manifest(count)
+        started = time.perf_counter()
+        index = search_index.build_search_index(manifest)
+        build_seconds = time.perf_counter() - started
+
+        body = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        manifest_body = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+        results[str(count)] = {
+            'build_seconds': round(build_seconds, 3),
+            'grams': len(index['grams']),
+            'index_bytes': len(body),
+            'index_gzip_bytes': len(gzip.compress(body, 9)),
+            'manifest_min_bytes': len(manifest_body),
+        }
+    return results
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Module count and slowest top-level imports from `python -X importtime` output."""
+    top_level = []
+    modules = 0
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or 'cumulative' in line:
+            continue
+        modules += 1
+        name = parts[2][1:]
+        if not name.startswith(' '):  # nested imports are indented
+            top_level.append((int(parts[1]), name.strip()))
+    top_level.sort(reverse=True)
+    return {
+        'modules': modules,
+        'slowest_ms': {name: round(us / 1000, 1) for us, name in top_level[:3]},
+    }
+
+
+def bench_startup(args) -> dict:
+    """Cold-start latency of every entry point, measured as `<script> --help` wall time."""
+    def run(cmd):
+        started = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True)
+        return (time.perf_counter() - started) * 1000, proc
+
+    baseline = [run([sys.executable, '-c', 'pass'])[0] for _ in range(args.repeat)]
+    results = {'interpreter_ms': round(min(baseline), 1)}
+
+    for script in args.scripts or ENTRY_POINTS:
+        timings = []
+        for _ in range(args.repeat):
+            ms, proc = run([sys.executable, script, '--help'])
+            if proc.returncode != 0:
+                error = (proc.stderr.strip().splitlines() or ['?'])[-1]
+                results[script] = {'error': error[:120]}
+                break
+            timings.append(ms)
+        else:
+            _, proc = run([sys.executable, '-X', 'importtime', script, '--help'])
+            results[script] = {
+                'min_ms': round(min(timings), 1),
+                'median_ms': round(statistics.median(timings), 1),
+                **parse_importtime(proc.stderr),
+            }
+    return results
+
+# Ingest pipeline on synthetic corpora
+
+CORPUS_FORMATS = ('mp3', 'flac', 'm4a')
+CORPUS_MARKER = '.corpus.json'
+INGEST_STAGES = ('extract', 'scan', 'rescan', 'build_manifest', 'upload')
+BENCH_BUCKET = '36247-bench'
+
+
+def _mp3_audio(rng: random.Random, frames: int = 40) -> bytes:
+    """MPEG-1 Layer III frames (128 kbps, 44.1 kHz) with random payloads."""
+    header = b'\xff\xfb\x90\x00'
+    frame_size = 144 * 128000 // 44100
+    return b''.join(header + rng.randbytes(frame_size - 4) for _ in range(frames))
+
+
+def _flac_audio(rng: random.Random, seconds: int = 1) -> bytes:
+    """fLaC marker, a STREAMINFO block and random frame bytes (mutagen reads only the metadata)."""
+    rate, channels, bits = 44100, 2, 16
+    info = struct.pack('>HH3s3s', 4096, 4096, b'\0\0\0', b'\0\0\0')
+    info += ((rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | rate * seconds).to_bytes(8, 'big')
+    info += rng.randbytes(16)  # MD5 of the (absent) audio
+    return b'fLaC' + b'\x80' + len(info).to_bytes(3, 'big') + info + rng.randbytes(8192)
+
+
+def _m4a_audio(rng: random.Random, seconds: int = 1) -> bytes:
+    """Minimal MP4 with one AAC sound track and random mdat bytes."""
+    def atom(name, *payload):
+        body = b''.join(payload)
+        return struct.pack('>I4s', 8 + len(body), name) + body
+
+    rate = 44100
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = atom(b'mvhd', struct.pack('>IIIII', 0, 0, 0, 1000, seconds * 1000),
+                struct.pack('>IH10x', 0x10000, 0x100), matrix, bytes(24), struct.pack('>I', 2))
+    mdhd = atom(b'mdhd', struct.pack('>IIIIIHH', 0, 0, 0, rate, rate * seconds, 0x55c4, 0))
+    hdlr = atom(b'hdlr', struct.pack('>II4s12x', 0, 0, b'soun'), b'\0')
+    # AAC-LC, 44.1 kHz stereo, 128 kbps
+    decoder = b'\x40\x15' + bytes(3) + struct.pack('>II', 128000, 128000) + b'\x05\x02\x12\x10'
+    descriptor = struct.pack('>HB', 1, 0) + b'\x04' + bytes([len(decoder)]) + decoder + b'\x06\x01\x02'
+    esds = atom(b'esds', bytes(4), b'\x03', bytes([len(descriptor)]), descriptor)
+    mp4a = atom(b'mp4a', bytes(6), struct.pack('>H8xHHHHI', 1, 2, 16, 0, 0, rate << 16), esds)
+    stbl = atom(b'stbl', atom(b'stsd', struct.pack('>II', 0, 1), mp4a))
+    trak = atom(b'trak', atom(b'mdia', mdhd, hdlr, atom(b'minf', stbl)))
+    return (atom(b'ftyp', b'M4A ', struct.pack('>I', 0), b'M4A mp42isom')
+            + atom(b'moov', mvhd, trak) + atom(b'mdat', rng.randbytes(8192)))
+
+
+def _tag_file(path: Path, fmt: str, tags: dict, cover: bytes | None):
+    """Write artist/album/title/year/track (and a cover) the way real rips carry them."""
+    if fmt == 'mp3':
+        from mutagen.id3 import APIC, ID3, TALB, TDRC, TIT2, TPE1, TRCK
+        id3 = ID3()
+        id3.add(TPE1(encoding=3, text=tags['artist']))
+        id3.add(TALB(encoding=3, text=tags['album']))
+        id3.add(TIT2(encoding=3, text=tags['title']))
+        id3.add(TDRC(encoding=3, text=str(tags['year'])))
+        id3.add(TRCK(encoding=3, text=str(tags['track'])))
+        if cover:
+            id3.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='', data=cover))
+        id3.save(path)
+    elif fmt == 'flac':
+        from mutagen.flac import FLAC, Picture
+        audio = FLAC(path)
+        audio.update({'artist': tags['artist'], 'album': tags['album'], 'title': tags['title'],
+                      'date': str(tags['year']), 'tracknumber': str(tags['track'])})
+        if cover:
+            picture = Picture()
+            picture.type, picture.mime, picture.data = 3, 'image/jpeg', cover
+            audio.add_picture(picture)
+        audio.save()
+    else:
+        from mutagen.mp4 import MP4, MP4Cover
+        audio = MP4(path)
+        audio.update({'\xa9ART': tags['artist'], '\xa9alb': tags['album'], '\xa9nam': tags['title'],
+                      '\xa9day': str(tags['year']), 'trkn': [(tags['track'], 0)]})
+        if cover:
+            audio['covr'] = [MP4Cover(cover, MP4Cover.FORMAT_JPEG)]
+        audio.save()
+
+
+def generate_corpus(directory: Path, count: int, formats=CORPUS_FORMATS, tagged: float = 0.8,
+                    seed: int = 36247) -> dict:
+    """
+    Write `count` small audio files into directory, cycling through formats.
+
+    A `tagged` fraction carries full tags, and most of those carry the
+    album's shared cover. The rest are untagged and named "Artist - Title",
+    so extraction falls back to the filename. Files are reused when the
+    directory already holds a corpus with the same parameters.
+    """
+    params = {'count': count, 'formats': list(formats), 'tagged': tagged, 'seed': seed}
+    marker = directory / CORPUS_MARKER
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return params
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for old in directory.iterdir():
+        if old.suffix.lower() in SUPPORTED_EXTENSIONS:
+            old.unlink()
+
+    rng = random.Random(seed)
+    builders = {'mp3': _mp3_audio, 'flac': _flac_audio, 'm4a': _m4a_audio}
+    manifest = synthetic_manifest(count, seed)
+    cover = None
+    for i, track in enumerate(manifest['tracks']):
+        if i % 12 == 0:
+            cover = b'\xff\xd8\xff\xe0' + rng.randbytes(4096) if rng.random() < 0.9 else None
+        fmt = formats[i % len(formats)]
+        path = directory / f"{i:06d} {track['artist']} - {track['title']}.{fmt}"
+        path.write_bytes(builders[fmt](rng))
+        if rng.random() < tagged:
+            tags = {**track, 'year': track['year'] or 1995, 'track': i % 12 + 1}
+            _tag_file(path, fmt, tags, cover)
+    marker.write_text(json.dumps(params))
+    return params
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS to the current RSS (Linux only). A spawned child
+    starts out with its parent's high-water mark, so without this every
+    stage would report at least the parent's peak.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (VmHWM on Linux, else ru_maxrss)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _run_stage(stage: str, params: dict) -> dict:
+    """
+    Run one ingest stage in a fresh process. Only the stage itself is
+    timed; loading its input is not. Progress output goes to /dev/null.
+    """
+    import contextlib
+    import os
+
+    reset_peak_rss()
+    corpus, output = Path(params['corpus']), Path(params['output'])
+    files = find_audio_files(corpus)
+    result = {}
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if stage == 'extract':
+            import extract_metadata
+            artwork_dir = output / 'extract-artwork'
+            artwork_dir.mkdir(parents=True, exist_ok=True)
+            started = time.perf_counter()
+            for path in files:
+                extract_metadata.extract_metadata(path, artwork_dir)
+            elapsed = time.perf_counter() - started
+
+        elif stage in ('scan', 'rescan'):
+            import extract_metadata
+            started = time.perf_counter()
+            metadata = extract_metadata.scan_directory(corpus, output, resume=stage == 'rescan',
+                                                       workers=params['workers'])
+            elapsed = time.perf_counter() - started
+            result['tagged'] = sum(1 for t in metadata['tracks'].values() if t.get('tagged'))
+
+        else:
+            import batch_upload
+            # Only an explicitly chosen profile; the stand-in takes env credentials
+            batch_upload.AWS_PROFILE = os.environ.get('AWS_PROFILE')
+            metadata = batch_upload.load_metadata(output)
+            for track in metadata['tracks'].values():
+                track['uploaded'] = True
+                track['s3_path'] = f"audio/{track['id']}.mp3"
+
+            if stage == 'build_manifest':
+                started = time.perf_counter()
+                manifest = batch_upload.build_manifest(metadata)
+                elapsed = time.perf_counter() - started
+                result['manifest_bytes'] = len(json.dumps(manifest, separators=(',', ':')))
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+                s3_client = batch_upload.get_s3_client(params['concurrency'])
+                artwork_uploads = batch_upload.ArtworkUploads()
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=params['concurrency']) as executor:
+                    uploads = list(executor.map(
+                        lambda item: batch_upload.upload_track(s3_client, *item, artwork_uploads=artwork_uploads),
+                        metadata['tracks'].items()
+                    ))
+                elapsed = time.perf_counter() - started
+                manifest_started = time.perf_counter()
+                batch_upload.upload_manifest(s3_client, batch_upload.build_manifest(metadata))
+                result['manifest_seconds'] = round(time.perf_counter() - manifest_started, 4)
+                result['failed'] = sum(1 for r in uploads if not r['ok'])
+                result['mb_per_sec'] = round(sum(r['bytes'] for r in uploads) / (1024 * 1024) / max(elapsed, 1e-9), 2)
+
+    count = len(files)
+    return {
+        'seconds': round(elapsed, 4),
+        'files': count,
+        'files_per_sec': round(count / max(elapsed, 1e-9), 1),
+        'peak_rss_mb': peak_rss_mb(),
+        **result,
+    }
+
+
+def _baseline_rss() -> float:
+    reset_peak_rss()
+    return peak_rss_mb()
+
+
+def start_s3_stand_in() -> tuple:
+    """A local moto S3 server on a free port; returns (server, endpoint_url)."""
+    import socket
+    from moto.server import ThreadedMotoServer
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def bench_ingest(args) -> dict:
+    """Generate corpora and time each ingest stage in its own process (files/sec, peak RSS)."""
+    import multiprocessing
+    import os
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    stages = [s for s in INGEST_STAGES if s in (args.stages or INGEST_STAGES)]
+    spawn = multiprocessing.get_context('spawn')
+
+    def run(stage, params):
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            return executor.submit(_run_stage, stage, params).result()
+
+    server = None
+    if 'upload' in stages:
+        endpoint = args.endpoint_url
+        if not endpoint:
+            try:
+                server, endpoint = start_s3_stand_in()
+            except ImportError:
+                print("Skipping upload: moto not installed (pip install 'moto[server]') "
+                      "and no --endpoint-url given", file=sys.stderr)
+                stages = [s for s in stages if s != 'upload']
+        if endpoint:
+            # Inherited by the stage processes, which read them at import
+            os.environ.update({'S3_ENDPOINT_URL': endpoint, 'TRACKS_BUCKET': BENCH_BUCKET})
+            if server:
+                os.environ.pop('AWS_PROFILE', None)
+                os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+                os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+                os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+        baseline = executor.submit(_baseline_rss).result()
+    results = {'baseline_rss_mb': baseline}
+    scratch = Path(tempfile.mkdtemp(prefix='36247-bench-'))
+    try:
+        for count in args.sizes:
+            corpus = (args.corpus or scratch) / f"corpus-{count}"
+            started = time.perf_counter()
+            generate_corpus(corpus, count, args.formats, args.tagged)
+            size = {
+                'generate_seconds': round(time.perf_counter() - started, 2),
+                'corpus_bytes': sum(p.stat().st_size for p in find_audio_files(corpus)),
+            }
+            output = scratch / f"out-{count}"
+            output.mkdir()
+            params = {'corpus': str(corpus), 'output': str(output),
+                      'workers': args.workers, 'concurrency': args.concurrency}
+            for stage in stages:
+                if stage == 'upload':
+                    from core import get_client
+                    s3 = get_client('s3', os.environ.get('AWS_PROFILE'), endpoint_url=os.environ['S3_ENDPOINT_URL'])
+                    try:
+                        s3.create_bucket(Bucket=BENCH_BUCKET)
+                    except s3.exceptions.BucketAlreadyOwnedByYou:
+                        pass
+                if stage in ('rescan', 'build_manifest', 'upload') and not (output / 'metadata_base.json').exists():
+                    run('scan', params)  # later stages read the scan's metadata
+                size[stage] = run(stage, params)
+            results[str(count)] = size
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        if server:
+            server.stop()
+    return results
+
+
+def print_report(name: str, results: dict):
+    """Print results as indented key/value lines."""
+    print(f"== {name} ==")
+
+    def walk(values: dict, indent: str):
+        for key, value in values.items():
+            if isinstance(value, dict):
+                print(f"{indent}{key}:")
+                walk(value, indent + '  ')
+            else:
+                print(f"{indent}{key}: {value}")
+
+    walk(results, '  ')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the 36247 ingest tools')
+    parser.add_argument('--json', action='store_true', help='Emit results as JSON')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('extract-io', help='Legacy vs single-read metadata extraction I/O')
+    p.add_argument('directory', type=Path, help='Directory of audio files')
+    p.add_argument('--limit', type=int, default=0, help='Only use the first N files (0 = all)')
+    p.add_argument('--repeat', type=int, default=3, help='Runs per variant; best is reported')
+    p.set_defaults(func=bench_extract_io)
+
+    p = subparsers.add_parser('search-index', help='search-index.json build time and size')
+    p.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 200000],
+                   help='Catalog sizes to build (default: 2000 20000 200000)')
+    p.set_defaults(func=bench_search_index)
+
+    p = subparsers.add_parser('startup', help='Cold-start time of each entry point (--help)')
+    p.add_argument('scripts', nargs='*', help=f'Scripts relative to the repo root (default: all {len(ENTRY_POINTS)})')
+    p.add_argument('--repeat', type=int, default=5, help='Runs per script (default: 5)')
+    p.set_defaults(func=bench_startup)
+
+    p = subparsers.add_parser('ingest', help='Ingest stages on synthetic MP3/FLAC/M4A corpora')
+    p.add_argument('--sizes', type=int, nargs='+', default=[1000],
+                   help='Corpus sizes in files (default: 1000)')
+    p.add_argument('--formats', nargs='+', choices=CORPUS_FORMATS, default=list(CORPUS_FORMATS),
+                   help='Formats to cycle through (default: all)')
+    p.add_argument('--tagged', type=float, default=0.8, help='Fraction of files with tags (default: 0.8)')
+    p.add_argument('--stages', nargs='+', choices=INGEST_STAGES,
+                   help=f"Stages to run (default: {' '.join(INGEST_STAGES)})")
+    p.add_argument('--workers', type=int, default=1, help='scan_directory extraction workers (default: 1)')
+    p.add_argument('--concurrency', type=int, default=8, help='Upload threads (default: 8)')
+    p.add_argument('--corpus', type=Path, help='Keep generated corpora here and reuse them across runs')
+    p.add_argument('--endpoint-url', help='S3-compatible endpoint to upload to instead of a local moto server')
+    p.set_defaults(func=bench_ingest)
+
+    args = parser.parse_args()
+    results = args.func(args)
+
+    if args.json:
+        print(json.dumps({args.command: results}, indent=2))
+    else:
+        print_report(args.command, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+36247 Cookie Signer
+
+CloudFront signed-cookie library and local signing service. The signing
+key is fetched and parsed once per process, not once per cookie, and
+policies can be signed in batches with per-resource expiries. That covers
+per-user or per-path cookies as well as the site-wide one.
+
+Key material comes from a secret provider:
+- Secrets Manager (default): SECRET_NAME via AWS_PROFILE / AWS_REGION
+- File: a JSON file with "private_key" (PEM) and "key_pair_id", selected
+  with --key-file or SIGNING_KEY_FILE. `keygen` writes a throwaway one for
+  local testing.
+
+Usage:
+    python cookie_signer.py sign --resource 'https://36247.rmzi.world/audio/*' --hours 6
+    python cookie_signer.py serve --port 8247
+    python cookie_signer.py bench --count 2000 --workers 4
+    python cookie_signer.py keygen test-key.json
+
+Service API (localhost only):
+    POST /sign  {"requests": [{"resource": "...", "hours": 24}, ...]}
+    -> {"cookies": [{"resource": ..., "expires": ..., "cookies": {...}}, ...]}
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+
+from core import get_client
+
+# Configuration
+AWS_PROFILE = os.environ.get('AWS_PROFILE', 'personal')
+AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+SECRET_NAME = '36247-cloudfront-signing-key'
+SIGNING_KEY_FILE = os.environ.get('SIGNING_KEY_FILE')
+DOMAIN = '36247.rmzi.world'
+DEFAULT_RESOURCE = f"https://{DOMAIN}/*"
+SERVICE_PORT = 8247
+POLICY_CACHE_SIZE = 4096
+MAX_BATCH = 10000
+MAX_VALIDITY = timedelta(hours=8760)  # service requests; same as deploy-cookies' default
+
+
+# Secret providers
+
+class SecretsManagerProvider:
+    """Signing key from AWS Secrets Manager."""
+
+    def __init__(self, secret_name: str = SECRET_NAME, profile: str = AWS_PROFILE, region: str = AWS_REGION):
+        self.secret_name = secret_name
+        self.profile = profile
+        self.region = region
+
+    def describe(self) -> str:
+        return f"Secrets Manager ({self.secret_name})"
+
+    def fetch(self) -> dict:
+        response = get_client('secretsmanager', self.profile, self.region).get_secret_value(
+            SecretId=self.secret_name
+        )
+        return json.loads(response['SecretString'])
+
+
+class FileSecretProvider:
+    """Signing key from a local JSON file (same shape as the secret)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def describe(self) -> str:
+        return f"file ({self.path})"
+
+    def fetch(self) -> dict:
+        with open(self.path) as f:
+            return json.load(f)
+
+
+def get_secret_provider(key_file: Path = None):
+    """File provider if a key file is given (or SIGNING_KEY_FILE is set), else Secrets Manager."""
+    key_file = key_file or SIGNING_KEY_FILE
+    return FileSecretProvider(key_file) if key_file else SecretsManagerProvider()
+
+
+# Signing
+
+def make_cloudfront_safe(s: str) -> str:
+    """Make base64 string safe for CloudFront cookies."""
+    return s.replace('+', '-').replace('=', '_').replace('/', '~')
+
+
+def policy_json(resource: str, expires: datetime) -> str:
+    """Custom policy JSON, serialized exactly as it is signed."""
+    policy = {
+        "Statement": [{
+            "Resource": resource,
+            "Condition": {
+                "DateLessThan": {
+                    "AWS:EpochTime": int(expires.timestamp())
+                }
+            }
+        }]
+    }
+    return json.dumps(policy, separators=(',', ':'))
+
+
+class CookieSigner:
+    """
+    Signs CloudFront cookie policies with a key loaded once.
+
+    The provider is only queried on first use. Identical policies (same
+    resource and expiry second) are served from an LRU cache. Thread-safe:
+    RSA signing in cryptography releases the GIL, so batches can use a
+    thread pool.
+    """
+
+    def __init__(self, provider=None):
+        self.provider = provider or get_secret_provider()
+        self.lock = threading.Lock()
+        self._key = None
+        self.key_pair_id = None
+        self.signatures = 0
+        self._sign_policy = lru_cache(maxsize=POLICY_CACHE_SIZE)(self._sign_policy_uncached)
+
+    def load(self):
+        """Fetch and parse the key (first call only)."""
+        if self._key is None:
+            with self.lock:
+                if self._key is None:
+                    from cryptography.hazmat.primitives import serialization
+
+                    secret = self.provider.fetch()
+                    self.key_pair_id = secret['key_pair_id']
+                    self._key = serialization.load_pem_private_key(
+                        secret['private_key'].encode(), password=None
+                    )
+        return self._key
+
+    def sign(self, message: bytes) -> bytes:
+        """RSA-SHA1 signature (required by CloudFront)."""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        signature = self.load().sign(message, padding.PKCS1v15(), hashes.SHA1())
+        with self.lock:
+            self.signatures += 1
+        return signature
+
+    def _sign_policy_uncached(self, policy: str) -> tuple:
+        policy_b64 = make_cloudfront_safe(base64.b64encode(policy.encode()).decode())
+        signature_b64 = make_cloudfront_safe(base64.b64encode(self.sign(policy.encode())).decode())
+        return policy_b64, signature_b64
+
+    def cookies(self, resource: str = DEFAULT_RESOURCE, expires: datetime = None, hours: float = 24) -> dict:
+        """CloudFront-Policy / -Signature / -Key-Pair-Id for one resource."""
+        expires = expires or datetime.now(timezone.utc) + timedelta(hours=hours)
+        self.load()
+        policy_b64, signature_b64 = self._sign_policy(policy_json(resource, expires))
+        return {
+            'CloudFront-Policy': policy_b64,
+            'CloudFront-Signature': signature_b64,
+            'CloudFront-Key-Pair-Id': self.key_pair_id
+        }
+
+    def sign_batch(self, requests: list, workers: int = 1) -> list:
+        """
+        Sign many (resource, expires) pairs; results keep request order.
+
+        Each result is {'resource', 'expires' (ISO), 'cookies'}.
+        """
+        self.load()
+
+        def one(request):
+            resource, expires = request
+            return {
+                'resource': resource,
+                'expires': expires.isoformat(),
+                'cookies': self.cookies(resource, expires)
+            }
+
+        if workers <= 1 or len(requests) < 2:
+            return [one(r) for r in requests]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(one, requests))
+
+
+def parse_requests(items: list, now: datetime = None) -> list:
+    """
+    [{'resource', 'hours'|'expires'}] -> [(resource, expires datetime)].
+
+    Raises ValueError for an expiry that is not in the future or lies more
+    than MAX_VALIDITY ahead (out-of-range numbers included).
+    """
+    now = now or datetime.now(timezone.utc)
+    parsed = []
+    for item in items:
+        try:
+            if 'expires' in item:
+                expires = datetime.fromtimestamp(int(item['expires']), timezone.utc)
+            else:
+                expires = now + timedelta(hours=float(item.get('hours', 24)))
+        except (OverflowError, OSError) as e:
+            raise ValueError(f"expiry out of range: {e}") from None
+        if not now < expires <= now + MAX_VALIDITY:
+            raise ValueError(f"expiry {expires.isoformat()} outside (now, now + {MAX_VALIDITY.days} days]")
+        parsed.append((item.get('resource', DEFAULT_RESOURCE), expires))
+    return parsed
+
+
+# Service
+
+def make_handler(signer: CookieSigner, workers: int):
+    from http.server import BaseHTTPRequestHandler
+
+    class SignHandler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._reply(200, {'ok': True, 'signatures': signer.signatures})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/sign':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                items = json.loads(self.rfile.read(length) or b'{}').get('requests', [])
+                if len(items) > MAX_BATCH:
+                    raise ValueError(f"batch larger than {MAX_BATCH}")
+                requests = parse_requests(items)
+            except (ValueError, TypeError, AttributeError, OverflowError, OSError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            self._reply(200, {'cookies': signer.sign_batch(requests, workers)})
+
+        def log_message(self, fmt, *args):
+            print(f"  {self.address_string()} {fmt % args}", file=sys.stderr)
+
+    return SignHandler
+
+
+def serve(signer: CookieSigner, port: int, workers: int):
+    from http.server import ThreadingHTTPServer
+
+    signer.load()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(signer, workers))
+    print(f"Signing service on http://127.0.0.1:{port} (key pair {signer.key_pair_id})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Benchmark
+
+def bench(provider, count: int, workers: int) -> dict:
+    """Signatures/sec: key parsed per signature (the old scripts) vs cached vs batched."""
+    now = datetime.now(timezone.utc)
+    # Distinct expiries so the policy cache never short-circuits signing
+    requests = [(f"https://{DOMAIN}/audio/{i:06d}/*", now + timedelta(seconds=3600 + i)) for i in range(count)]
+    secret = provider.fetch()
+    results = {'count': count, 'workers': workers}
+
+    class StaticProvider:
+        def fetch(self):
+            return secret
+
+    # Old behaviour: parse the PEM for every signature
+    cold_n = min(count, 200)
+    started = time.perf_counter()
+    for resource, expires in requests[:cold_n]:
+        CookieSigner(StaticProvider()).cookies(resource, expires)
+    results['reparse_per_signature'] = round(cold_n / (time.perf_counter() - started), 1)
+
+    signer = CookieSigner(StaticProvider())
+    signer.load()
+    started = time.perf_counter()
+    signer.sign_batch(requests)
+    results['cached_key'] = round(count / (time.perf_counter() - started), 1)
+
+    if workers > 1:
+        signer = CookieSigner(StaticProvider())
+        signer.load()
+        started = time.perf_counter()
+        signer.sign_batch(requests, workers)
+        results['cached_key_threads'] = round(count / (time.perf_counter() - started), 1)
+
+    started = time.perf_counter()
+    signer.sign_batch(requests)
+    results['policy_cache_hits'] = round(count / (time.perf_counter() - started), 1)
+    return results
+
+
+def keygen(path: Path, key_pair_id: str = 'KTESTLOCALKEY'):
+    """Write a throwaway 2048-bit key in the secret's JSON shape."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption()
+    ).decode()
+    path.write_text(json.dumps({'private_key': pem, 'key_pair_id': key_pair_id}, indent=2))
+    path.chmod(0o600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CloudFront cookie signing for 36247')
+    parser.add_argument('--key-file', type=Path, help='Local key JSON instead of Secrets Manager')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('sign', help='Sign one or more resources')
+    p.add_argument('--resource', action='append', help=f'Resource URL pattern (repeatable; default: {DEFAULT_RESOURCE})')
+    p.add_argument('--hours', type=float, default=24, help='Validity in hours (default: 24)')
+
+    p = subparsers.add_parser('serve', help='Run the local signing service')
+    p.add_argument('--port', type=int, default=SERVICE_PORT, help=f'Port (default: {SERVICE_PORT})')
+    p.add_argument('--workers', type=int, default=4, help='Signing threads per batch (default: 4)')
+
+    p = subparsers.add_parser('bench', help='Signing throughput (signatures/sec)')
+    p.add_argument('--count', type=int, default=2000, help='Policies to sign (default: 2000)')
+    p.add_argument('--workers', type=int, default=4, help='Threads for the batched run (default: 4)')
+
+    p = subparsers.add_parser('keygen', help='Write a throwaway local key file')
+    p.add_argument('path', type=Path, help='Output JSON path')
+
+    args = parser.parse_args()
+
+    if args.command == 'keygen':
+        keygen(args.path)
+        print(f"Wrote test signing key to {args.path}", file=sys.stderr)
+        return 0
+
+    provider = get_secret_provider(args.key_file)
+    print(f"Signing key from {provider.describe()}", file=sys.stderr)
+
+    if args.command == 'sign':
+        signer = CookieSigner(provider)
+        requests = parse_requests([{'resource': r, 'hours': args.hours} for r in args.resource or [DEFAULT_RESOURCE]])
+        print(json.dumps(signer.sign_batch(requests), indent=2))
+    elif args.command == 'serve':
+        serve(CookieSigner(provider), args.port, args.workers)
+    else:
+        results = bench(provider, args.count, args.workers)
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
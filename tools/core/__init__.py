@@ -0,0 +1,40 @@
+"""
+36247 tool core
+
+Shared helpers for the scripts in tools/ and agents/:
+
+- lazy:  lazy_import() defers heavy third-party imports (boto3, mutagen,
+         musicbrainzngs, numpy) until first use, so --help and --dry-run
+         start fast
+- aws:   one cached boto3 session and client per configuration
+- files: content hashing and MIME types
+- metrics: per-stage timers, counters and latency histograms, exported as
+         JSON lines or a Prometheus textfile, plus optional cProfile runs
+
+Importing this package pulls in the standard library only.
+"""
+
+from .aws import get_client, get_session
+from .files import (
+    CONTENT_TYPES,
+    HASH_CHUNK_SIZE,
+    SUPPORTED_EXTENSIONS,
+    compute_buffer_hash,
+    compute_file_hash,
+    get_content_type,
+)
+from .lazy import lazy_import
+from . import metrics
+
+__all__ = [
+    'CONTENT_TYPES',
+    'HASH_CHUNK_SIZE',
+    'SUPPORTED_EXTENSIONS',
+    'compute_buffer_hash',
+    'compute_file_hash',
+    'get_client',
+    'get_content_type',
+    'get_session',
+    'lazy_import',
+    'metrics',
+]
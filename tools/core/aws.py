@@ -0,0 +1,42 @@
+"""Cached boto3 sessions and clients."""
+
+import threading
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+
+def get_session(profile: str = None, region: str = None):
+    """One boto3 Session per (profile, region); an empty profile means env credentials."""
+    key = (profile or None, region)
+    with _lock:
+        if key not in _sessions:
+            import boto3
+            _sessions[key] = boto3.Session(profile_name=key[0], region_name=region)
+        return _sessions[key]
+
+
+def get_client(service: str, profile: str = None, region: str = None, endpoint_url: str = None,
+               max_pool_connections: int = 10, adaptive_retries: bool = False):
+    """
+    Cached client for service. Clients are thread-safe, so every caller in
+    a process shares one connection pool per configuration.
+    """
+    key = (service, profile or None, region, endpoint_url, max_pool_connections, adaptive_retries)
+    with _lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+
+    from botocore.config import Config
+
+    options = {'max_pool_connections': max_pool_connections}
+    if adaptive_retries:
+        options['retries'] = {'max_attempts': 5, 'mode': 'adaptive'}
+    session = get_session(profile, region)
+    with _lock:
+        # Session.client() isn't thread-safe; build under the lock
+        if key not in _clients:
+            _clients[key] = session.client(service, endpoint_url=endpoint_url, config=Config(**options))
+        return _clients[key]
@@ -0,0 +1,37 @@
+"""Content hashing and MIME types."""
+
+import hashlib
+from pathlib import Path
+
+SUPPORTED_EXTENSIONS = {'.mp3', '.m4a', '.ogg', '.flac', '.wav'}
+HASH_CHUNK_SIZE = 1024 * 1024
+CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.ogg': 'audio/ogg',
+    '.flac': 'audio/flac',
+    '.wav': 'audio/wav',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+
+def compute_file_hash(filepath: Path) -> str:
+    """SHA-256 of a file, truncated to the 12-character track id."""
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()[:12]
+
+
+def compute_buffer_hash(data: bytes) -> str:
+    """Same id as compute_file_hash, for a file that is already in memory."""
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def get_content_type(filepath: Path) -> str:
+    """MIME type by extension."""
+    return CONTENT_TYPES.get(Path(filepath).suffix.lower(), 'application/octet-stream')
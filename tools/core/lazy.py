@@ -0,0 +1,31 @@
+"""Deferred module imports."""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """
+    Return module `name`, executing it only on first attribute access.
+
+    Uses importlib's LazyLoader: the module is located (so a missing
+    dependency still fails at import time) but its body does not run until
+    the script actually uses it. Already-imported modules are returned as is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    # Bind submodules on their (already imported) parent, as a normal import
+    # does; otherwise `import botocore.exceptions` elsewhere finds the module
+    # in sys.modules but `botocore.exceptions` raises AttributeError
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
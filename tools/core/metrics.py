@@ -0,0 +1,284 @@
+"""
+Per-stage timers, counters and latency histograms for the ingest tools.
+
+One process-wide registry, used through module functions:
+
+    from core import metrics
+
+    with metrics.timer('hash'):
+        track_id = compute_buffer_hash(data)
+    metrics.count('bytes_read', len(data))
+
+Every timer feeds a histogram over LATENCY_BUCKETS. Recording costs one
+perf_counter() pair and a lock, so instrumentation stays on all the time.
+Only export is opt-in: instrument() wraps a script's run. It prints a stage
+summary and writes the registry as a JSON line or a Prometheus textfile
+(--metrics). Optionally, it runs everything under cProfile (--cprofile).
+
+Process pools: a worker calls reset() before its task and returns
+snapshot(); the parent calls merge() on the snapshot.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_PREFIX = 'ingest'
+PROFILE_LINES = 40
+
+
+class Histogram:
+    """Count, sum, min, max and per-bucket counts of observed durations."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate, interpolating linearly inside the bucket that holds it (clamped to min/max)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = self.min
+        for n, bound in zip(self.buckets, (*LATENCY_BUCKETS, self.max)):
+            upper = min(bound, self.max)
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = max(upper, self.min)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+                'buckets': list(self.buckets)}
+
+    def merge(self, snapshot: dict):
+        if not snapshot['count']:
+            return
+        self.count += snapshot['count']
+        self.sum += snapshot['sum']
+        self.min = snapshot['min'] if self.min is None else min(self.min, snapshot['min'])
+        self.max = snapshot['max'] if self.max is None else max(self.max, snapshot['max'])
+        self.buckets = [a + b for a, b in zip(self.buckets, snapshot['buckets'])]
+
+
+class Registry:
+    """Thread-safe counters and stage histograms."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+
+    def count(self, name: str, n: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time the block into the stage's histogram (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'stages': {name: h.snapshot() for name, h in self.stages.items()}}
+
+    def merge(self, snapshot: dict):
+        with self.lock:
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, data in snapshot['stages'].items():
+                self.stages.setdefault(name, Histogram()).merge(data)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.stages.clear()
+
+
+_registry = Registry()
+count = _registry.count
+observe = _registry.observe
+timer = _registry.timer
+snapshot = _registry.snapshot
+merge = _registry.merge
+reset = _registry.reset
+
+
+# Export
+
+def summary(elapsed: float = None) -> str:
+    """Stage table (slowest total first) and counters, as printed after a run."""
+    with _registry.lock:
+        stages = sorted(_registry.stages.items(), key=lambda item: item[1].sum, reverse=True)
+        counters = sorted(_registry.counters.items())
+        lines = [f"{'Stage':<20} {'count':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}"]
+        for name, h in stages:
+            lines.append(f"{name:<20} {h.count:>8} {h.sum:>9.2f} {h.sum / h.count * 1000:>9.1f} "
+                         f"{h.quantile(0.5) * 1000:>8.1f} {h.quantile(0.95) * 1000:>8.1f} {h.max * 1000:>8.1f}")
+    if elapsed:
+        lines.append(f"{'(wall)':<20} {'':>8} {elapsed:>9.2f}")
+    lines += [f"  {name}: {value:,}" for name, value in counters]
+    return '\n'.join(lines)
+
+
+def write_jsonl(path: Path, tool: str, elapsed: float = None):
+    """Append one line for this run: counters plus per-stage histograms and quantiles."""
+    data = snapshot()
+    with _registry.lock:
+        for name, h in _registry.stages.items():
+            data['stages'][name].update({'p50': h.quantile(0.5), 'p95': h.quantile(0.95)})
+    line = {
+        't': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        'tool': tool,
+        'seconds': round(elapsed, 3) if elapsed is not None else None,
+        'buckets': list(LATENCY_BUCKETS),
+        **data,
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(line) + '\n')
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def write_prometheus(path: Path, tool: str, elapsed: float = None):
+    """
+    Write a node_exporter textfile (replaced atomically, as the collector
+    may read it at any time): one histogram family for stage latencies,
+    one counter per counter name, plus run duration and timestamp.
+    """
+    prefix = PROMETHEUS_PREFIX
+    label = f'tool="{tool}"'
+    data = snapshot()
+    lines = [
+        f'# HELP {prefix}_stage_seconds Time spent per ingest stage.',
+        f'# TYPE {prefix}_stage_seconds histogram',
+    ]
+    for stage, h in sorted(data['stages'].items()):
+        labels = f'{label},stage="{stage}"'
+        cumulative = 0
+        for bound, n in zip((*LATENCY_BUCKETS, '+Inf'), h['buckets']):
+            cumulative += n
+            lines.append(f'{prefix}_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_sum{{{labels}}} {h["sum"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{{labels}}} {h["count"]}')
+    for name, value in sorted(data['counters'].items()):
+        metric = f'{prefix}_{_metric_name(name)}_total'
+        lines += [f'# TYPE {metric} counter', f'{metric}{{{label}}} {value}']
+    if elapsed is not None:
+        lines += [f'# TYPE {prefix}_run_seconds gauge', f'{prefix}_run_seconds{{{label}}} {elapsed:.3f}']
+    lines += [f'# TYPE {prefix}_last_run_timestamp_seconds gauge',
+              f'{prefix}_last_run_timestamp_seconds{{{label}}} {time.time():.0f}']
+
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+
+def export(path: Path, tool: str, elapsed: float = None):
+    """Prometheus textfile for *.prom, else a JSON line appended to path."""
+    if Path(path).suffix == '.prom':
+        write_prometheus(path, tool, elapsed)
+    else:
+        write_jsonl(path, tool, elapsed)
+
+
+# Script integration
+
+def add_arguments(parser):
+    """--metrics FILE and --cprofile [FILE] (--profile is the AWS profile elsewhere)."""
+    parser.add_argument(
+        '--metrics',
+        type=Path,
+        metavar='FILE',
+        help='Write stage timings, counters and histograms: a Prometheus textfile '
+             'if FILE ends in .prom, else one JSON line appended per run'
+    )
+    parser.add_argument(
+        '--cprofile',
+        nargs='?',
+        const='',
+        metavar='FILE',
+        help='Run under cProfile; write stats to FILE (default: <tool>.prof) and a text summary to FILE.txt'
+    )
+
+
+@contextmanager
+def instrument(tool: str, metrics_path: Path = None, profile_path: str = None):
+    """
+    Wrap a script's run. With a metrics path or profiling enabled, prints
+    the stage summary afterwards and writes the requested outputs (also
+    when the run fails).
+    """
+    profiler = None
+    if profile_path is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if profiler:
+            profiler.disable()
+            write_profile(profiler, Path(profile_path or f"{tool}.prof"))
+        if metrics_path or profiler:
+            print(f"\n{summary(elapsed)}")
+        if metrics_path:
+            export(metrics_path, tool, elapsed)
+            print(f"Metrics written to {metrics_path}")
+
+
+def write_profile(profiler, path: Path):
+    """Raw stats (for snakeviz / pstats) plus the top functions by cumulative time."""
+    import io
+    import pstats
+
+    profiler.dump_stats(str(path))
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out).strip_dirs()
+    stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+    stats.sort_stats('tottime').print_stats(PROFILE_LINES)
+    summary_path = path.with_name(path.name + '.txt')
+    summary_path.write_text(out.getvalue())
+    print(f"Profile written to {path} (summary: {summary_path})", file=sys.stderr)
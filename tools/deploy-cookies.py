@@ -6,7 +6,6 @@ Generates signed cookies and deploys an auth page with them embedded.
 """
 
 import argparse
-import base64
 import json
 import os
 import re
@@ -14,86 +13,33 @@ import sys
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-import boto3
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
+from cookie_signer import DOMAIN, CookieSigner, get_secret_provider
+from core import get_client
 
 # Configuration
 AWS_PROFILE = os.environ.get('AWS_PROFILE', 'personal')
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
-SECRET_NAME = '36247-cloudfront-signing-key'
-DOMAIN = '36247.rmzi.world'
 SITE_BUCKET = '36247-site.rmzi.world'
 CLOUDFRONT_DISTRIBUTION_ID = 'E3SAK6ILUR5289'
 
 
-def get_signing_key():
-    """Fetch signing key from Secrets Manager."""
-    session = boto3.Session(profile_name=AWS_PROFILE, region_name=AWS_REGION)
-    client = session.client('secretsmanager')
-    response = client.get_secret_value(SecretId=SECRET_NAME)
-    secret = json.loads(response['SecretString'])
-    return secret['private_key'], secret['key_pair_id']
-
-
-def rsa_sign(message: bytes, private_key_pem: str) -> bytes:
-    """Sign a message using RSA-SHA1 (required by CloudFront)."""
-    private_key = serialization.load_pem_private_key(
-        private_key_pem.encode(),
-        password=None,
-        backend=default_backend()
-    )
-    return private_key.sign(message, padding.PKCS1v15(), hashes.SHA1())
-
-
-def make_cloudfront_safe(s: str) -> str:
-    """Make base64 string safe for CloudFront cookies."""
-    return s.replace('+', '-').replace('=', '_').replace('/', '~')
-
-
-def generate_signed_cookies(key_pair_id: str, private_key_pem: str, hours: int) -> dict:
-    """Generate CloudFront signed cookies."""
-    expires = datetime.now(timezone.utc) + timedelta(hours=hours)
-    resource = f"https://{DOMAIN}/*"
-
-    policy = {
-        "Statement": [{
-            "Resource": resource,
-            "Condition": {
-                "DateLessThan": {
-                    "AWS:EpochTime": int(expires.timestamp())
-                }
-            }
-        }]
-    }
-
-    policy_json = json.dumps(policy, separators=(',', ':'))
-    policy_b64 = make_cloudfront_safe(base64.b64encode(policy_json.encode()).decode())
-
-    signature = rsa_sign(policy_json.encode(), private_key_pem)
-    signature_b64 = make_cloudfront_safe(base64.b64encode(signature).decode())
-
-    return {
-        'CloudFront-Policy': policy_b64,
-        'CloudFront-Signature': signature_b64,
-        'CloudFront-Key-Pair-Id': key_pair_id
-    }, expires
-
-
 def main():
     parser = argparse.ArgumentParser(description='Deploy auth page with fresh signed cookies')
     parser.add_argument('--hours', type=int, default=8760, help='Cookie validity in hours (default: 8760 = 1 year)')
     parser.add_argument('--dry-run', action='store_true', help='Show what would be deployed without deploying')
+    parser.add_argument('--key-file', type=Path, help='Local key JSON instead of Secrets Manager')
     args = parser.parse_args()
 
     # Get signing key
-    print("Fetching signing key from Secrets Manager...")
-    private_key, key_pair_id = get_signing_key()
+    provider = get_secret_provider(args.key_file)
+    print(f"Fetching signing key from {provider.describe()}...")
+    signer = CookieSigner(provider)
 
     # Generate cookies
     print(f"Generating cookies valid for {args.hours} hours...")
-    cookies, expires = generate_signed_cookies(key_pair_id, private_key, args.hours)
+    expires = datetime.now(timezone.utc) + timedelta(hours=args.hours)
+    cookies = signer.cookies(f"https://{DOMAIN}/*", expires)
+    key_pair_id = signer.key_pair_id
 
     print(f"Cookies valid until: {expires.isoformat()}")
 
@@ -120,8 +66,7 @@ def main():
 
     # Upload to S3
     print("Uploading main.js to S3...")
-    session = boto3.Session(profile_name=AWS_PROFILE, region_name=AWS_REGION)
-    s3 = session.client('s3')
+    s3 = get_client('s3', AWS_PROFILE, AWS_REGION)
 
     s3.put_object(
         Bucket=SITE_BUCKET,
@@ -133,7 +78,7 @@ def main():
 
     # Invalidate CloudFront cache
     print("Invalidating CloudFront cache...")
-    cf = session.client('cloudfront')
+    cf = get_client('cloudfront', AWS_PROFILE, AWS_REGION)
     cf.create_invalidation(
         DistributionId=CLOUDFRONT_DISTRIBUTION_ID,
         InvalidationBatch={
@@ -2,36 +2,49 @@
 """
 36247 Metadata Extractor
 
-Scans a directory of audio files and extracts all metadata into a JSON database.
+Scans a directory of audio files and extracts all metadata into a JSON database
+(or the SQLite metadata store, with --sqlite or when metadata.sqlite3 exists).
 Extracts embedded album art and saves to a separate directory.
 """
 
 import argparse
 import hashlib
+import io
 import json
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
-from mutagen import File as MutagenFile
-from mutagen.id3 import ID3
-from mutagen.mp3 import MP3
+import metadata_store
+from core import SUPPORTED_EXTENSIONS, compute_buffer_hash, compute_file_hash, lazy_import, metrics
+from upload_journal import write_json_atomic
+
+mutagen = lazy_import('mutagen')
+mutagen_id3 = lazy_import('mutagen.id3')
+mutagen_mp3 = lazy_import('mutagen.mp3')
 
 # Configuration
-SUPPORTED_EXTENSIONS = {'.mp3', '.m4a', '.ogg', '.flac', '.wav'}
 METADATA_FILE = 'metadata_base.json'
+SCAN_CACHE_FILE = 'scan_cache.json'
 ARTWORK_DIR = 'artwork'
+CHECKPOINT_INTERVAL = 50
+
 
+def read_audio_file(filepath: Path) -> io.BytesIO:
+    """
+    Read a file from disk exactly once.
 
-def compute_file_hash(filepath: Path) -> str:
-    """Compute SHA256 hash of file for unique ID."""
-    sha256 = hashlib.sha256()
-    with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            sha256.update(chunk)
-    return sha256.hexdigest()[:12]
+    The returned buffer is hashed and handed to mutagen as a file object, so
+    hashing and tag parsing share a single read. `name` is set because
+    mutagen uses the extension when scoring formats.
+    """
+    with open(filepath, 'rb', buffering=0) as f:
+        buf = io.BytesIO(f.read())
+    buf.name = str(filepath)
+    return buf
 
 
 def parse_filename(filename: str) -> dict:
@@ -74,8 +87,36 @@ def parse_filename(filename: str) -> dict:
     return result
 
 
-def extract_album_art(audio, track_id: str, artwork_dir: Path) -> str | None:
-    """Extract embedded album art and save to file. Returns path if found."""
+def has_tag(tags, key: str) -> bool:
+    """`key in tags`; Vorbis comments raise ValueError for non-ASCII keys like '\\xa9ART'."""
+    try:
+        return key in tags
+    except ValueError:
+        return False
+
+
+def artwork_hash(data: bytes) -> str:
+    """Content address for a cover image."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def save_artwork(data: bytes, ext: str, artwork_dir: Path) -> Path:
+    """
+    Store a cover under its content hash, once.
+
+    Every track on an album shares the same file. Writes go through a temp
+    file + rename so parallel extract workers can't interleave.
+    """
+    artwork_path = artwork_dir / f"{artwork_hash(data)}.{ext}"
+    if not artwork_path.exists():
+        tmp_path = artwork_path.with_name(f".{artwork_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, artwork_path)
+    return artwork_path
+
+
+def extract_album_art(audio, artwork_dir: Path) -> str | None:
+    """Extract embedded album art into the content-addressed store. Returns path if found."""
     artwork_path = None
 
     try:
@@ -89,26 +130,20 @@ def extract_album_art(audio, track_id: str, artwork_dir: Path) -> str | None:
                     apic = tags[key]
                     if apic.data and len(apic.data) > 1000:  # At least 1KB
                         ext = 'jpg' if apic.mime == 'image/jpeg' else 'png'
-                        artwork_path = artwork_dir / f"{track_id}.{ext}"
-                        artwork_path.write_bytes(apic.data)
-                        return str(artwork_path)
+                        return str(save_artwork(apic.data, ext, artwork_dir))
 
             # MP4/M4A cover art
             if 'covr' in tags:
                 cover = tags['covr'][0]
                 if len(cover) > 1000:
-                    artwork_path = artwork_dir / f"{track_id}.jpg"
-                    artwork_path.write_bytes(bytes(cover))
-                    return str(artwork_path)
+                    return str(save_artwork(bytes(cover), 'jpg', artwork_dir))
 
             # FLAC pictures
             if hasattr(audio, 'pictures'):
                 for pic in audio.pictures:
                     if pic.data and len(pic.data) > 1000:
                         ext = 'jpg' if pic.mime == 'image/jpeg' else 'png'
-                        artwork_path = artwork_dir / f"{track_id}.{ext}"
-                        artwork_path.write_bytes(pic.data)
-                        return str(artwork_path)
+                        return str(save_artwork(pic.data, ext, artwork_dir))
 
     except Exception as e:
         print(f"  Warning: Could not extract artwork: {e}", file=sys.stderr)
@@ -118,13 +153,17 @@ def extract_album_art(audio, track_id: str, artwork_dir: Path) -> str | None:
 
 def extract_metadata(filepath: Path, artwork_dir: Path) -> dict:
     """Extract all metadata from an audio file."""
-    track_id = compute_file_hash(filepath)
+    with metrics.timer('read'):
+        buf = read_audio_file(filepath)
+    with metrics.timer('hash'):
+        track_id = compute_buffer_hash(buf.getbuffer())
+    metrics.count('bytes_read', buf.getbuffer().nbytes)
 
     metadata = {
         'id': track_id,
         'original_path': str(filepath),
         'original_filename': filepath.name,
-        'file_size': filepath.stat().st_size,
+        'file_size': buf.getbuffer().nbytes,
         'artist': None,
         'album': None,
         'title': None,
@@ -135,6 +174,7 @@ def extract_metadata(filepath: Path, artwork_dir: Path) -> dict:
         'bitrate': None,
         'sample_rate': None,
         'artwork_path': None,
+        'artwork_hash': None,
         'tagged': False,
         'extracted_at': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
     }
@@ -143,7 +183,8 @@ def extract_metadata(filepath: Path, artwork_dir: Path) -> dict:
     filename_meta = parse_filename(filepath.name)
 
     try:
-        audio = MutagenFile(filepath)
+        with metrics.timer('tag_parse'):
+            audio = mutagen.File(buf)
         if audio is None:
             # Use filename metadata as fallback
             metadata.update({k: v for k, v in filename_meta.items() if v})
@@ -160,9 +201,15 @@ def extract_metadata(filepath: Path, artwork_dir: Path) -> dict:
                 metadata['sample_rate'] = info.sample_rate
 
         # Try to get ID3 tags (MP3)
-        if isinstance(audio, MP3) or filepath.suffix.lower() == '.mp3':
+        if isinstance(audio, mutagen_mp3.MP3) or filepath.suffix.lower() == '.mp3':
             try:
-                tags = ID3(filepath)
+                # MP3 already parsed its ID3 header; only re-read on fallback
+                if isinstance(audio.tags, mutagen_id3.ID3):
+                    tags = audio.tags
+                else:
+                    buf.seek(0)
+                    with metrics.timer('tag_parse'):
+                        tags = mutagen_id3.ID3(buf)
 
                 # Artist
                 for key in ['TPE1', 'TPE2']:
@@ -221,7 +268,7 @@ def extract_metadata(filepath: Path, artwork_dir: Path) -> dict:
 
             for field, keys in tag_map.items():
                 for key in keys:
-                    if key in tags:
+                    if has_tag(tags, key):
                         val = tags[key]
                         if isinstance(val, list):
                             val = val[0]
@@ -242,9 +289,11 @@ def extract_metadata(filepath: Path, artwork_dir: Path) -> dict:
                         break
 
         # Extract album art
-        artwork_path = extract_album_art(audio, track_id, artwork_dir)
+        with metrics.timer('artwork_extract'):
+            artwork_path = extract_album_art(audio, artwork_dir)
         if artwork_path:
             metadata['artwork_path'] = artwork_path
+            metadata['artwork_hash'] = Path(artwork_path).stem
 
     except Exception as e:
         print(f"  Warning: Error reading {filepath.name}: {e}", file=sys.stderr)
@@ -267,18 +316,152 @@ def extract_metadata(filepath: Path, artwork_dir: Path) -> dict:
     return metadata
 
 
-def scan_directory(directory: Path, output_dir: Path, resume: bool = False) -> dict:
+def save_metadata_base(metadata_file: Path, metadata_base: dict):
+    """Stamp and atomically replace metadata_base.json."""
+    metadata_base['generated'] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    write_json_atomic(metadata_file, metadata_base)
+
+
+def file_signature(filepath: Path) -> dict:
+    """Cheap change detector: size, mtime and inode from a single stat()."""
+    st = filepath.stat()
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino}
+
+
+def load_scan_cache(cache_file: Path) -> dict:
+    """Load scan_cache.json, mapping path -> signature + track id."""
+    if cache_file.exists():
+        with open(cache_file) as f:
+            return json.load(f)
+    return {'version': 1, 'entries': {}}
+
+
+def save_scan_cache(cache_file: Path, scan_cache: dict):
+    """Write scan_cache.json (compact; it is never read by humans)."""
+    write_json_atomic(cache_file, scan_cache, indent=None)
+
+
+def plan_scan(audio_files: list, metadata_base: dict, scan_cache: dict) -> tuple:
+    """
+    Split audio_files into work that needs extraction and work that doesn't.
+
+    Returns (pending, moved, unchanged, signatures):
+    - unchanged: path and stat signature match the cache; nothing is read
+    - moved: list of (new_path, old_path) for files that were renamed or
+      copied; matched by inode first, then by content id, and re-keyed
+      without re-extracting
+    - pending: new or modified files that must be hashed and parsed
+    - signatures: path -> signature for everything that was stat()ed
+    """
+    tracks = metadata_base['tracks']
+    entries = scan_cache['entries']
+
+    by_inode = {}
+    by_id = {}
+    sizes = set()
+    for path, entry in entries.items():
+        if path in tracks:
+            by_inode[(entry['inode'], entry['size'], entry['mtime_ns'])] = path
+    for path, track in tracks.items():
+        by_id[track['id']] = path
+        sizes.add(track.get('file_size'))
+
+    pending, moved, unchanged = [], [], 0
+    signatures = {}
+    present = {str(fp) for fp in audio_files}
+    claimed = set()
+
+    for filepath in audio_files:
+        key = str(filepath)
+        sig = file_signature(filepath)
+        signatures[key] = sig
+
+        entry = entries.get(key)
+        if key in tracks and entry and all(entry[k] == sig[k] for k in sig):
+            unchanged += 1
+            continue
+        if key in tracks and not entry:
+            # Tracked before the cache existed: trust it, just record the stat
+            unchanged += 1
+            continue
+
+        old = by_inode.get((sig['inode'], sig['size'], sig['mtime_ns']))
+        if old is None and sig['size'] in sizes:
+            # Only hash when some known track has the same size
+            old = by_id.get(compute_file_hash(filepath))
+        if old is not None and old != key and old not in present and old not in claimed:
+            claimed.add(old)
+            moved.append((filepath, old))
+            continue
+
+        pending.append(filepath)
+
+    return pending, moved, unchanged, signatures
+
+
+def _extract_worker(args: tuple) -> tuple:
+    """Process pool entry point. Returns (meta, error) so one bad file can't kill the pool."""
+    filepath, artwork_dir = args
+    try:
+        return extract_metadata(filepath, artwork_dir), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _extract_worker_metered(args: tuple) -> tuple:
+    """_extract_worker in a pool process, plus that task's metrics for the parent to merge."""
+    metrics.reset()
+    return (*_extract_worker(args), metrics.snapshot())
+
+
+def iter_extracted(pending: list, artwork_dir: Path, workers: int = 1):
+    """
+    Yield (filepath, meta, error) for each pending file, in input order.
+
+    With workers > 1 extraction fans out across a process pool; results are
+    still yielded in order so checkpoints always cover a contiguous prefix.
+    """
+    if workers <= 1:
+        for filepath in pending:
+            yield (filepath, *_extract_worker((filepath, artwork_dir)))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = ((filepath, artwork_dir) for filepath in pending)
+        results = executor.map(_extract_worker_metered, jobs, chunksize=4)
+        for filepath, (meta, error, snapshot) in zip(pending, results):
+            metrics.merge(snapshot)
+            yield filepath, meta, error
+
+
+def scan_directory(directory: Path, output_dir: Path, resume: bool = False, workers: int = 1,
+                   sqlite: bool = False) -> dict:
     """Scan directory and extract metadata from all audio files."""
     metadata_file = output_dir / METADATA_FILE
+    cache_file = output_dir / SCAN_CACHE_FILE
     artwork_dir = output_dir / ARTWORK_DIR
     artwork_dir.mkdir(parents=True, exist_ok=True)
 
+    # With a store every track is upserted as it is extracted, so
+    # checkpoints no longer rewrite the whole database
+    store = metadata_store.open_store(output_dir, create=sqlite)
+    if store:
+        metadata_file = store.path
+
     # Load existing metadata if resuming
     metadata_base = {'version': 1, 'generated': None, 'tracks': {}}
-    if resume and metadata_file.exists():
+    scan_cache = {'version': 1, 'entries': {}}
+    if resume and store:
+        metadata_base = store.load()
+        scan_cache = load_scan_cache(cache_file)
+        print(f"Resuming: {len(metadata_base['tracks'])} tracks already processed")
+    elif resume and metadata_file.exists():
         with open(metadata_file) as f:
             metadata_base = json.load(f)
+        scan_cache = load_scan_cache(cache_file)
         print(f"Resuming: {len(metadata_base['tracks'])} tracks already processed")
+    elif store:
+        store.clear()
 
     # Find all audio files
     audio_files = []
@@ -289,38 +472,64 @@ def scan_directory(directory: Path, output_dir: Path, resume: bool = False) -> d
     audio_files = sorted(set(audio_files))
     print(f"Found {len(audio_files)} audio files")
 
+    # Skip unchanged files and re-key moved ones without re-extracting
+    with metrics.timer('scan_plan'):
+        pending, moved, skipped, signatures = plan_scan(audio_files, metadata_base, scan_cache)
+    for filepath, old_path in moved:
+        meta = metadata_base['tracks'].pop(old_path)
+        meta['original_path'] = str(filepath)
+        meta['original_filename'] = filepath.name
+        metadata_base['tracks'][str(filepath)] = meta
+        if store:
+            store.move(old_path, str(filepath), meta)
+        scan_cache['entries'].pop(old_path, None)
+        print(f"  Moved: {Path(old_path).name[:40]} -> {filepath.name[:40]}")
+    for path in signatures:
+        if path in metadata_base['tracks']:
+            scan_cache['entries'][path] = {**signatures[path], 'id': metadata_base['tracks'][path]['id']}
+    skipped += len(moved)
+    print(f"Unchanged: {skipped - len(moved)}, moved: {len(moved)}, to extract: {len(pending)}")
+    metrics.count('files_found', len(audio_files))
+    metrics.count('files_unchanged', skipped - len(moved))
+    metrics.count('files_moved', len(moved))
+
+    if workers > 1:
+        print(f"Extracting with {workers} workers")
+
     # Process files
     processed = 0
-    skipped = 0
-
-    for i, filepath in enumerate(audio_files):
-        # Skip if already processed
-        file_key = str(filepath)
-        if file_key in metadata_base['tracks']:
-            skipped += 1
-            continue
 
+    for i, (filepath, meta, error) in enumerate(iter_extracted(pending, artwork_dir, workers), skipped):
         print(f"[{i+1}/{len(audio_files)}] Processing: {filepath.name[:60]}...")
 
-        try:
-            meta = extract_metadata(filepath, artwork_dir)
-            metadata_base['tracks'][file_key] = meta
-            processed += 1
-
-            # Save periodically
-            if processed % 50 == 0:
-                metadata_base['generated'] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
-                with open(metadata_file, 'w') as f:
-                    json.dump(metadata_base, f, indent=2)
-                print(f"  Checkpoint saved ({processed} new, {skipped} skipped)")
+        if error:
+            print(f"  Error: {error}", file=sys.stderr)
+            metrics.count('extract_errors')
+            continue
 
-        except Exception as e:
-            print(f"  Error: {e}", file=sys.stderr)
+        metadata_base['tracks'][str(filepath)] = meta
+        if store:
+            store.put(str(filepath), meta)
+        scan_cache['entries'][str(filepath)] = {**signatures[str(filepath)], 'id': meta['id']}
+        processed += 1
+        metrics.count('files_extracted')
+
+        # Save periodically
+        if processed % CHECKPOINT_INTERVAL == 0:
+            with metrics.timer('metadata_write'):
+                if not store:
+                    save_metadata_base(metadata_file, metadata_base)
+                save_scan_cache(cache_file, scan_cache)
+            print(f"  Checkpoint saved ({processed} new, {skipped} skipped)")
 
     # Final save
-    metadata_base['generated'] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
-    with open(metadata_file, 'w') as f:
-        json.dump(metadata_base, f, indent=2)
+    with metrics.timer('metadata_write'):
+        if store:
+            store.touch()
+            store.close()
+        else:
+            save_metadata_base(metadata_file, metadata_base)
+        save_scan_cache(cache_file, scan_cache)
 
     print(f"\nDone! Processed {processed} new files, skipped {skipped}")
     print(f"Total tracks in database: {len(metadata_base['tracks'])}")
@@ -349,6 +558,18 @@ def main():
         action='store_true',
         help='Resume from existing metadata file'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of extraction processes (default: 1)'
+    )
+    parser.add_argument(
+        '--sqlite',
+        action='store_true',
+        help='Write metadata.sqlite3 instead of metadata_base.json (used automatically if it exists)'
+    )
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -358,7 +579,8 @@ def main():
 
     args.output.mkdir(parents=True, exist_ok=True)
 
-    scan_directory(args.directory, args.output, args.resume)
+    with metrics.instrument('extract_metadata', args.metrics, args.cprofile):
+        scan_directory(args.directory, args.output, args.resume, args.workers, args.sqlite)
     return 0
 
 
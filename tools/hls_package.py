@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+36247 HLS Packaging
+
+Splits every uploaded track into short MPEG-TS segments plus a VOD playlist,
+so the player can start after the first segment and seek without range
+requests against a 12 MB object:
+
+- metadata/hls/<id>.m3u8        playlist, uploaded as audio/hls/<id>.m3u8
+- metadata/hls/seg/<hash>.ts    segments, uploaded as audio/hls/seg/<hash>.ts
+
+Segments are named by the SHA-256 of their bytes, so they are content
+addressed: re-packaging a track whose audio did not change (for example a
+re-tagged MP3, which gets a new id) yields the same segments, and only the
+new playlist is uploaded. Segments already in the bucket are never uploaded
+again. Everything lives under audio/, behind the same signed-cookie
+CloudFront behavior as the originals.
+
+MP3 originals are re-muxed without re-encoding; other formats are encoded
+to AAC. Tracks whose playlist is already on disk are skipped. With
+--upload, each track records its playlist (`hls`) and segment keys, and the
+manifest exposes `hls`.
+
+Requires ffmpeg on PATH.
+"""
+
+import argparse
+import hashlib
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+SEGMENT_SECONDS = 6
+AAC_BITRATE = '192k'
+HLS_DIR = 'hls'
+HLS_PREFIX = 'audio/hls/'
+SEGMENT_DIR = 'seg'
+PLAYLIST_TYPE = 'application/vnd.apple.mpegurl'
+SEGMENT_TYPE = 'video/mp2t'
+UPLOAD_WORKERS = 8
+
+
+def playlist_path(hls_dir: Path, track_id: str) -> Path:
+    return hls_dir / f"{track_id}.m3u8"
+
+
+def playlist_key(track_id: str) -> str:
+    return f"{HLS_PREFIX}{track_id}.m3u8"
+
+
+def segment_key(name: str) -> str:
+    return f"{HLS_PREFIX}{SEGMENT_DIR}/{name}"
+
+
+def playlist_segments(playlist: Path) -> list:
+    """Segment file names referenced by a packaged playlist, in order."""
+    prefix = f"{SEGMENT_DIR}/"
+    return [line[len(prefix):] for line in playlist.read_text().splitlines() if line.startswith(prefix)]
+
+
+def segment(source: Path, hls_dir: Path, track_id: str) -> tuple:
+    """
+    Package one track: ffmpeg segments into a scratch directory, then each
+    segment is moved into seg/ under its content hash and the playlist is
+    rewritten to point at the hashed names.
+
+    Returns (segment count, bytes of segments that were new on disk).
+    """
+    seg_dir = hls_dir / SEGMENT_DIR
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    codec = ['-c:a', 'copy'] if source.suffix.lower() == '.mp3' else ['-c:a', 'aac', '-b:a', AAC_BITRATE]
+
+    # Scratch space on the same filesystem as seg/, so segments can be
+    # renamed into place (/tmp is often a separate tmpfs)
+    with tempfile.TemporaryDirectory(prefix='.scratch-', dir=hls_dir) as scratch:
+        scratch = Path(scratch)
+        # bitexact keeps encoder version strings out of the bytes, so the
+        # same audio always hashes to the same segments
+        subprocess.run([
+            'ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', str(source),
+            '-map', '0:a:0', '-map_metadata', '-1', *codec,
+            '-fflags', '+bitexact', '-flags:a', '+bitexact',
+            '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', str(scratch / '%05d.ts'),
+            str(scratch / 'index.m3u8'),
+        ], check=True, capture_output=True)
+
+        lines = []
+        count = new_bytes = 0
+        for line in (scratch / 'index.m3u8').read_text().splitlines():
+            if line and not line.startswith('#'):
+                data = (scratch / line).read_bytes()
+                name = f"{hashlib.sha256(data).hexdigest()[:16]}.ts"
+                target = seg_dir / name
+                if not target.exists():
+                    (scratch / line).replace(target)
+                    new_bytes += len(data)
+                line = f"{SEGMENT_DIR}/{name}"
+                count += 1
+            lines.append(line)
+
+    # Written last, so a playlist on disk means every segment is there too
+    target = playlist_path(hls_dir, track_id)
+    tmp = target.with_name(f".{target.name}.tmp")
+    tmp.write_text('\n'.join(lines) + '\n')
+    tmp.replace(target)
+    return count, new_bytes
+
+
+def _package_worker(args: tuple) -> tuple:
+    """Process pool entry point. Returns (track_id, segments, new bytes, error)."""
+    track_id, source, hls_dir = args
+    try:
+        count, new_bytes = segment(Path(source), Path(hls_dir), track_id)
+        return track_id, count, new_bytes, None
+    except subprocess.CalledProcessError as e:
+        return track_id, 0, 0, e.stderr.decode(errors='replace').strip()[-200:]
+    except Exception as e:
+        return track_id, 0, 0, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Package every track as HLS segments')
+    parser.add_argument(
+        '--metadata-dir',
+        type=Path,
+        default=Path(__file__).parent.parent / 'metadata',
+        help='Directory containing metadata_base.json'
+    )
+    parser.add_argument('--workers', type=int, default=4, help='ffmpeg processes (default: 4)')
+    parser.add_argument('--limit', type=int, default=0, help='Only package the first N tracks (0 = all)')
+    parser.add_argument('--download', action='store_true',
+                        help='Download uploaded audio when the local original is gone')
+    parser.add_argument('--upload', action='store_true',
+                        help='Upload new segments and playlists, record them in metadata and the manifest')
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        print("Error: ffmpeg not found on PATH", file=sys.stderr)
+        return 1
+
+    import batch_upload
+    from transcode import fetch_source
+
+    metadata = batch_upload.load_metadata(args.metadata_dir)
+    hls_dir = args.metadata_dir / HLS_DIR
+    tracks = [t for t in metadata['tracks'].values() if t.get('uploaded')]
+    jobs = [t for t in tracks if not playlist_path(hls_dir, t['id']).exists()]
+    if args.limit > 0:
+        jobs = jobs[:args.limit]
+    print(f"Tracks: {len(jobs)} to package, {len(tracks) - len(jobs)} packaged")
+
+    s3_client = batch_upload.get_s3_client() if (args.download or args.upload) else None
+    failed = 0
+    done = 0
+    segments = 0
+    new_bytes = 0
+
+    def collect(future, source: Path):
+        nonlocal failed, done, segments, new_bytes
+        track_id, count, written, error = future.result()
+        if source.parent == scratch_dir:
+            source.unlink(missing_ok=True)  # downloaded copy
+        if error:
+            print(f"  Error packaging {track_id}: {error}", file=sys.stderr)
+            failed += 1
+            return
+        done += 1
+        segments += count
+        new_bytes += written
+        if done % 25 == 0:
+            print(f"  {done}/{len(jobs)} packaged")
+
+    with tempfile.TemporaryDirectory(prefix='36247-hls-src-') as scratch, \
+            ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # Same bounded window as transcode.py: downloads overlap with ffmpeg
+        scratch_dir = Path(scratch)
+        pending = deque()
+        for track in jobs:
+            source = fetch_source(s3_client if args.download else None,
+                                  batch_upload.TRACKS_BUCKET, track, scratch_dir)
+            if source is None:
+                print(f"  Skip {track['id']}: no local original (use --download)")
+                continue
+            pending.append((executor.submit(_package_worker, (track['id'], str(source), str(hls_dir))), source))
+            while len(pending) >= args.workers * 2:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+
+    print(f"Packaged {done} ({segments} segments, {new_bytes / (1024 * 1024):.1f} MB new), failed {failed}")
+
+    if args.upload:
+        upload_packages(s3_client, args.metadata_dir, metadata, hls_dir)
+
+    return 0 if failed == 0 else 1
+
+
+def upload_packages(s3_client, metadata_dir: Path, metadata: dict, hls_dir: Path):
+    """Upload segments the bucket lacks, then each playlist, and record them on the tracks."""
+    import batch_upload
+    from sync_plan import list_inventory
+
+    inventory = list_inventory(s3_client, batch_upload.TRACKS_BUCKET, (segment_key(''),))
+    seg_dir = hls_dir / SEGMENT_DIR
+
+    packaged = []
+    wanted = {}
+    for track in metadata['tracks'].values():
+        playlist = playlist_path(hls_dir, track['id'])
+        if track.get('uploaded') and playlist.exists():
+            names = playlist_segments(playlist)
+            packaged.append((track, playlist, names))
+            wanted.update((segment_key(name), name) for name in names if segment_key(name) not in inventory)
+
+    def upload_segment(item):
+        key, name = item
+        return batch_upload.upload_file(s3_client, seg_dir / name, key, SEGMENT_TYPE)
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        results = dict(zip(wanted, executor.map(upload_segment, wanted.items())))
+    uploaded_bytes = sum((seg_dir / name).stat().st_size for key, name in wanted.items() if results[key])
+    print(f"Uploaded {sum(results.values())}/{len(wanted)} segment(s) "
+          f"({uploaded_bytes / (1024 * 1024):.1f} MB), {len(inventory)} already in bucket")
+
+    # A playlist is published only once all of its segments are in the bucket
+    playlists = 0
+    for track, playlist, names in packaged:
+        keys = [segment_key(name) for name in names]
+        if not all(key in inventory or results.get(key) for key in keys):
+            continue
+        key = playlist_key(track['id'])
+        if track.get('hls') != key:
+            if not batch_upload.upload_file(s3_client, playlist, key, PLAYLIST_TYPE):
+                continue
+            playlists += 1
+        track['hls'] = key
+        track['hls_segments'] = keys
+
+    batch_upload.save_metadata(metadata_dir, metadata)
+    batch_upload.upload_manifest(s3_client, batch_upload.build_manifest(metadata), writer='hls_package.py',
+                                 fields=('hls',))
+    print(f"Uploaded {playlists} playlist(s)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
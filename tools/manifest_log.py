@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+36247 Manifest Delta Log
+
+Instead of download -> mutate -> re-upload of the whole manifest, writers
+append small deltas to manifest.d/<seq>.json and a compaction step folds
+them into manifest.json.
+
+- Deltas are created with If-None-Match: *, so two writers can never claim
+  the same sequence number; the loser retries with the next one.
+- Compaction replaces manifest.json with If-Match on the ETag it read, so a
+  concurrent compaction can't clobber it. A lost race is harmless: the
+  deltas stay in the log and the next compaction folds them.
+- Pruned deltas free their keys, so a writer can win a sequence number the
+  base has already passed. append_delta re-reads the base after the put
+  and moves such a delta to a new sequence number.
+- Tools that rebuild the manifest from local metadata publish() their
+  tracks as a delta instead of overwriting manifest.json, limited to the
+  fields each tool owns.
+
+Delta format:
+    {"seq": 12, "created": "...", "writer": "upload.py",
+     "ops": [{"op": "add", "track": {...}},
+             {"op": "update", "id": "abc123", "fields": {...}}]}
+
+Usage:
+    python manifest_log.py status
+    python manifest_log.py compact
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import manifest_writer
+from core import get_client, lazy_import
+
+botocore_exceptions = lazy_import('botocore.exceptions')
+
+AWS_PROFILE = os.environ.get('AWS_PROFILE', 'personal')
+AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+TRACKS_BUCKET = os.environ.get('TRACKS_BUCKET', '36247-tracks.rmzi.world')
+MANIFEST_KEY = manifest_writer.MANIFEST_KEY
+DELTA_PREFIX = 'manifest.d/'
+APPEND_RETRIES = 5
+CONFLICT_CODES = {'PreconditionFailed', 'ConditionalRequestConflict'}
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def _is_conflict(e: Exception) -> bool:
+    return e.response.get('Error', {}).get('Code') in CONFLICT_CODES
+
+
+def delta_key(seq: int) -> str:
+    return f"{DELTA_PREFIX}{seq:010d}.json"
+
+
+def empty_manifest() -> dict:
+    return {'version': 1, 'generated': _now(), 'delta_seq': 0, 'tracks': []}
+
+
+def fetch_base(s3_client, bucket: str) -> tuple:
+    """Fetch manifest.json. Returns (manifest, etag); etag is None if missing."""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=MANIFEST_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return empty_manifest(), None
+    manifest = json.loads(response['Body'].read().decode('utf-8'))
+    manifest.setdefault('delta_seq', 0)
+    return manifest, response['ETag']
+
+
+def list_delta_seqs(s3_client, bucket: str) -> list:
+    """Sequence numbers of every delta in the log, ascending."""
+    seqs = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=DELTA_PREFIX):
+        for obj in page.get('Contents', []):
+            name = obj['Key'][len(DELTA_PREFIX):].split('.', 1)[0]
+            if name.isdigit():
+                seqs.append(int(name))
+    return sorted(seqs)
+
+
+def fetch_delta(s3_client, bucket: str, seq: int) -> dict:
+    response = s3_client.get_object(Bucket=bucket, Key=delta_key(seq))
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+
+def apply_ops(manifest: dict, ops: list):
+    """Apply delta ops to a manifest in place."""
+    by_id = {t['id']: t for t in manifest['tracks']}
+    for op in ops:
+        if op['op'] == 'add':
+            track = op['track']
+            if track['id'] in by_id:
+                by_id[track['id']].update(track)
+            else:
+                manifest['tracks'].append(track)
+                by_id[track['id']] = track
+        elif op['op'] == 'update':
+            if op['id'] in by_id:
+                by_id[op['id']].update(op['fields'])
+        else:
+            print(f"Warning: unknown delta op {op['op']!r}", file=sys.stderr)
+
+
+def load_manifest(s3_client, bucket: str) -> tuple:
+    """
+    Current view of the catalog: base manifest plus all pending deltas.
+
+    Returns (manifest, etag, pending_seqs). The etag is the base's, for a
+    later conditional compaction.
+    """
+    manifest, etag = fetch_base(s3_client, bucket)
+    pending = [s for s in list_delta_seqs(s3_client, bucket) if s > manifest['delta_seq']]
+    for seq in pending:
+        apply_ops(manifest, fetch_delta(s3_client, bucket, seq)['ops'])
+    return manifest, etag, pending
+
+
+def append_delta(s3_client, bucket: str, ops: list, writer: str) -> int | None:
+    """Append a delta with the next free sequence number. Returns its seq."""
+    if not ops:
+        return None
+
+    for attempt in range(APPEND_RETRIES):
+        seqs = list_delta_seqs(s3_client, bucket)
+        base, _ = fetch_base(s3_client, bucket)
+        seq = max(seqs + [base['delta_seq']]) + 1
+        body = {'seq': seq, 'created': _now(), 'writer': writer, 'ops': ops}
+        try:
+            s3_client.put_object(
+                Bucket=bucket, Key=delta_key(seq),
+                Body=manifest_writer.minify(body),
+                ContentType='application/json',
+                IfNoneMatch='*'
+            )
+        except botocore_exceptions.ClientError as e:
+            if not _is_conflict(e):
+                raise
+            print(f"  Delta {seq} taken by another writer, retrying...", file=sys.stderr)
+            time.sleep(0.2 * (attempt + 1))
+            continue
+
+        # Another writer's delta with this seq may have been compacted and
+        # pruned between our listing and the put: the put then succeeds,
+        # but at or below the base's watermark it is never read. A pruned
+        # key means the base is already past it, so checking the base
+        # after the put is enough.
+        base, _ = fetch_base(s3_client, bucket)
+        if seq > base['delta_seq']:
+            return seq
+        s3_client.delete_object(Bucket=bucket, Key=delta_key(seq))
+        print(f"  Delta {seq} already compacted past, retrying...", file=sys.stderr)
+
+    raise RuntimeError(f"Could not append manifest delta after {APPEND_RETRIES} attempts")
+
+
+def publish(s3_client, bucket: str, tracks: list, writer: str, fields: tuple = None,
+            sharded: bool = False, checkpoint: bool = False) -> bool:
+    """
+    Publish a writer's view of its tracks through the log.
+
+    Tracks missing from the current manifest (base plus pending deltas)
+    are added whole. For tracks already there, only the fields this writer
+    owns (`fields`; None = all) are compared, and the ones that differ are
+    written as update ops, so corrections other writers made to the other
+    fields (e.g. the metadata agent's tags) are kept. The ops go into one
+    delta, which is then compacted, and the watermark carries forward.
+
+    A checkpoint only appends the delta and, when sharded, uploads the
+    changed shards of the merged view; manifest.json is left for the
+    final publish of the run to compact.
+
+    Returns True once manifest.json holds the tracks (or nothing changed),
+    False if the compaction lost a race; the delta then stays in the log
+    for the next compaction.
+    """
+    manifest, _, pending = load_manifest(s3_client, bucket)
+    current = {t['id']: t for t in manifest['tracks']}
+    ops = []
+    for track in tracks:
+        existing = current.get(track['id'])
+        if existing is None:
+            ops.append({'op': 'add', 'track': track})
+            continue
+        changed = {k: v for k, v in track.items()
+                   if (fields is None or k in fields) and existing.get(k) != v}
+        if changed:
+            ops.append({'op': 'update', 'id': track['id'], 'fields': changed})
+
+    seq = append_delta(s3_client, bucket, ops, writer)
+    if seq is not None:
+        print(f"Wrote manifest delta {seq} ({len(ops)} track(s))")
+    if checkpoint or (seq is None and not pending):
+        if sharded:
+            apply_ops(manifest, ops)
+            manifest_writer.upload_shards(s3_client, bucket, manifest)
+        return True
+    return compact(s3_client, bucket, sharded=sharded)
+
+
+def compact(s3_client, bucket: str, sharded: bool = False, prune: bool = True) -> bool:
+    """
+    Fold pending deltas into manifest.json with a conditional put.
+
+    The compact variants (and shards) are only rewritten once the
+    conditional put of manifest.json has succeeded. Returns False if
+    another writer won the race.
+    """
+    manifest, etag, pending = load_manifest(s3_client, bucket)
+    if not pending:
+        print("No pending manifest deltas")
+        return True
+
+    manifest['delta_seq'] = pending[-1]
+    manifest['generated'] = _now()
+    variants = manifest_writer.encode_variants(manifest)
+
+    body, extra_args = variants[MANIFEST_KEY]
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3_client.put_object(Bucket=bucket, Key=MANIFEST_KEY, Body=body, **extra_args, **condition)
+    except botocore_exceptions.ClientError as e:
+        if not _is_conflict(e):
+            raise
+        print("Manifest changed during compaction; deltas left for the next run", file=sys.stderr)
+        return False
+
+    for key, (body, extra_args) in variants.items():
+        if key != MANIFEST_KEY:
+            s3_client.put_object(Bucket=bucket, Key=key, Body=body, **extra_args)
+    manifest_writer.report_sizes(variants)
+    if sharded:
+        manifest_writer.upload_shards(s3_client, bucket, manifest)
+
+    if prune:
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': delta_key(s)} for s in pending], 'Quiet': True}
+        )
+
+    print(f"Compacted {len(pending)} delta(s) through seq {pending[-1]}; "
+          f"manifest has {len(manifest['tracks'])} track(s)")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or compact the manifest delta log')
+    parser.add_argument('command', choices=['status', 'compact'])
+    parser.add_argument('--bucket', default=TRACKS_BUCKET, help=f'S3 bucket name (default: {TRACKS_BUCKET})')
+    parser.add_argument('--profile', default=AWS_PROFILE, help=f'AWS profile (default: {AWS_PROFILE})')
+    parser.add_argument('--sharded', action='store_true', help='Also rewrite manifest shards when compacting')
+    parser.add_argument('--keep-deltas', action='store_true', help='Do not delete deltas after compacting')
+    args = parser.parse_args()
+
+    s3_client = get_client('s3', args.profile, AWS_REGION, endpoint_url=os.environ.get('S3_ENDPOINT_URL'))
+
+    if args.command == 'status':
+        manifest, etag, pending = load_manifest(s3_client, args.bucket)
+        print(f"Base manifest: seq {manifest['delta_seq']}, ETag {etag}")
+        print(f"Pending deltas: {len(pending)}" + (f" ({pending[0]}..{pending[-1]})" if pending else ''))
+        print(f"Tracks (with pending deltas): {len(manifest['tracks'])}")
+        return 0
+
+    return 0 if compact(s3_client, args.bucket, args.sharded, prune=not args.keep_deltas) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
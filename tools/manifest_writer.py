@@ -0,0 +1,274 @@
+"""
+36247 Manifest Writer
+
+Encodes manifest.json into compact variants for the player:
+
+- manifest.min.json         minified JSON, same shape as manifest.json
+- manifest.min.json.gz/.br  the above, precompressed
+- manifest.columnar.json    versioned columnar layout with a shared string
+                            table (artist/album/path templates are interned)
+- search-index.json         trigram index for the player's track search
+                            (see search_index.py)
+- manifest.index.json       sharded mode: small index pointing at fixed-size,
+                            content-addressed shards under manifest/shards/
+
+Used by batch_upload.py and upload.py. brotli is optional; the .br variant
+is skipped when it isn't installed.
+"""
+
+import gzip
+import hashlib
+import json
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from search_index import SEARCH_INDEX_KEY, build_search_index
+
+MANIFEST_KEY = 'manifest.json'
+COLUMNAR_SCHEMA = '36247-manifest-columnar'
+COLUMNAR_VERSION = 1
+
+# Sharded mode
+INDEX_KEY = 'manifest.index.json'
+INDEX_SCHEMA = '36247-manifest-index'
+INDEX_VERSION = 1
+SHARD_PREFIX = 'manifest/shards/'
+SHARD_SIZE = 500
+
+# Player-facing fields, in column order. Kinds:
+#   raw       value stored as-is
+#   interned  index into the string table (-1 for null)
+#   template  like interned, but the track id is replaced by '{id}' first so
+#             'audio/<id>.mp3' collapses to one shared 'audio/{id}.mp3'
+#   flag      0/1
+COLUMNS = {
+    'id': 'raw',
+    'path': 'template',
+    'artist': 'interned',
+    'album': 'interned',
+    'title': 'raw',
+    'year': 'raw',
+    'duration': 'raw',
+    'artwork': 'template',
+    'artwork_thumb': 'interned',
+    'artwork_medium': 'interned',
+    'renditions': 'raw',
+    'hls': 'template',
+    'tagged': 'flag',
+}
+
+
+def encode_columnar(manifest: dict) -> dict:
+    """Convert a row-oriented manifest into the columnar layout."""
+    strings = []
+    index = {}
+
+    def intern(value):
+        if value is None:
+            return -1
+        if value not in index:
+            index[value] = len(strings)
+            strings.append(value)
+        return index[value]
+
+    columns = {name: [] for name in COLUMNS}
+    for track in manifest['tracks']:
+        track_id = track['id']
+        for name, kind in COLUMNS.items():
+            value = track.get(name)
+            if kind == 'interned':
+                value = intern(value)
+            elif kind == 'template':
+                value = intern(value.replace(track_id, '{id}') if value else None)
+            elif kind == 'flag':
+                value = 1 if value else 0
+            columns[name].append(value)
+
+    return {
+        'schema': COLUMNAR_SCHEMA,
+        'version': COLUMNAR_VERSION,
+        'generated': manifest.get('generated'),
+        'count': len(manifest['tracks']),
+        'strings': strings,
+        'columns': columns,
+    }
+
+
+def decode_columnar(columnar: dict) -> dict:
+    """Inverse of encode_columnar (player-facing fields only)."""
+    if columnar.get('schema') != COLUMNAR_SCHEMA or columnar.get('version') != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar manifest: {columnar.get('schema')} v{columnar.get('version')}")
+
+    strings = columnar['strings']
+    columns = columnar['columns']
+    tracks = []
+    for i in range(columnar['count']):
+        track_id = columns['id'][i]
+        track = {}
+        for name, kind in COLUMNS.items():
+            if name not in columns:
+                track[name] = None  # column added after this manifest was written
+                continue
+            value = columns[name][i]
+            if kind in ('interned', 'template'):
+                value = strings[value] if value >= 0 else None
+                if kind == 'template' and value:
+                    value = value.replace('{id}', track_id)
+            elif kind == 'flag':
+                value = bool(value)
+            track[name] = value
+        tracks.append(track)
+
+    return {'version': 1, 'generated': columnar.get('generated'), 'tracks': tracks}
+
+
+def minify(obj) -> bytes:
+    """Serialize without whitespace."""
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def encode_variants(manifest: dict) -> dict:
+    """
+    Encode every manifest variant.
+
+    Returns {key: (body, extra_args)} ready for put_object. The pretty
+    manifest.json is kept so existing clients keep working.
+    """
+    pretty = json.dumps(manifest, indent=2).encode('utf-8')
+    minified = minify(manifest)
+    columnar = minify(encode_columnar(manifest))
+    search = minify(build_search_index(manifest))
+
+    json_type = {'ContentType': 'application/json'}
+    variants = {
+        MANIFEST_KEY: (pretty, json_type),
+        'manifest.min.json': (minified, json_type),
+        'manifest.min.json.gz': (gzip.compress(minified, 9, mtime=0),
+                                 {**json_type, 'ContentEncoding': 'gzip'}),
+        'manifest.columnar.json': (columnar, json_type),
+        'manifest.columnar.json.gz': (gzip.compress(columnar, 9, mtime=0),
+                                      {**json_type, 'ContentEncoding': 'gzip'}),
+        SEARCH_INDEX_KEY: (gzip.compress(search, 9, mtime=0),
+                           {**json_type, 'ContentEncoding': 'gzip'}),
+    }
+    if brotli is not None:
+        variants['manifest.min.json.br'] = (brotli.compress(minified, quality=11),
+                                            {**json_type, 'ContentEncoding': 'br'})
+        variants['manifest.columnar.json.br'] = (brotli.compress(columnar, quality=11),
+                                                 {**json_type, 'ContentEncoding': 'br'})
+    return variants
+
+
+def report_sizes(variants: dict):
+    """Print the byte size of each variant relative to manifest.json."""
+    baseline = len(variants[MANIFEST_KEY][0])
+    for key, (body, _) in variants.items():
+        print(f"  {key:<28} {len(body):>10,} bytes ({len(body) / baseline:6.1%})")
+
+
+def build_shards(manifest: dict, shard_size: int = SHARD_SIZE) -> tuple:
+    """
+    Partition tracks into fixed-size shards keyed by content hash.
+
+    Shards hold only their tracks (no position or timestamp), so a shard
+    whose tracks didn't change keeps its key. Appending tracks only touches
+    the last shard. Returns (index, {key: body}).
+    """
+    tracks = manifest['tracks']
+    shards = {}
+    entries = []
+    for start in range(0, len(tracks), shard_size):
+        chunk = tracks[start:start + shard_size]
+        body = minify({'tracks': chunk})
+        key = f"{SHARD_PREFIX}{hashlib.sha256(body).hexdigest()[:16]}.json"
+        shards[key] = body
+        entries.append({'key': key, 'count': len(chunk), 'bytes': len(body)})
+
+    index = {
+        'schema': INDEX_SCHEMA,
+        'version': INDEX_VERSION,
+        'generated': manifest.get('generated'),
+        'count': len(tracks),
+        'shard_size': shard_size,
+        'shards': entries,
+    }
+    return index, shards
+
+
+def fetch_index(s3_client, bucket: str) -> dict | None:
+    """Fetch the current shard index, or None if there isn't one yet."""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=INDEX_KEY)
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+
+def upload_shards(s3_client, bucket: str, manifest: dict, shard_size: int = SHARD_SIZE,
+                  verbose: bool = True) -> dict:
+    """
+    Upload changed shards, then the index.
+
+    Shards already listed in the live index are skipped. Shards are
+    immutable and cached for a year; the index is never cached. It is
+    written last so clients never see an index pointing at a missing shard.
+
+    Afterwards, shards referenced by neither the new nor the previous index
+    are deleted. Keeping the previous generation gives a client that just
+    read the old index time to fetch its shards.
+    """
+    previous = fetch_index(s3_client, bucket)
+    existing = {entry['key'] for entry in previous['shards']} if previous else set()
+
+    index, shards = build_shards(manifest, shard_size)
+    uploaded = 0
+    for key, body in shards.items():
+        if key in existing:
+            continue
+        s3_client.put_object(
+            Bucket=bucket, Key=key, Body=body,
+            ContentType='application/json',
+            CacheControl='max-age=31536000, immutable'
+        )
+        uploaded += 1
+
+    s3_client.put_object(
+        Bucket=bucket, Key=INDEX_KEY, Body=minify(index),
+        ContentType='application/json',
+        CacheControl='no-cache'
+    )
+
+    pruned = prune_shards(s3_client, bucket, set(shards) | existing)
+
+    if verbose:
+        print(f"  Shards: {uploaded} uploaded, {len(shards) - uploaded} unchanged, {pruned} pruned "
+              f"({len(shards)} total, {shard_size} tracks each)")
+    return {'uploaded': uploaded, 'unchanged': len(shards) - uploaded, 'total': len(shards),
+            'pruned': pruned}
+
+
+def prune_shards(s3_client, bucket: str, keep: set) -> int:
+    """Delete shard objects not in keep. Returns how many were deleted."""
+    stale = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=SHARD_PREFIX):
+        stale.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Key'] not in keep)
+    for start in range(0, len(stale), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': k} for k in stale[start:start + 1000]], 'Quiet': True}
+        )
+    return len(stale)
+
+
+if __name__ == '__main__':
+    # Report sizes for a local manifest: python manifest_writer.py manifest.json
+    if len(sys.argv) != 2:
+        print("Usage: manifest_writer.py <manifest.json>", file=sys.stderr)
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        report_sizes(encode_variants(json.load(f)))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+36247 Metadata Store
+
+SQLite replacement for metadata/metadata_base.json. Rewriting the whole
+JSON file at every checkpoint makes a full run O(n^2); here each track is
+one row and updates are per-track upserts in their own transaction.
+
+- Rows are keyed by file_key (the original file path, as in the JSON).
+  id, uploaded, tagged, artist and album are indexed columns; the full
+  track dict is stored as JSON in `data`.
+- import/export convert to and from the metadata_base.json format, so
+  tools that only read JSON keep working.
+- extract_metadata.py, batch_upload.py, artwork_sizes.py and
+  migrate_artwork.py use the store whenever metadata/metadata.sqlite3
+  exists; the metadata agent writes tag fixes into it with --metadata-db.
+
+Usage:
+    python metadata_store.py import ../metadata     # metadata_base.json -> metadata.sqlite3
+    python metadata_store.py export ../metadata     # metadata.sqlite3 -> metadata_base.json
+    python metadata_store.py stats  ../metadata
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from upload_journal import write_json_atomic
+
+STORE_FILE = 'metadata.sqlite3'
+METADATA_FILE = 'metadata_base.json'
+SCHEMA_VERSION = 1
+INDEXED_COLUMNS = ('id', 'uploaded', 'tagged', 'artist', 'album')
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def store_path(metadata_dir: Path) -> Path:
+    return Path(metadata_dir) / STORE_FILE
+
+
+def open_store(metadata_dir: Path, create: bool = False):
+    """The directory's MetadataStore, or None if it has none and create is False."""
+    path = store_path(metadata_dir)
+    if not create and not path.exists():
+        return None
+    return MetadataStore(path)
+
+
+class MetadataStore:
+    """Tracks keyed by file_key in SQLite, safe to share between threads."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS tracks (
+                file_key TEXT PRIMARY KEY,
+                id TEXT NOT NULL,
+                uploaded INTEGER NOT NULL DEFAULT 0,
+                tagged INTEGER NOT NULL DEFAULT 0,
+                artist TEXT,
+                album TEXT,
+                data TEXT NOT NULL
+            )
+        ''')
+        for column in INDEXED_COLUMNS:
+            self.db.execute(f'CREATE INDEX IF NOT EXISTS tracks_{column} ON tracks ({column})')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('version', ?)", (str(SCHEMA_VERSION),))
+
+    @contextmanager
+    def transaction(self):
+        """Group several writes into one transaction."""
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def _write(self, sql: str, params=()):
+        # Outside transaction() each statement autocommits on its own
+        with self.lock:
+            return self.db.execute(sql, params)
+
+    # Reads
+
+    def get(self, file_key: str) -> dict | None:
+        with self.lock:
+            row = self.db.execute('SELECT data FROM tracks WHERE file_key = ?', (file_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_id(self, track_id: str) -> tuple:
+        """(file_key, track) for a track id, or (None, None)."""
+        with self.lock:
+            row = self.db.execute('SELECT file_key, data FROM tracks WHERE id = ?', (track_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, None)
+
+    @staticmethod
+    def _where(where: dict) -> tuple:
+        """SQL WHERE clause and params for equality filters on indexed columns."""
+        unknown = set(where) - set(INDEXED_COLUMNS)
+        if unknown:
+            raise ValueError(f"Not an indexed column: {', '.join(sorted(unknown))}")
+        if not where:
+            return '', []
+        clause = ' WHERE ' + ' AND '.join(f'{column} = ?' for column in where)
+        return clause, [int(v) if isinstance(v, bool) else v for v in where.values()]
+
+    def tracks(self, **where) -> dict:
+        """{file_key: track}, optionally filtered on indexed columns (e.g. uploaded=False)."""
+        clause, params = self._where(where)
+        with self.lock:
+            rows = self.db.execute(f'SELECT file_key, data FROM tracks{clause} ORDER BY file_key', params).fetchall()
+        return {file_key: json.loads(data) for file_key, data in rows}
+
+    def count(self, **where) -> int:
+        clause, params = self._where(where)
+        with self.lock:
+            return self.db.execute(f'SELECT COUNT(*) FROM tracks{clause}', params).fetchone()[0]
+
+    def get_meta(self, key: str) -> str | None:
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    # Writes
+
+    def put(self, file_key: str, track: dict):
+        """Insert or replace one track."""
+        self._write(
+            'INSERT OR REPLACE INTO tracks (file_key, id, uploaded, tagged, artist, album, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (file_key, track['id'], int(bool(track.get('uploaded'))), int(bool(track.get('tagged'))),
+             track.get('artist'), track.get('album'), json.dumps(track))
+        )
+
+    def put_many(self, tracks: dict):
+        """Upsert {file_key: track} in a single transaction."""
+        with self.transaction():
+            for file_key, track in tracks.items():
+                self.put(file_key, track)
+
+    def move(self, old_key: str, new_key: str, track: dict):
+        """Re-key a track (file renamed or moved) atomically."""
+        with self.transaction():
+            self._write('DELETE FROM tracks WHERE file_key = ?', (old_key,))
+            self.put(new_key, track)
+
+    def delete(self, file_key: str):
+        self._write('DELETE FROM tracks WHERE file_key = ?', (file_key,))
+
+    def clear(self):
+        self._write('DELETE FROM tracks')
+
+    def touch(self):
+        """Record the generation time, as metadata_base.json's 'generated'."""
+        self._write("INSERT OR REPLACE INTO meta VALUES ('generated', ?)", (now_iso(),))
+
+    # JSON interchange
+
+    def load(self) -> dict:
+        """Everything in metadata_base.json format."""
+        return {'version': 1, 'generated': self.get_meta('generated'), 'tracks': self.tracks()}
+
+    def import_json(self, metadata: dict, replace: bool = True) -> int:
+        with self.transaction():
+            if replace:
+                self.clear()
+            for file_key, track in metadata.get('tracks', {}).items():
+                self.put(file_key, track)
+            if metadata.get('generated'):
+                self._write("INSERT OR REPLACE INTO meta VALUES ('generated', ?)", (metadata['generated'],))
+        return len(metadata.get('tracks', {}))
+
+    def export_json(self, metadata_file: Path) -> int:
+        """Write metadata_base.json atomically."""
+        metadata = self.load()
+        write_json_atomic(metadata_file, metadata)
+        return len(metadata['tracks'])
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the 36247 SQLite metadata store')
+    parser.add_argument('command', choices=['import', 'export', 'stats'])
+    parser.add_argument(
+        'metadata_dir',
+        type=Path,
+        nargs='?',
+        default=Path(__file__).parent.parent / 'metadata',
+        help='Directory containing metadata_base.json / metadata.sqlite3'
+    )
+    args = parser.parse_args()
+
+    json_file = args.metadata_dir / METADATA_FILE
+
+    if args.command == 'import':
+        if not json_file.exists():
+            print(f"Error: {json_file} not found", file=sys.stderr)
+            return 1
+        with open(json_file) as f:
+            metadata = json.load(f)
+        store = open_store(args.metadata_dir, create=True)
+        print(f"Imported {store.import_json(metadata)} track(s) into {store.path}")
+        store.close()
+        return 0
+
+    store = open_store(args.metadata_dir)
+    if store is None:
+        print(f"Error: {store_path(args.metadata_dir)} not found (run import first)", file=sys.stderr)
+        return 1
+
+    if args.command == 'export':
+        print(f"Exported {store.export_json(json_file)} track(s) to {json_file}")
+    else:
+        print(f"Store: {store.path} ({store.path.stat().st_size / 1024:,.0f} KB)")
+        print(f"Generated: {store.get_meta('generated')}")
+        print(f"Tracks: {store.count()}")
+        print(f"  Uploaded: {store.count(uploaded=True)}")
+        print(f"  Tagged: {store.count(tagged=True)}")
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
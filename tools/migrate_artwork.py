@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+36247 Artwork Migration
+
+Moves metadata/artwork from one file per track (<track_id>.jpg) to the
+content-addressed layout (<image_hash>.jpg) that extract_metadata.py now
+writes, so each unique cover is stored and uploaded once.
+
+Steps:
+1. Hash every track's artwork file; keep one copy per hash, delete the rest
+2. Point artwork_path / artwork_hash at the shared file
+3. With --s3: server-side copy each unique cover to artwork/<hash>.<ext>,
+   point s3_artwork_path at the copies that succeeded, re-publish the
+   manifest, and with --delete-old remove the old keys
+
+Without --s3 only local files change; s3_artwork_path keeps naming the
+per-track keys that are actually in the bucket.
+
+Reports how many bytes the deduplication saves.
+"""
+
+import argparse
+import shutil
+import sys
+from pathlib import Path
+
+import batch_upload
+from extract_metadata import artwork_hash
+
+
+def plan_migration(metadata: dict, artwork_dir: Path) -> dict:
+    """
+    Work out the new layout without touching anything.
+
+    Returns {'moves': {old_path: new_path}, 'tracks': {file_key: new_path},
+    'bytes_before': int, 'bytes_after': int, 'missing': int}.
+    """
+    moves = {}
+    tracks = {}
+    sizes = {}
+    missing = 0
+    for file_key, track in metadata['tracks'].items():
+        if not track.get('artwork_path'):
+            continue
+        old_path = Path(track['artwork_path'])
+        if not old_path.exists():
+            missing += 1
+            continue
+        if old_path not in moves:
+            data = old_path.read_bytes()
+            moves[old_path] = artwork_dir / f"{artwork_hash(data)}{old_path.suffix}"
+            sizes[old_path] = len(data)
+        tracks[file_key] = moves[old_path]
+
+    unique = {}
+    for old_path, new_path in moves.items():
+        unique.setdefault(new_path, sizes[old_path])
+
+    return {
+        'moves': moves,
+        'tracks': tracks,
+        'bytes_before': sum(sizes.values()),
+        'bytes_after': sum(unique.values()),
+        'missing': missing,
+    }
+
+
+def materialize(plan: dict):
+    """Create each content-addressed file from the first copy that maps to it."""
+    for old_path, new_path in plan['moves'].items():
+        if not new_path.exists():
+            shutil.copyfile(old_path, new_path)
+
+
+def remove_old(plan: dict) -> int:
+    """Delete the per-track files once metadata points at the shared ones."""
+    removed = 0
+    for old_path, new_path in plan['moves'].items():
+        if old_path != new_path and old_path.exists():
+            old_path.unlink()
+            removed += 1
+    return removed
+
+
+def copy_keys(s3_client, bucket: str, key_moves: dict) -> set:
+    """
+    Server-side copy each unique cover to its new key.
+
+    Returns the new keys that now exist (copied, or unchanged by the move);
+    a failed copy is reported and left out.
+    """
+    from botocore.exceptions import ClientError
+
+    copied = set()
+    failed = set()
+    for old_key, new_key in key_moves.items():
+        if old_key == new_key:
+            copied.add(new_key)
+            continue
+        if new_key in copied or new_key in failed:
+            continue
+        try:
+            s3_client.copy_object(
+                Bucket=bucket, Key=new_key,
+                CopySource={'Bucket': bucket, 'Key': old_key},
+                MetadataDirective='COPY'
+            )
+            copied.add(new_key)
+        except ClientError as e:
+            print(f"  Error copying {old_key} -> {new_key}: {e}", file=sys.stderr)
+            failed.add(new_key)
+    return copied
+
+
+def delete_keys(s3_client, bucket: str, keys: list):
+    """Delete keys in batches of 1000 (the delete_objects limit)."""
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': k} for k in keys[start:start + 1000]], 'Quiet': True}
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate artwork to content-addressed storage')
+    parser.add_argument(
+        '--metadata-dir',
+        type=Path,
+        default=Path(__file__).parent.parent / 'metadata',
+        help='Directory containing metadata_base.json and artwork'
+    )
+    parser.add_argument('--dry-run', action='store_true', help='Report savings without changing anything')
+    parser.add_argument('--s3', action='store_true', help='Also migrate uploaded artwork in the bucket')
+    parser.add_argument('--delete-old', action='store_true',
+                        help='With --s3, delete the old per-track keys after re-publishing the manifest')
+    parser.add_argument('--bucket', default=batch_upload.TRACKS_BUCKET,
+                        help=f'S3 bucket name (default: {batch_upload.TRACKS_BUCKET})')
+    args = parser.parse_args()
+
+    batch_upload.TRACKS_BUCKET = args.bucket
+    metadata = batch_upload.load_metadata(args.metadata_dir)
+    artwork_dir = args.metadata_dir / 'artwork'
+
+    plan = plan_migration(metadata, artwork_dir)
+    saved = plan['bytes_before'] - plan['bytes_after']
+    unique = len(set(plan['moves'].values()))
+    print(f"Artwork files: {len(plan['moves'])} -> {unique} unique cover(s)")
+    print(f"Tracks with artwork: {len(plan['tracks'])} ({plan['missing']} missing file(s) skipped)")
+    print(f"Bytes: {plan['bytes_before']:,} -> {plan['bytes_after']:,} "
+          f"(saves {saved:,}, {saved / max(plan['bytes_before'], 1):.0%})")
+
+    if args.dry_run:
+        return 0
+
+    # New files first, then metadata, then old files: a crash at any point
+    # leaves every artwork_path pointing at a file that exists
+    materialize(plan)
+
+    # s3_artwork_path only moves once the object exists under the new key;
+    # without --s3 the old per-track keys stay in place and in use
+    key_moves = {}
+    for file_key, new_path in plan['tracks'].items():
+        track = metadata['tracks'][file_key]
+        track['artwork_path'] = str(new_path)
+        track['artwork_hash'] = new_path.stem
+        if track.get('s3_artwork_path'):
+            key_moves[track['s3_artwork_path']] = f"artwork/{new_path.name}"
+
+    s3_client = None
+    moved = {}
+    if args.s3 and key_moves:
+        s3_client = batch_upload.get_s3_client()
+        copied = copy_keys(s3_client, args.bucket, key_moves)
+        moved = {old: new for old, new in key_moves.items() if new in copied}
+        for track in metadata['tracks'].values():
+            if track.get('s3_artwork_path') in moved:
+                track['s3_artwork_path'] = moved[track['s3_artwork_path']]
+        print(f"  Copied {len(set(moved.values()))} unique cover(s) in S3, "
+              f"{len(key_moves) - len(moved)} key(s) left in place")
+
+    batch_upload.save_metadata(args.metadata_dir, metadata)
+    removed = remove_old(plan)
+    print(f"Local: metadata updated, removed {removed} per-track file(s)")
+
+    if moved:
+        # The manifest must point at the new keys before the old ones go
+        published = batch_upload.upload_manifest(s3_client, batch_upload.build_manifest(metadata),
+                                                 writer='migrate_artwork.py', fields=('artwork',))
+        if args.delete_old and not published:
+            print("  Manifest not re-published; old artwork keys kept", file=sys.stderr)
+            return 1
+        if args.delete_old:
+            old_keys = [k for k, v in moved.items() if k != v]
+            delete_keys(s3_client, args.bucket, old_keys)
+            print(f"  Deleted {len(old_keys)} old artwork key(s)")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+36247 Search Index
+
+Builds search-index.json, a trigram index over the same text the player's
+filterTracks() searches: "<artist> <album> <title> <year>", lowercased.
+
+A query of three or more characters is answered by intersecting the
+postings of its trigrams. Only the surviving candidates need the exact
+substring check, so results match the linear scan exactly. Shorter queries
+still fall back to the scan in the player.
+
+Format (schema 36247-search-index, version 1):
+    {
+      "schema": "36247-search-index", "version": 1,
+      "generated": <manifest generated>, "count": <tracks>,
+      "grams": ["  d", " dj", ...],          sorted trigrams
+      "postings": [[0, 3, 1, ...], ...]      delta-encoded track positions
+    }
+
+Positions index manifest['tracks'] in order. The player only uses the index
+when `generated` and `count` match the manifest it loaded.
+"""
+
+SEARCH_INDEX_KEY = 'search-index.json'
+SEARCH_SCHEMA = '36247-search-index'
+SEARCH_VERSION = 1
+GRAM_SIZE = 3
+
+
+def search_text(track: dict) -> str:
+    """The string filterTracks() matches against, built the same way."""
+    parts = [track.get(k) for k in ('artist', 'album', 'title', 'year')]
+    return ' '.join('' if p is None else str(p) for p in parts).lower()
+
+
+def build_search_index(manifest: dict) -> dict:
+    """Build the trigram index for a manifest."""
+    postings = {}
+    for position, track in enumerate(manifest['tracks']):
+        text = search_text(track)
+        grams = {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+        for gram in grams:
+            postings.setdefault(gram, []).append(position)
+
+    grams = sorted(postings)
+    encoded = []
+    for gram in grams:
+        previous = 0
+        deltas = []
+        for position in postings[gram]:
+            deltas.append(position - previous)
+            previous = position
+        encoded.append(deltas)
+
+    return {
+        'schema': SEARCH_SCHEMA,
+        'version': SEARCH_VERSION,
+        'generated': manifest.get('generated'),
+        'count': len(manifest['tracks']),
+        'grams': grams,
+        'postings': encoded,
+    }
+
+
+def query_search_index(index: dict, tracks: list, query: str) -> list:
+    """
+    Reference implementation of the player's lookup: track positions whose
+    search text contains query. Short queries fall back to a scan.
+    """
+    query = query.lower()
+    if len(query) < GRAM_SIZE:
+        return [i for i, t in enumerate(tracks) if query in search_text(t)]
+
+    lookup = dict(zip(index['grams'], index['postings']))
+    candidates = None
+    for i in range(len(query) - GRAM_SIZE + 1):
+        deltas = lookup.get(query[i:i + GRAM_SIZE])
+        if deltas is None:
+            return []
+        positions = set()
+        position = 0
+        for delta in deltas:
+            position += delta
+            positions.add(position)
+        candidates = positions if candidates is None else candidates & positions
+        if not candidates:
+            return []
+
+    return sorted(i for i in candidates if query in search_text(tracks[i]))
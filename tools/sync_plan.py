@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+36247 Sync Planner
+
+Diffs local metadata against what is actually in the tracks bucket. The
+bucket is listed once: audio/ and artwork/ are paged through with
+list_objects_v2 into an in-memory {key: (size, etag)} inventory, with no
+per-object HEAD requests. Every track is then classified in a single pass:
+
+- upload:  not uploaded, not in the bucket
+- present: not uploaded, but the object is already there (size matches);
+           only the metadata needs marking
+- repair:  marked uploaded, but the object is missing or the wrong size,
+           and the original file is still available to re-upload
+- lost:    marked uploaded and missing, with no original to re-upload
+- orphan:  objects referenced by neither the metadata nor the manifest
+
+With --apply, present tracks are marked uploaded, audio repairs are
+un-marked so the next batch_upload.py run re-uploads them, and missing
+artwork is re-uploaded directly. Orphans are only reported unless
+--delete-orphans is given.
+
+Works against moto via S3_ENDPOINT_URL (see batch_upload.py).
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+import batch_upload
+import manifest_log
+
+PREFIXES = ('audio/', 'artwork/')
+ARTWORK_FIELDS = ('s3_artwork_path', 's3_artwork_thumb', 's3_artwork_medium')
+
+
+def list_inventory(s3_client, bucket: str, prefixes=PREFIXES) -> dict:
+    """{key: {'size': int, 'etag': str}} for every object under prefixes."""
+    inventory = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for prefix in prefixes:
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', ()):
+                inventory[obj['Key']] = {'size': obj['Size'], 'etag': obj['ETag'].strip('"')}
+    return inventory
+
+
+def local_md5(path: Path) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def etag_matches(obj: dict, path: Path) -> bool:
+    """Compare a single-part ETag (the MD5) with the local file; multipart ETags can't be checked."""
+    if '-' in obj['etag']:
+        return True
+    return local_md5(path) == obj['etag']
+
+
+def audio_key(track: dict) -> str:
+    """Where batch_upload.py puts (or put) this track's audio."""
+    return track.get('s3_path') or f"audio/{track['id']}.mp3"
+
+
+def build_plan(metadata: dict, inventory: dict, manifest: dict = None, verify_etag: bool = False) -> dict:
+    """Classify every track and bucket object in one pass over each."""
+    plan = {'upload': [], 'present': [], 'repair': [], 'lost': [], 'artwork': [], 'orphan': [], 'ok': 0}
+    referenced = set()
+
+    for file_key, track in metadata['tracks'].items():
+        key = audio_key(track)
+        referenced.add(key)
+        referenced.update(track[f] for f in ARTWORK_FIELDS if track.get(f))
+        referenced.update(r['path'] for r in (track.get('renditions') or {}).values())
+        referenced.update(track.get('hls_segments') or ())
+        if track.get('hls'):
+            referenced.add(track['hls'])
+
+        original = Path(file_key)
+        local_size = original.stat().st_size if original.exists() else None
+        obj = inventory.get(key)
+        intact = obj is not None and (local_size is None or obj['size'] == local_size)
+        if intact and verify_etag and local_size is not None:
+            intact = etag_matches(obj, original)
+
+        entry = {'file': file_key, 'id': track['id'], 'key': key}
+        if not track.get('uploaded'):
+            plan['present' if intact else 'upload'].append(entry)
+        elif intact:
+            plan['ok'] += 1
+        elif local_size is not None:
+            plan['repair'].append({**entry, 'reason': 'missing' if obj is None else 'size mismatch'})
+        else:
+            plan['lost'].append(entry)
+
+        artwork_key = track.get('s3_artwork_path')
+        if track.get('uploaded') and artwork_key and artwork_key not in inventory:
+            plan['artwork'].append({'file': file_key, 'key': artwork_key, 'path': track.get('artwork_path')})
+
+    # Objects published by upload.py or the agent live only in the manifest
+    for track in (manifest or {}).get('tracks', ()):
+        referenced.update(v for v in (track.get('path'), track.get('artwork'),
+                                      track.get('artwork_thumb'), track.get('artwork_medium'),
+                                      track.get('hls')) if v)
+        referenced.update(r['path'] for r in (track.get('renditions') or {}).values())
+
+    plan['orphan'] = [
+        {'key': key, 'size': inventory[key]['size']} for key in sorted(inventory) if key not in referenced
+    ]
+    return plan
+
+
+def apply_plan(metadata: dict, plan: dict) -> list:
+    """Mark present tracks uploaded and un-mark audio repairs; returns changed file keys."""
+    changed = []
+    for entry in plan['present']:
+        track = metadata['tracks'][entry['file']]
+        track['s3_path'] = entry['key']
+        track['uploaded'] = True
+        changed.append(entry['file'])
+    for entry in plan['repair']:
+        metadata['tracks'][entry['file']]['uploaded'] = False
+        changed.append(entry['file'])
+    return changed
+
+
+def print_plan(plan: dict):
+    print(f"  In sync:  {plan['ok']}")
+    print(f"  Upload:   {len(plan['upload'])}")
+    print(f"  Present:  {len(plan['present'])} (already in bucket, only metadata needs marking)")
+    print(f"  Repair:   {len(plan['repair'])}")
+    for entry in plan['repair'][:10]:
+        print(f"    {entry['key']} ({entry['reason']})")
+    print(f"  Lost:     {len(plan['lost'])} (uploaded, missing, original gone)")
+    for entry in plan['lost'][:10]:
+        print(f"    {entry['key']} <- {Path(entry['file']).name}")
+    print(f"  Artwork:  {len(plan['artwork'])} missing cover(s)")
+    orphan_bytes = sum(o['size'] for o in plan['orphan'])
+    print(f"  Orphans:  {len(plan['orphan'])} ({orphan_bytes / (1024 * 1024):.1f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff local metadata against the tracks bucket')
+    parser.add_argument(
+        '--metadata-dir',
+        type=Path,
+        default=Path(__file__).parent.parent / 'metadata',
+        help='Directory containing metadata_base.json and artwork'
+    )
+    parser.add_argument('--bucket', default=batch_upload.TRACKS_BUCKET,
+                        help=f'S3 bucket name (default: {batch_upload.TRACKS_BUCKET})')
+    parser.add_argument('--verify-etag', action='store_true',
+                        help='Also compare single-part ETags with local MD5s (reads every local original)')
+    parser.add_argument('--apply', action='store_true',
+                        help='Mark present tracks uploaded, queue repairs, re-upload missing artwork')
+    parser.add_argument('--delete-orphans', action='store_true', help='Delete orphaned objects')
+    parser.add_argument('--json', action='store_true', help='Print the full plan as JSON')
+    args = parser.parse_args()
+
+    batch_upload.TRACKS_BUCKET = args.bucket
+    s3_client = batch_upload.get_s3_client()
+    metadata = batch_upload.load_metadata(args.metadata_dir)
+
+    print(f"Listing s3://{args.bucket}/{{{','.join(PREFIXES)}}}...")
+    inventory = list_inventory(s3_client, args.bucket)
+    print(f"  {len(inventory)} object(s)")
+    manifest, _, _ = manifest_log.load_manifest(s3_client, args.bucket)
+
+    plan = build_plan(metadata, inventory, manifest, args.verify_etag)
+    if args.json:
+        print(json.dumps(plan, indent=2))
+    else:
+        print_plan(plan)
+
+    if args.apply:
+        changed = apply_plan(metadata, plan)
+        reuploaded = 0
+        for entry in plan['artwork']:
+            path = Path(entry['path'] or '')
+            if path.exists() and batch_upload.upload_file(
+                    s3_client, path, entry['key'], batch_upload.get_content_type(path)):
+                reuploaded += 1
+        batch_upload.save_metadata(args.metadata_dir, metadata)
+        print(f"Applied: {len(changed)} track(s) updated, {reuploaded} cover(s) re-uploaded")
+        if plan['repair']:
+            print("Run batch_upload.py to re-upload the repaired tracks")
+
+    if args.delete_orphans and plan['orphan']:
+        from migrate_artwork import delete_keys
+        delete_keys(s3_client, args.bucket, [o['key'] for o in plan['orphan']])
+        print(f"Deleted {len(plan['orphan'])} orphaned object(s)")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
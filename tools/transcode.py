@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+36247 Transcoding Ladder
+
+Encodes every uploaded track into a bitrate ladder so the player can stream
+a cheaper rendition than the full-bitrate original:
+
+- 96 kbps:  cellular / save-data
+- 160 kbps: default
+- 320 kbps: fast connections (only when the source is above it)
+
+Each track is decoded once by ffmpeg, which writes every missing rung in a
+single pass. Tracks run in a process pool. Renditions are stored as
+metadata/renditions/<id>/<kbps>.mp3 and uploaded as audio/<kbps>/<id>.mp3.
+Rungs already on disk are skipped, and rungs at or above the source bitrate
+are never produced, since they would only be bigger, not better.
+
+The source is the local original when it still exists; otherwise the
+uploaded audio is downloaded to a temp file. With --upload, each track gets
+a `renditions` map ({kbps: {path, size}}), which the manifest exposes.
+
+Requires ffmpeg with libmp3lame on PATH.
+"""
+
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+LADDER = (96, 160, 320)
+RENDITIONS_DIR = 'renditions'
+
+
+def rendition_path(renditions_dir: Path, track_id: str, kbps: int) -> Path:
+    return renditions_dir / track_id / f"{kbps}.mp3"
+
+
+def rendition_key(track_id: str, kbps: int) -> str:
+    return f"audio/{kbps}/{track_id}.mp3"
+
+
+def wanted_rungs(track: dict, ladder=LADDER) -> list:
+    """Rungs below the source bitrate (all of them if it is unknown)."""
+    source_kbps = (track.get('bitrate') or 0) // 1000
+    return [kbps for kbps in ladder if not source_kbps or kbps < source_kbps]
+
+
+def encode(source: Path, outputs: dict):
+    """One ffmpeg run: decode source once, write {kbps: path} as CBR MP3."""
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', str(source)]
+    for kbps, path in outputs.items():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cmd += ['-map', '0:a:0', '-map_metadata', '-1', '-c:a', 'libmp3lame',
+                '-b:a', f'{kbps}k', str(path.with_name(f".{path.name}.tmp.mp3"))]
+    subprocess.run(cmd, check=True, capture_output=True)
+    for path in outputs.values():
+        path.with_name(f".{path.name}.tmp.mp3").replace(path)
+
+
+def _transcode_worker(args: tuple) -> tuple:
+    """Process pool entry point. Returns (track_id, {kbps: size}, error)."""
+    track_id, source, outputs = args
+    try:
+        encode(Path(source), outputs)
+        return track_id, {kbps: path.stat().st_size for kbps, path in outputs.items()}, None
+    except subprocess.CalledProcessError as e:
+        return track_id, {}, e.stderr.decode(errors='replace').strip()[-200:]
+    except Exception as e:
+        return track_id, {}, str(e)
+
+
+def plan_jobs(tracks: list, renditions_dir: Path, ladder=LADDER) -> tuple:
+    """(jobs needing a local original or download, count of tracks already complete)."""
+    jobs = []
+    complete = 0
+    for track in tracks:
+        missing = {
+            kbps: rendition_path(renditions_dir, track['id'], kbps)
+            for kbps in wanted_rungs(track, ladder)
+            if not rendition_path(renditions_dir, track['id'], kbps).exists()
+        }
+        if missing:
+            jobs.append((track, missing))
+        else:
+            complete += 1
+    return jobs, complete
+
+
+def fetch_source(s3_client, bucket: str, track: dict, scratch: Path) -> Path | None:
+    """Local original if it survives, else a downloaded copy of the uploaded audio."""
+    original = Path(track.get('original_path') or '')
+    if original.is_file():
+        return original
+    if s3_client is None or not track.get('s3_path'):
+        return None
+    target = scratch / f"{track['id']}{Path(track['s3_path']).suffix}"
+    s3_client.download_file(bucket, track['s3_path'], str(target))
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encode a bitrate ladder for every track')
+    parser.add_argument(
+        '--metadata-dir',
+        type=Path,
+        default=Path(__file__).parent.parent / 'metadata',
+        help='Directory containing metadata_base.json'
+    )
+    parser.add_argument('--workers', type=int, default=4, help='Encoder processes (default: 4)')
+    parser.add_argument('--ladder', type=int, nargs='+', default=list(LADDER),
+                        help=f"Bitrates in kbps (default: {' '.join(map(str, LADDER))})")
+    parser.add_argument('--limit', type=int, default=0, help='Only transcode the first N tracks (0 = all)')
+    parser.add_argument('--download', action='store_true',
+                        help='Download uploaded audio when the local original is gone')
+    parser.add_argument('--upload', action='store_true',
+                        help='Upload renditions and record them in metadata and the manifest')
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        print("Error: ffmpeg not found on PATH", file=sys.stderr)
+        return 1
+
+    import batch_upload
+
+    metadata = batch_upload.load_metadata(args.metadata_dir)
+    renditions_dir = args.metadata_dir / RENDITIONS_DIR
+    tracks = [t for t in metadata['tracks'].values() if t.get('uploaded') or Path(t.get('original_path') or '').is_file()]
+    jobs, complete = plan_jobs(tracks, renditions_dir, tuple(sorted(args.ladder)))
+    if args.limit > 0:
+        jobs = jobs[:args.limit]
+    print(f"Tracks: {len(jobs)} to transcode, {complete} complete")
+
+    s3_client = batch_upload.get_s3_client() if (args.download or args.upload) else None
+    failed = 0
+    done = 0
+
+    def collect(future, source: Path):
+        nonlocal failed, done
+        track_id, sizes, error = future.result()
+        if source.parent == scratch_dir:
+            source.unlink(missing_ok=True)  # downloaded copy
+        if error:
+            print(f"  Error transcoding {track_id}: {error}", file=sys.stderr)
+            failed += 1
+            return
+        done += 1
+        if done % 25 == 0:
+            print(f"  {done}/{len(jobs)} transcoded")
+
+    with tempfile.TemporaryDirectory(prefix='36247-transcode-') as scratch, \
+            ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # Sources are resolved (and downloaded) on the main thread while the
+        # pool encodes; the window bounds how many downloads sit on disk
+        scratch_dir = Path(scratch)
+        pending = deque()
+        for track, outputs in jobs:
+            source = fetch_source(s3_client if args.download else None,
+                                  batch_upload.TRACKS_BUCKET, track, scratch_dir)
+            if source is None:
+                print(f"  Skip {track['id']}: no local original (use --download)")
+                continue
+            pending.append((executor.submit(_transcode_worker, (track['id'], str(source), outputs)), source))
+            while len(pending) >= args.workers * 2:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+
+    print(f"Transcoded {done}, failed {failed}")
+
+    if args.upload:
+        upload_renditions(s3_client, args.metadata_dir, metadata, renditions_dir, tuple(sorted(args.ladder)))
+
+    return 0 if failed == 0 else 1
+
+
+def upload_renditions(s3_client, metadata_dir: Path, metadata: dict, renditions_dir: Path, ladder=LADDER):
+    """Upload new renditions and record {kbps: {path, size}} on each track."""
+    import batch_upload
+
+    uploaded = 0
+    source_bytes = 0
+    ladder_bytes = {kbps: 0 for kbps in ladder}
+    for track in metadata['tracks'].values():
+        renditions = dict(track.get('renditions') or {})
+        for kbps in ladder:
+            path = rendition_path(renditions_dir, track['id'], kbps)
+            if not path.exists():
+                continue
+            key = rendition_key(track['id'], kbps)
+            size = path.stat().st_size
+            if renditions.get(str(kbps)) != {'path': key, 'size': size}:
+                if not batch_upload.upload_file(s3_client, path, key, 'audio/mpeg'):
+                    continue
+                renditions[str(kbps)] = {'path': key, 'size': size}
+                uploaded += 1
+            ladder_bytes[kbps] += size
+        if renditions:
+            track['renditions'] = renditions
+            source_bytes += track.get('file_size') or 0
+
+    batch_upload.save_metadata(metadata_dir, metadata)
+    batch_upload.upload_manifest(s3_client, batch_upload.build_manifest(metadata), writer='transcode.py',
+                                 fields=('renditions',))
+    print(f"Uploaded {uploaded} rendition(s)")
+    for kbps, n in ladder_bytes.items():
+        if n:
+            print(f"  {kbps:>3} kbps: {n / (1024 * 1024):,.0f} MB"
+                  + (f" ({n / source_bytes:.0%} of originals)" if source_bytes else ''))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,11 @@
 36247 Audio Upload Tool
 
 Upload audio files to the 36247 tracks S3 bucket and update the manifest.
+
+With --stream, each file is read from disk once: the same chunks feed the
+hasher and a multipart upload to a temporary incoming/ key. Once the hash is
+known, the upload is either aborted (the track already exists) or completed
+and promoted to audio/<hash>.<ext> with a server-side copy.
 """
 
 import argparse
@@ -10,13 +15,19 @@ import hashlib
 import json
 import os
 import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-import boto3
-from mutagen import File as MutagenFile
-from mutagen.id3 import ID3
-from mutagen.mp3 import MP3
+import manifest_log
+from core import SUPPORTED_EXTENSIONS, compute_file_hash, get_client, get_content_type, lazy_import
+
+botocore_exceptions = lazy_import('botocore.exceptions')
+mutagen = lazy_import('mutagen')
+mutagen_id3 = lazy_import('mutagen.id3')
+mutagen_mp3 = lazy_import('mutagen.mp3')
 
 # Configuration
 AWS_PROFILE = os.environ.get('AWS_PROFILE', 'personal')
@@ -24,24 +35,17 @@ AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 TRACKS_BUCKET = os.environ.get('TRACKS_BUCKET', '36247-tracks.rmzi.world')
 MANIFEST_KEY = 'manifest.json'
 AUDIO_PREFIX = 'audio/'
+INCOMING_PREFIX = 'incoming/'
+CACHE_CONTROL = 'max-age=31536000'  # 1 year cache
 
-# Supported audio formats
-SUPPORTED_EXTENSIONS = {'.mp3', '.m4a', '.ogg', '.flac', '.wav'}
+# Streaming upload: part size (S3 minimum is 5 MB) and parts in flight
+STREAM_PART_SIZE = 16 * 1024 * 1024
+STREAM_MAX_IN_FLIGHT = 4
 
 
 def get_s3_client():
     """Get boto3 S3 client using the configured profile."""
-    session = boto3.Session(profile_name=AWS_PROFILE, region_name=AWS_REGION)
-    return session.client('s3')
-
-
-def compute_file_hash(filepath: Path) -> str:
-    """Compute SHA256 hash of file for unique naming."""
-    sha256 = hashlib.sha256()
-    with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            sha256.update(chunk)
-    return sha256.hexdigest()[:12]
+    return get_client('s3', AWS_PROFILE, AWS_REGION)
 
 
 def extract_metadata(filepath: Path) -> dict:
@@ -56,7 +60,7 @@ def extract_metadata(filepath: Path) -> dict:
     }
 
     try:
-        audio = MutagenFile(filepath)
+        audio = mutagen.File(filepath)
         if audio is None:
             return metadata
 
@@ -65,9 +69,9 @@ def extract_metadata(filepath: Path) -> dict:
             metadata['duration'] = int(audio.info.length)
 
         # Try to get ID3 tags (MP3)
-        if isinstance(audio, MP3) or filepath.suffix.lower() == '.mp3':
+        if isinstance(audio, mutagen_mp3.MP3) or filepath.suffix.lower() == '.mp3':
             try:
-                tags = ID3(filepath)
+                tags = mutagen_id3.ID3(filepath)
                 metadata['artist'] = str(tags.get('TPE1', [''])[0]) or None
                 metadata['album'] = str(tags.get('TALB', [''])[0]) or None
                 metadata['title'] = str(tags.get('TIT2', [''])[0]) or None
@@ -135,59 +139,137 @@ def extract_metadata(filepath: Path) -> dict:
 
 
 def get_manifest(s3_client) -> dict:
-    """Fetch current manifest from S3."""
+    """Fetch current manifest from S3, including deltas not yet compacted."""
     try:
-        response = s3_client.get_object(Bucket=TRACKS_BUCKET, Key=MANIFEST_KEY)
-        return json.loads(response['Body'].read().decode('utf-8'))
-    except s3_client.exceptions.NoSuchKey:
-        # Return empty manifest if doesn't exist
-        return {
-            'version': 1,
-            'generated': datetime.utcnow().isoformat() + 'Z',
-            'tracks': []
-        }
+        manifest, _, pending = manifest_log.load_manifest(s3_client, TRACKS_BUCKET)
+        if pending:
+            print(f"Manifest has {len(pending)} pending delta(s)")
+        return manifest
     except Exception as e:
         print(f"Warning: Could not fetch manifest: {e}", file=sys.stderr)
-        return {
-            'version': 1,
-            'generated': datetime.utcnow().isoformat() + 'Z',
-            'tracks': []
-        }
-
-
-def save_manifest(s3_client, manifest: dict):
-    """Save manifest to S3."""
-    manifest['generated'] = datetime.utcnow().isoformat() + 'Z'
-    body = json.dumps(manifest, indent=2)
-
-    s3_client.put_object(
-        Bucket=TRACKS_BUCKET,
-        Key=MANIFEST_KEY,
-        Body=body.encode('utf-8'),
-        ContentType='application/json'
-    )
+        return manifest_log.empty_manifest()
+
+
+def save_manifest(s3_client, new_tracks: list, sharded: bool = False, compact: bool = True):
+    """
+    Record new tracks as a manifest delta, then fold the log into manifest.json.
+
+    Appending a delta never overwrites another writer's changes. If the
+    compaction loses a race the delta simply waits for the next compaction.
+    """
+    ops = [{'op': 'add', 'track': track} for track in new_tracks]
+    seq = manifest_log.append_delta(s3_client, TRACKS_BUCKET, ops, writer='upload.py')
+    print(f"Wrote manifest delta {seq} ({len(ops)} track(s))")
+    if compact:
+        manifest_log.compact(s3_client, TRACKS_BUCKET, sharded=sharded)
+
+
+def object_exists(s3_client, key: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=TRACKS_BUCKET, Key=key)
+        return True
+    except botocore_exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
 
+def stream_upload(s3_client, filepath: Path, existing_ids: set) -> tuple:
+    """
+    Hash and upload a file in a single pass over its bytes.
 
-def get_content_type(filepath: Path) -> str:
-    """Get MIME type for audio file."""
+    Parts go to a temporary incoming/ key while the hash accumulates. When
+    the hash shows the track is already known (manifest or bucket), the
+    multipart upload is aborted and no object is ever created; otherwise it
+    is completed and copied server-side to audio/<hash>.<ext>.
+
+    Returns (file_hash, uploaded).
+    """
     ext = filepath.suffix.lower()
-    types = {
-        '.mp3': 'audio/mpeg',
-        '.m4a': 'audio/mp4',
-        '.ogg': 'audio/ogg',
-        '.flac': 'audio/flac',
-        '.wav': 'audio/wav'
-    }
-    return types.get(ext, 'application/octet-stream')
+    temp_key = f"{INCOMING_PREFIX}{uuid.uuid4().hex}{ext}"
+    sha256 = hashlib.sha256()
+    multipart = s3_client.create_multipart_upload(
+        Bucket=TRACKS_BUCKET, Key=temp_key,
+        ContentType=get_content_type(filepath), CacheControl=CACHE_CONTROL
+    )
+    upload_id = multipart['UploadId']
+    in_flight = threading.BoundedSemaphore(STREAM_MAX_IN_FLIGHT)
+    failed = threading.Event()
+
+    def send_part(number: int, chunk: bytes) -> dict:
+        try:
+            response = s3_client.upload_part(
+                Bucket=TRACKS_BUCKET, Key=temp_key, UploadId=upload_id,
+                PartNumber=number, Body=chunk
+            )
+            return {'PartNumber': number, 'ETag': response['ETag']}
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            in_flight.release()
+
+    try:
+        futures = []
+        with ThreadPoolExecutor(max_workers=STREAM_MAX_IN_FLIGHT) as executor, open(filepath, 'rb') as f:
+            # Stop reading at the first failed part; its error is raised
+            # below and the upload aborted. A zero-byte file still needs one
+            # (empty) part.
+            while not failed.is_set():
+                chunk = f.read(STREAM_PART_SIZE)
+                if not chunk and futures:
+                    break
+                sha256.update(chunk)
+                in_flight.acquire()  # bounds memory to STREAM_MAX_IN_FLIGHT parts
+                if failed.is_set():
+                    in_flight.release()
+                    break
+                futures.append(executor.submit(send_part, len(futures) + 1, chunk))
+            parts = [future.result() for future in futures]
+
+        file_hash = sha256.hexdigest()[:12]
+        final_key = f"{AUDIO_PREFIX}{file_hash}{ext}"
+        if file_hash in existing_ids or object_exists(s3_client, final_key):
+            s3_client.abort_multipart_upload(Bucket=TRACKS_BUCKET, Key=temp_key, UploadId=upload_id)
+            return file_hash, False
+
+        s3_client.complete_multipart_upload(
+            Bucket=TRACKS_BUCKET, Key=temp_key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except BaseException:
+        try:
+            s3_client.abort_multipart_upload(Bucket=TRACKS_BUCKET, Key=temp_key, UploadId=upload_id)
+        except Exception:
+            pass
+        raise
+
+    # Managed copy: switches to multipart copy for objects over 5 GB
+    s3_client.copy({'Bucket': TRACKS_BUCKET, 'Key': temp_key}, TRACKS_BUCKET, final_key)
+    s3_client.delete_object(Bucket=TRACKS_BUCKET, Key=temp_key)
+    return file_hash, True
 
 
-def upload_file(s3_client, filepath: Path, manifest: dict, dry_run: bool = False) -> bool:
+def upload_file(s3_client, filepath: Path, manifest: dict, dry_run: bool = False, stream: bool = False) -> bool:
     """Upload a single audio file to S3 and update manifest."""
-    # Compute file hash for unique ID
-    file_hash = compute_file_hash(filepath)
+    existing_ids = {t['id'] for t in manifest['tracks']}
+    streamed = stream and not dry_run
+
+    if streamed:
+        # Hash and upload in one read; the upload is aborted if the hash is known
+        print(f"Streaming {filepath.name}...")
+        try:
+            file_hash, uploaded = stream_upload(s3_client, filepath, existing_ids)
+        except Exception as e:
+            print(f"Error uploading {filepath.name}: {e}", file=sys.stderr)
+            return False
+        if not uploaded and file_hash not in existing_ids:
+            print(f"  Already in bucket as {file_hash}, adding to manifest")
+    else:
+        # Compute file hash for unique ID
+        file_hash = compute_file_hash(filepath)
 
     # Check if already in manifest
-    existing_ids = {t['id'] for t in manifest['tracks']}
     if file_hash in existing_ids:
         print(f"Skipping {filepath.name} (already uploaded as {file_hash})")
         return False
@@ -219,21 +301,22 @@ def upload_file(s3_client, filepath: Path, manifest: dict, dry_run: bool = False
         return True
 
     # Upload to S3
-    print(f"Uploading {filepath.name} -> {s3_key}...")
-
-    try:
-        s3_client.upload_file(
-            str(filepath),
-            TRACKS_BUCKET,
-            s3_key,
-            ExtraArgs={
-                'ContentType': get_content_type(filepath),
-                'CacheControl': 'max-age=31536000'  # 1 year cache
-            }
-        )
-    except Exception as e:
-        print(f"Error uploading {filepath.name}: {e}", file=sys.stderr)
-        return False
+    if not streamed:
+        print(f"Uploading {filepath.name} -> {s3_key}...")
+
+        try:
+            s3_client.upload_file(
+                str(filepath),
+                TRACKS_BUCKET,
+                s3_key,
+                ExtraArgs={
+                    'ContentType': get_content_type(filepath),
+                    'CacheControl': CACHE_CONTROL
+                }
+            )
+        except Exception as e:
+            print(f"Error uploading {filepath.name}: {e}", file=sys.stderr)
+            return False
 
     # Add to manifest
     manifest['tracks'].append(track)
@@ -258,6 +341,8 @@ def find_audio_files(path: Path) -> list:
 
 
 def main():
+    global TRACKS_BUCKET, AWS_PROFILE
+
     parser = argparse.ArgumentParser(
         description='Upload audio files to 36247 tracks bucket'
     )
@@ -272,6 +357,21 @@ def main():
         action='store_true',
         help='Show what would be uploaded without actually uploading'
     )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Read each file once: hash while uploading to a temporary key, then promote it'
+    )
+    parser.add_argument(
+        '--sharded',
+        action='store_true',
+        help='Also write a sharded manifest (only changed shards are uploaded)'
+    )
+    parser.add_argument(
+        '--no-compact',
+        action='store_true',
+        help='Only append a manifest delta; leave compaction to manifest_log.py'
+    )
     parser.add_argument(
         '--bucket',
         default=TRACKS_BUCKET,
@@ -286,7 +386,6 @@ def main():
     args = parser.parse_args()
 
     # Update globals from args
-    global TRACKS_BUCKET, AWS_PROFILE
     TRACKS_BUCKET = args.bucket
     AWS_PROFILE = args.profile
 
@@ -309,17 +408,18 @@ def main():
 
     # Get current manifest
     manifest = get_manifest(s3_client)
-    print(f"Current manifest has {len(manifest['tracks'])} track(s)")
+    existing_count = len(manifest['tracks'])
+    print(f"Current manifest has {existing_count} track(s)")
 
     # Upload files
     uploaded = 0
     for filepath in audio_files:
-        if upload_file(s3_client, filepath, manifest, args.dry_run):
+        if upload_file(s3_client, filepath, manifest, args.dry_run, args.stream):
             uploaded += 1
 
     # Save updated manifest
     if uploaded > 0 and not args.dry_run:
-        save_manifest(s3_client, manifest)
+        save_manifest(s3_client, manifest['tracks'][existing_count:], args.sharded, not args.no_compact)
         print(f"\nUploaded {uploaded} new track(s)")
         print(f"Manifest now has {len(manifest['tracks'])} total track(s)")
     elif args.dry_run and uploaded > 0:
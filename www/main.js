@@ -118,6 +118,7 @@
   let state = {
     mode: MODES.REGULAR,
     manifest: null,
+    searchIndex: null,
     tracks: [],
     filteredTracks: [],
     currentTrack: null,
@@ -534,6 +535,8 @@
         throw new Error('No tracks available.');
       }
 
+      loadSearchIndex();
+
       return true;
     } catch (e) {
       console.error('Manifest load error:', e);
@@ -541,6 +544,60 @@
     }
   }
 
+  // Prebuilt trigram index for track search (built by tools/search_index.py).
+  // Optional: if it's missing or stale, filterTracks falls back to a scan.
+  async function loadSearchIndex() {
+    try {
+      const response = await fetch('/search-index.json', {
+        credentials: isLocalhost() ? 'omit' : 'include'
+      });
+      if (!response.ok) return;
+
+      const index = await response.json();
+      if (index.version !== 1 ||
+          index.count !== state.tracks.length ||
+          index.generated !== state.manifest.generated) {
+        return;
+      }
+
+      const grams = new Map();
+      index.grams.forEach((gram, i) => grams.set(gram, index.postings[i]));
+      state.searchIndex = grams;
+    } catch (e) {
+      console.warn('Search index unavailable:', e);
+    }
+  }
+
+  function searchText(t) {
+    return `${t.artist || ''} ${t.album || ''} ${t.title || ''} ${t.year || ''}`.toLowerCase();
+  }
+
+  // Intersect trigram postings, then confirm the survivors with the same
+  // substring check as the scan so results are identical. Grams are code
+  // points, as in search_index.py, so astral characters (emoji) count once.
+  function searchWithIndex(query) {
+    const chars = Array.from(query);
+    let candidates = null;
+    for (let i = 0; i + 3 <= chars.length; i++) {
+      const deltas = state.searchIndex.get(chars.slice(i, i + 3).join(''));
+      if (!deltas) return [];
+
+      const positions = new Set();
+      let position = 0;
+      for (const delta of deltas) {
+        position += delta;
+        if (!candidates || candidates.has(position)) positions.add(position);
+      }
+      candidates = positions;
+      if (candidates.size === 0) return [];
+    }
+
+    return [...candidates]
+      .sort((a, b) => a - b)
+      .map(i => state.tracks[i])
+      .filter(t => searchText(t).includes(query));
+  }
+
   // Clickable metadata search (super/secret modes)
   function searchFor(query) {
     if (!query || !isSecretMode()) return;
@@ -585,10 +642,11 @@
     if (!state.searchQuery) {
       state.filteredTracks = [...state.tracks];
     } else {
-      state.filteredTracks = state.tracks.filter(t => {
-        const searchStr = `${t.artist || ''} ${t.album || ''} ${t.title || ''} ${t.year || ''}`.toLowerCase();
-        return searchStr.includes(state.searchQuery);
-      });
+      if (state.searchIndex && Array.from(state.searchQuery).length >= 3) {
+        state.filteredTracks = searchWithIndex(state.searchQuery);
+      } else {
+        state.filteredTracks = state.tracks.filter(t => searchText(t).includes(state.searchQuery));
+      }
       // Track search after 500ms of no typing
       clearTimeout(searchTrackTimeout);
       searchTrackTimeout = setTimeout(() => {
@@ -610,7 +668,8 @@
       const artist = track.artist || '???';
       const title = track.title || '???';
       const year = track.year || '';
-      const artworkSrc = track.artwork ? getMediaUrl(track.artwork) : '';
+      const thumb = track.artwork_thumb || track.artwork;
+      const artworkSrc = thumb ? getMediaUrl(thumb) : '';
       const thumbClass = artworkSrc ? '' : 'no-art';
 
       return `
@@ -674,7 +733,7 @@
     if (!elements.artworkContainer || !elements.artworkImage) return;
 
     if (track.artwork) {
-      elements.artworkImage.src = getMediaUrl(track.artwork);
+      elements.artworkImage.src = getMediaUrl(track.artwork_medium || track.artwork);
       elements.artworkImage.alt = `${track.artist || 'Unknown'} - ${track.album || 'Unknown'}`;
       elements.artworkContainer.classList.remove('no-art');
     } else {
@@ -723,7 +782,7 @@
     }
     updateBackButton();
 
-    const audioUrl = getMediaUrl(track.path);
+    const audioUrl = getMediaUrl(getAudioPath(track));
 
     try {
       elements.audio.src = audioUrl;
@@ -1054,6 +1113,33 @@
     return window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1';
   }
 
+  // Native HLS (Safari, iOS)
+  function canPlayHls() {
+    return elements.audio.canPlayType('application/vnd.apple.mpegurl') !== '';
+  }
+
+  // Pick the cheapest rendition that suits the connection; the original
+  // when there is no ladder (or for downloads)
+  function getAudioPath(track) {
+    const renditions = track.renditions;
+    const connection = navigator.connection || {};
+    const constrained = connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType);
+    // Segmented playback starts sooner and seeks without range requests,
+    // but where native HLS is missing (or data is tight) use a single file
+    if (track.hls && !(constrained && renditions) && canPlayHls()) return track.hls;
+    if (!renditions) return track.path;
+    let target = 160;
+    if (constrained) {
+      target = 96;
+    } else if (connection.downlink && connection.downlink >= 10) {
+      target = 320;
+    }
+    // Rungs are only made below the source bitrate, so a missing rung means
+    // the original is already at or below the target
+    const rung = renditions[target];
+    return rung ? rung.path : track.path;
+  }
+
   // Get media URL - on localhost, point to production for audio/artwork
   const PROD_URL = 'https://36247.rmzi.world';
   function getMediaUrl(path) {